@@ -0,0 +1,178 @@
+# --- アセットのメモリ計測とマップのパレット化 ---
+# 読み込んだ画像・音・派生データ (接触テーブルなど) の大きさを種類ごとに記録し、
+# F3 の表示と終了時の一覧 (--memory-report) に出す。
+# 登録は弱参照で持つので、解放されたサーフェス (前のシーンの背景など) は自然に消える。
+# 毎フレーム作り直す一時サーフェスは数が多いので、名前ごとの直近と最大の大きさだけを残す。
+#
+# マップは数色しか使っていないので、--palette-map では 8bit のパレット画像として持つ
+# (32bit の 1/4)。表示に使うのは画面に映る範囲だけで、blit のときに画面の形式に変換される。
+import os
+import weakref
+
+import numpy as np
+import pygame
+
+KINDS = ("map", "tables", "image", "screen", "sound", "cache")
+_CHUNK = 256      # パレット化で一度に処理する列の数 (一時配列の大きさを抑える)
+
+
+def surface_bytes(surface):
+  # サーフェスの画素が使うバイト数 (親と画素を共有する subsurface は 0)
+  if surface.get_parent() is not None:
+    return 0
+  return surface.get_pitch() * surface.get_height()
+
+
+def sound_bytes(sound):
+  # デコード済みの音のバイト数 (ミキサーの形式で展開されている)
+  mixer = pygame.mixer.get_init()
+  if mixer is None:
+    return 0
+  frequency, size, channels = mixer
+  return int(sound.get_length() * frequency) * channels * (abs(size) // 8)
+
+
+def process_rss():
+  # プロセスの常駐メモリ (バイト)。取れない環境 (Windows など) では None
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except (OSError, ValueError, AttributeError, IndexError):
+    return None
+
+
+def _mb(n):
+  return n / (1024 * 1024)
+
+
+class AssetRegistry:
+  def __init__(self):
+    self.entries = {}      # (種類, 名前) -> (弱参照, バイト数)
+    self.temporary = {}    # 名前 -> [直近のバイト数, 最大のバイト数]
+
+  def add(self, kind, name, asset, nbytes=None):
+    # asset を登録してそのまま返す (None なら何もしない)。nbytes を省くとサーフェス / 音から求める
+    if asset is None:
+      return None
+    if nbytes is None:
+      nbytes = sound_bytes(asset) if isinstance(asset, pygame.mixer.Sound) else surface_bytes(asset)
+    self.entries[(kind, name)] = (weakref.ref(asset), nbytes)
+    return asset
+
+  def note_temporary(self, name, surface):
+    # 毎フレーム作る一時サーフェスの大きさを記録する (描画の途中で呼ぶので軽くしておく)
+    nbytes = surface.get_pitch() * surface.get_height()
+    record = self.temporary.get(name)
+    if record is None:
+      self.temporary[name] = [nbytes, nbytes]
+    else:
+      record[0] = nbytes
+      if nbytes > record[1]:
+        record[1] = nbytes
+    return surface
+
+  def live(self):
+    # 解放されていないものだけ [(種類, 名前, バイト数)] (解放済みの登録は消す)
+    # (接触テーブルは裏のスレッドから登録されるので、辞書はコピーしてから見る)
+    entries = list(self.entries.items())
+    for key, (ref, _) in entries:
+      if ref() is None:
+        self.entries.pop(key, None)
+    return [(kind, name, nbytes) for (kind, name), (ref, nbytes) in entries if ref() is not None]
+
+  def totals(self):
+    result = dict.fromkeys(KINDS, 0)
+    for kind, _, nbytes in self.live():
+      result[kind] = result.get(kind, 0) + nbytes
+    return result
+
+  def readout(self):
+    # デバッグ表示用の2行
+    totals = self.totals()
+    parts = " ".join(f"{kind} {_mb(n):.1f}" for kind, n in totals.items() if n)
+    temp_peak = sum(peak for _, peak in self.temporary.values())
+    rss = process_rss()
+    rss_text = f" RSS {_mb(rss):.0f}MB" if rss is not None else ""
+    return [f"MEM {parts} MB",
+            f"MEM total {_mb(sum(totals.values())):.1f}MB temp peak {_mb(temp_peak):.1f}MB{rss_text}"]
+
+  def report(self):
+    totals = self.totals()
+    print(f"[INFO] Asset memory: {_mb(sum(totals.values())):.1f} MB")
+    entries = sorted(self.live(), key=lambda entry: (KINDS.index(entry[0])
+                                                     if entry[0] in KINDS else len(KINDS), -entry[2]))
+    for kind, name, nbytes in entries:
+      print(f"  {kind:<7} {_mb(nbytes):8.2f} MB  {name}")
+    if self.temporary:
+      print("[INFO] Per-frame surfaces (last / peak):")
+      for name, (last, peak) in sorted(self.temporary.items(), key=lambda item: -item[1][1]):
+        print(f"  {_mb(last):8.2f} / {_mb(peak):8.2f} MB  {name}")
+    rss = process_rss()
+    if rss is not None:
+      print(f"[INFO] Process RSS: {_mb(rss):.1f} MB")
+
+
+# --- マップのパレット化 ---
+def _packed_colors(surface, rect):
+  # rect の画素を 0xRRGGBB の uint32 の配列 [x, y] にまとめる (サーフェスはすぐに解放する)
+  rgb = pygame.surfarray.pixels3d(surface)
+  try:
+    part = rgb[rect.left:rect.right, rect.top:rect.bottom].astype(np.uint32)
+  finally:
+    del rgb
+  return (part[..., 0] << 16) | (part[..., 1] << 8) | part[..., 2]
+
+
+def _opaque(surface):
+  if not surface.get_flags() & pygame.SRCALPHA:
+    return True
+  alpha = pygame.surfarray.pixels_alpha(surface)
+  try:
+    return bool((alpha == 255).all())
+  finally:
+    del alpha
+
+
+def palettize(surface, max_colors=256):
+  # 不透明で max_colors 色以下の画像を、同じ見た目の 8bit パレット画像にする
+  # (変換できなければ理由を表示して None。色を減らして近づけることはしない)
+  if not _opaque(surface):
+    print("[WARNING] Palette map disabled: the map has transparent pixels")
+    return None
+  width, height = surface.get_size()
+  colors = np.zeros(0, dtype=np.uint32)
+  for x0 in range(0, width, _CHUNK):
+    colors = np.union1d(colors, np.unique(_packed_colors(surface, pygame.Rect(x0, 0, _CHUNK, height))))
+    if len(colors) > max_colors:
+      print(f"[WARNING] Palette map disabled: the map uses more than {max_colors} colors")
+      return None
+  result = pygame.Surface((width, height), 0, 8)
+  result.set_palette([((c >> 16) & 0xFF, (c >> 8) & 0xFF, c & 0xFF) for c in colors.tolist()])
+  indices = pygame.surfarray.pixels2d(result)
+  try:
+    for x0 in range(0, width, _CHUNK):
+      indices[x0:x0 + _CHUNK] = np.searchsorted(
+          colors, _packed_colors(surface, pygame.Rect(x0, 0, _CHUNK, height)))
+  finally:
+    del indices
+  return result
+
+
+def copy_to_palette(dest, pos, source, area):
+  # source (32bit) の area を 8bit の dest の pos へ写す。パレットにない色があれば写さずに False
+  rgb = np.array([tuple(color)[:3] for color in dest.get_palette()], dtype=np.uint32)
+  palette = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+  order = np.argsort(palette, kind="stable")
+  area = pygame.Rect(area)
+  packed = _packed_colors(source, area)
+  found = np.minimum(np.searchsorted(palette[order], packed), len(palette) - 1)
+  index = order[found]
+  if not (palette[index] == packed).all():
+    return False
+  x, y = pos
+  indices = pygame.surfarray.pixels2d(dest)
+  try:
+    indices[x:x + area.width, y:y + area.height] = index
+  finally:
+    del indices
+  return True
@@ -0,0 +1,214 @@
+# --- ミキサーの設定と音の遅延の計測 ---
+# キャリブレーション:
+#   python hisayoshi/audio.py [--probes 40]   (game.py --calibrate-audio でも同じ)
+# ミキサーのバッファが大きいほど Channel.play から音が出るまでが遅れ、
+# 小さすぎるとオーディオのコールバックが間に合わずに音が途切れる (アンダーラン)。
+# 設定の候補ごとにミキサーを開き直し、描画に相当する負荷をかけながら
+# 「ごく短い無音を play してから、コールバックがそれを消費し終えるまで」の時間を測って、
+# 遅れたコールバックのない一番小さいバッファを選んで audio_config.json に残す。
+# ゲーム中は AudioMonitor が同じ計測を裏のスレッドで続け、F3 に表示する。
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+import pygame
+
+import pacing
+
+AUDIO_CONFIG_PATH = "./hisayoshi/audio_config.json"
+DEFAULT_CONFIG = {"frequency": 44100, "size": -16, "channels": 2, "buffer": 512}
+CANDIDATE_FREQUENCIES = (48000, 44100)
+CANDIDATE_BUFFERS = (128, 256, 512, 1024, 2048)
+PROBE_CHANNEL = 4          # 計測用のチャンネル (0-3 はプレイヤーの効果音と風音)
+PROBE_FRAMES = 16          # 計測用の無音の長さ (サンプル数)
+PROBE_INTERVAL = 0.5       # ゲーム中に計測する間隔 (秒)
+LATE_SLACK_MS = 2.0        # 2バッファ分にこれを足した時間より遅ければアンダーランとみなす
+PROBE_TIMEOUT_PERIODS = 8  # 遅れの判定からさらにこのバッファ数だけ待っても空かなければ打ち切る
+
+
+def load_config(path=AUDIO_CONFIG_PATH):
+  # 保存した設定 (なければ DEFAULT_CONFIG)
+  config = dict(DEFAULT_CONFIG)
+  try:
+    with open(path, encoding="utf-8") as f:
+      saved = json.load(f)
+    config.update({key: int(saved[key]) for key in DEFAULT_CONFIG if key in saved})
+  except (OSError, ValueError, TypeError) as e:
+    if os.path.exists(path):
+      print(f"[WARNING] Ignored {path}: {e}")
+  return config
+
+
+def save_config(config, path=AUDIO_CONFIG_PATH):
+  try:
+    with open(path, "w", encoding="utf-8") as f:
+      json.dump(config, f, indent=1)
+  except OSError as e:
+    print(f"[WARNING] Failed to write audio config: {e}")
+
+
+def init_mixer(config):
+  # pre_init で設定を渡してからミキサーを開く (失敗したら pygame.error)
+  pygame.mixer.pre_init(config["frequency"], config["size"], config["channels"], config["buffer"])
+  pygame.mixer.init()
+  # 計測用とプレイヤー用のチャンネルは Sound.play() が勝手に使わないよう予約しておく
+  pygame.mixer.set_reserved(PROBE_CHANNEL + 1)
+
+
+def buffer_ms(config):
+  return config["buffer"] * 1000.0 / config["frequency"]
+
+
+def _probe_sound():
+  frequency, size, channels = pygame.mixer.get_init()
+  return pygame.mixer.Sound(buffer=bytes(PROBE_FRAMES * channels * (abs(size) // 8)))
+
+
+def _late_ms(config):
+  # これより遅ければアンダーラン (コールバックが2回続けて間に合わなかった)
+  return 2 * buffer_ms(config) + LATE_SLACK_MS
+
+
+def _measure(channel, sound, timeout_ms):
+  # 無音を play してからコールバックが消費し終える (チャンネルが空く) までの ms
+  # デバイスが止まって (抜かれた・一時停止) 消費されなければ timeout_ms で打ち切る
+  start = time.perf_counter()
+  deadline = start + timeout_ms / 1000
+  channel.play(sound)
+  while channel.get_busy():
+    if time.perf_counter() >= deadline:
+      channel.stop()
+      return timeout_ms
+    time.sleep(0.0002)
+  return (time.perf_counter() - start) * 1000
+
+
+class AudioMonitor:
+  # ゲーム中に一定間隔で play -> 消費の時間を測る (メインのスレッドは待たせない)
+  def __init__(self, config, interval=PROBE_INTERVAL):
+    self.config = config
+    self.interval = interval
+    self.period_ms = buffer_ms(config)
+    # ゲームのループと GIL を取り合うので、確認が切り替え間隔の分だけ遅れることがある
+    self.late_ms = _late_ms(config) + sys.getswitchinterval() * 1000
+    self.timeout_ms = self.late_ms + PROBE_TIMEOUT_PERIODS * self.period_ms
+    self.latency = pacing.Histogram(bin_ms=0.25, max_ms=200.0)
+    self.underruns = 0
+    self._stop = threading.Event()
+    self._thread = None
+
+  def start(self):
+    self._channel = pygame.mixer.Channel(PROBE_CHANNEL)
+    self._sound = _probe_sound()
+    self._thread = threading.Thread(target=self._run, name="audio-monitor", daemon=True)
+    self._thread.start()
+
+  def close(self):
+    if self._thread is not None:
+      self._stop.set()
+      self._thread.join()
+      self._thread = None
+
+  def _run(self):
+    # 毎回同じ位相で測らないよう、間隔を少しずらす
+    while not self._stop.wait(self.interval * random.uniform(0.8, 1.2)):
+      delay = _measure(self._channel, self._sound, self.timeout_ms)
+      self.latency.add(delay)
+      if delay > self.late_ms:     # 打ち切った分も数える
+        self.underruns += 1
+
+  def readout(self):
+    # デバッグ表示用の1行 (出力までの遅れは、消費までの時間 + デバイス側の1バッファ)
+    c = self.config
+    return (f"AUDIO {c['frequency']}Hz x{c['channels']} buf {c['buffer']} ({self.period_ms:.1f}ms) "
+            f"play->mix p50 {self.latency.percentile(50):.1f} p95 {self.latency.percentile(95):.1f}ms "
+            f"underrun {self.underruns}")
+
+
+# --- キャリブレーション ---
+def _load_worker(stop):
+  # 描画に相当する負荷 (pygame の変換は GIL を離すので計測のスレッドは止めない)
+  source = pygame.Surface((1280, 720))
+  target = pygame.Surface((960, 540))
+  while not stop.is_set():
+    pygame.transform.smoothscale(source, target.get_size(), target)
+
+
+def measure_config(config, probes):
+  # config でミキサーを開き、負荷をかけながら probes 回測る ({p50, p95, underruns})
+  # (デバイスが開けなければ pygame.error、別の周波数で開いたら None)
+  if probes < 1:
+    raise ValueError(f"probes must be at least 1 (got {probes})")
+  pygame.mixer.quit()
+  init_mixer(config)
+  if pygame.mixer.get_init()[0] != config["frequency"]:
+    return None     # デバイスが別の周波数で開いた (その周波数の候補で測る)
+  late = _late_ms(config)
+  timeout = late + PROBE_TIMEOUT_PERIODS * buffer_ms(config)
+  channel = pygame.mixer.Channel(PROBE_CHANNEL)
+  sound = _probe_sound()
+  stop = threading.Event()
+  load = threading.Thread(target=_load_worker, args=(stop,), daemon=True)
+  load.start()
+  delays = []
+  try:
+    for _ in range(probes):
+      time.sleep(random.uniform(0.005, 0.025))
+      delays.append(_measure(channel, sound, timeout))
+  finally:
+    stop.set()
+    load.join()
+    pygame.mixer.quit()
+  delays.sort()
+  return {"p50": delays[len(delays) // 2], "p95": delays[int(len(delays) * 0.95) - 1],
+          "underruns": sum(1 for d in delays if d > late)}
+
+
+def calibrate(probes=40, path=AUDIO_CONFIG_PATH):
+  # 候補を順に測り、アンダーランのない一番短いバッファの設定を保存して返す
+  print(f"[INFO] Audio calibration ({probes} probes per setting, "
+        f"driver {os.environ.get('SDL_AUDIODRIVER', 'default')})")
+  print(f"{'Hz':>6} {'buffer':>6} {'ms':>6} {'p50':>6} {'p95':>6} {'underrun':>8}")
+  best = None
+  for frequency in CANDIDATE_FREQUENCIES:
+    for size in CANDIDATE_BUFFERS:
+      config = dict(DEFAULT_CONFIG, frequency=frequency, buffer=size)
+      try:
+        result = measure_config(config, probes)
+      except (pygame.error, ValueError) as e:
+        print(f"[WARNING] Audio calibration stopped: {e}")
+        return dict(DEFAULT_CONFIG)
+      if result is None:
+        continue
+      print(f"{frequency:>6} {size:>6} {buffer_ms(config):>6.1f} {result['p50']:>6.1f} "
+            f"{result['p95']:>6.1f} {result['underruns']:>8}")
+      if result["underruns"] == 0:
+        # 周波数どうしはバッファの時間の短い方 (同じなら測った遅延の小さい方)
+        rank = (buffer_ms(config), result["p95"])
+        if best is None or rank < best[1]:
+          best = (config, rank)
+        break     # この周波数ではこれより大きいバッファは遅くなるだけ
+  if best is None:
+    print("[WARNING] No mixer setting ran without underruns, keeping the default settings")
+    return dict(DEFAULT_CONFIG)
+  config = best[0]
+  save_config(config, path)
+  print(f"[INFO] Saved {path}: {config['frequency']}Hz buffer {config['buffer']} "
+        f"(play->mix p95 {best[1][1]:.1f} ms)")
+  return config
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Pick mixer settings with the lowest latency")
+  parser.add_argument("--probes", type=int, default=40)
+  parser.add_argument("--out", default=AUDIO_CONFIG_PATH)
+  args = parser.parse_args()
+  if args.probes < 1:
+    parser.error("--probes must be at least 1")
+  pygame.display.init()     # smoothscale などの負荷用 (画面は作らない)
+  calibrate(args.probes, args.out)
+  sys.exit()
@@ -0,0 +1,161 @@
+# --- CPU プレイヤー ---
+# navgraph.py で事前計算したグラフ上を A* で探索し、
+# 毎フレーム control_map 互換のキー状態を作って Player.update に渡す。
+import time
+
+import env
+import navgraph
+
+PLAN_BUDGET_S = 0.0008    # 1フレームあたりの探索時間の上限
+ALIGN_TOLERANCE = 1.5     # 離陸点との位置ずれの許容量 (px)
+STOP_SPEED = 0.4          # 離陸してよい水平速度の上限
+GROUND_DECEL = 0.375      # Player.update の地上での加減速
+STUCK_FRAMES = 240        # 同じエッジでこれ以上かかったら諦めて再計画
+
+
+class BotKeys:
+  # pygame.key.get_pressed() の代わりに Player.update に渡すキー状態
+  def __init__(self, control_map):
+    self.control_map = control_map
+    self.pressed = set()
+
+  def set_action(self, action):
+    # env.ACTIONS の行動コードからキー状態を作る
+    left, right, jump = env.ACTIONS[action]
+    self.pressed.clear()
+    if left:
+      self.pressed.add(self.control_map['left'])
+    if right:
+      self.pressed.add(self.control_map['right'])
+    if jump:
+      self.pressed.add(self.control_map['jump'])
+
+  def __getitem__(self, key):
+    return key in self.pressed
+
+
+class BotController:
+  def __init__(self, graph, control_map):
+    self.graph = graph
+    self.keys = BotKeys(control_map)
+    self.path = []          # これから通るエッジ番号の列
+    self.search = None      # 進行中の AStarSearch
+    self.banned = set()     # 失敗したエッジ (次の探索で使わない)
+    self.script = None      # 実行中のエッジの行動列
+    self.script_pos = 0
+    self.script_edge = None
+    self.edge_frames = 0
+    self.last_plan_ms = 0.0
+    self.replans = 0
+
+  def update(self, player):
+    # 今フレームのキー状態を返す (Player.update の直前に呼ぶ)
+    self.last_plan_ms = 0.0
+    self.keys.set_action(self._decide(player))
+    return self.keys
+
+  def _decide(self, player):
+    if player.is_goal:
+      return navgraph.ACT_NONE
+
+    # 記録済みの行動列を再生中
+    if self.script is not None:
+      if self.script_pos < len(self.script):
+        action = self.script[self.script_pos]
+        self.script_pos += 1
+        return action
+      self._finish_script(player)
+
+    if not player.on_ground:
+      return navgraph.ACT_NONE
+
+    node = self.graph.locate(player.x, player.y)
+    if node is None:
+      return navgraph.ACT_NONE
+    if node in self.graph.targets:
+      return navgraph.ACT_NONE
+
+    if not self._follow_path(node):
+      if not self._plan(node):
+        return navgraph.ACT_NONE
+      if not self.path:
+        return navgraph.ACT_NONE
+
+    edge_index = self.path[0]
+    src, dst, kind, start_x, _, actions = self.graph.edges[edge_index]
+    self.edge_frames += 1
+    if self.edge_frames > STUCK_FRAMES:
+      # 位置合わせが終わらない: このエッジを避けて再計画
+      self.banned.add(edge_index)
+      self._reset_path()
+      return navgraph.ACT_NONE
+
+    if kind == 'walk':
+      _, x0, x1 = self.graph.nodes[dst]
+      return self._walk_to(player, (x0 + x1) / 2, stop=False)
+
+    action = self._walk_to(player, start_x, stop=True)
+    if action is not None:
+      return action
+    # 離陸点に着いたので行動列の再生を開始
+    self.script = [act for act, count in actions for _ in range(count)]
+    self.script_pos = 1
+    self.script_edge = edge_index
+    return self.script[0]
+
+  def _walk_to(self, player, target_x, stop):
+    # target_x へ歩く。止まって位置が合ったら None
+    dx = target_x - player.x
+    brake = player.vx * player.vx / (2 * GROUND_DECEL) if stop else 0.0
+    if dx > max(ALIGN_TOLERANCE, brake if player.vx > 0 else 0.0):
+      return navgraph.ACT_RIGHT
+    if dx < -max(ALIGN_TOLERANCE, brake if player.vx < 0 else 0.0):
+      return navgraph.ACT_LEFT
+    if stop and abs(player.vx) <= STOP_SPEED and abs(dx) <= ALIGN_TOLERANCE:
+      return None
+    return navgraph.ACT_NONE
+
+  def _finish_script(self, player):
+    # 行動列の再生が終わった: 予定のノードに着いたか確認する
+    edge_index = self.script_edge
+    self.script = None
+    self.script_edge = None
+    dst = self.graph.edges[edge_index][1]
+    node = self.graph.locate(player.x, player.y) if player.on_ground else None
+    if self.path and self.path[0] == edge_index and node == dst:
+      self.path.pop(0)
+      self.edge_frames = 0
+    elif node is not None and node != dst:
+      # 経路から外れた (次の _follow_path で再計画される)
+      self.edge_frames = 0
+
+  def _follow_path(self, node):
+    # 現在ノードが経路上にあれば経路を進め True、外れていれば False
+    if self.search is not None:
+      return False
+    for i, edge_index in enumerate(self.path):
+      if self.graph.edges[edge_index][0] == node:
+        if i:
+          self.path = self.path[i:]
+          self.edge_frames = 0
+        return True
+    return False
+
+  def _plan(self, node):
+    # 現在ノードから A* で再計画する (予算内に終わらなければ次フレームで続行)
+    start = time.perf_counter()
+    if self.search is None or self.search.start != node:
+      self.search = navgraph.AStarSearch(self.graph, node, self.banned)
+      self.replans += 1
+    done = self.search.run(PLAN_BUDGET_S)
+    if done:
+      self.path = self.search.path
+      self.search = None
+      self.edge_frames = 0
+    self.last_plan_ms = (time.perf_counter() - start) * 1000
+    return done
+
+  def _reset_path(self):
+    self.path = []
+    self.search = None
+    self.edge_frames = 0
@@ -0,0 +1,263 @@
+# --- プレイ動画のキャプチャ (ゴールの瞬間を残す) ---
+# ゲームのプロセスは表示した画面を縮小して共有メモリ上のスロットに書き込むだけで、
+# PNG への変換と保存は別プロセスが行う。
+# スロットは「空き / 書き込み済み」の状態を持つリングで、
+# ゲーム側は空きスロットにしか書かず、ワーカーは書き込み済みのスロットを読んで空きに戻す。
+# ワーカーが追いつかずに空きがなければ、そのフレームは捨てる (ゲームは待たない)。
+# ワーカーは直近 CLIP_SECONDS 秒分の PNG を手元に持っておき、
+# 保存の指示 (save_clip) が来たらそれを zip にまとめて書き出す。
+import os
+import io
+import json
+import time
+import zlib
+import struct
+import zipfile
+import collections
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+import pygame
+
+CAPTURE_DIR = "./hisayoshi/captures"
+CAPTURE_SCALE = 0.5      # 画面に対する縮小率
+CAPTURE_FPS = 20         # 取り込む頻度 (表示のフレームレートとは別)
+CLIP_SECONDS = 10.0      # 保存する長さ
+RING_SLOTS = 8           # 共有メモリ上のフレームのスロット数
+PNG_LEVEL = 1            # PNG の圧縮レベル (速さ優先)
+
+SLOT_FREE = 0
+SLOT_FULL = 1
+
+
+def _png_chunk(kind, data):
+  return (struct.pack('>I', len(data)) + kind + data +
+          struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+def encode_png(rgb, level=PNG_LEVEL):
+  # (高さ, 幅, 3) の uint8 配列を PNG にする (各行のフィルタは「なし」)
+  height, width, _ = rgb.shape
+  raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+  raw[:, 1:] = rgb.reshape(height, width * 3)
+  header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+  return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) +
+          _png_chunk(b'IDAT', zlib.compress(raw.tobytes(), level)) + _png_chunk(b'IEND', b''))
+
+
+class _Ring:
+  # 共有メモリの並び: スロットの状態 (int64 × slots) + フレーム番号 (int64 × slots) + 画素
+  def __init__(self, slots, height, pitch, name=None):
+    self.slots = slots
+    self.height = height
+    self.pitch = pitch
+    header = 2 * slots * 8
+    size = header + slots * height * pitch
+    if name is None:
+      self.shm = shared_memory.SharedMemory(create=True, size=size)
+      self.owner = True
+    else:
+      self.shm = shared_memory.SharedMemory(name=name)
+      self.owner = False
+    self.states = np.ndarray((slots,), dtype=np.int64, buffer=self.shm.buf)
+    self.frames = np.ndarray((slots,), dtype=np.int64, buffer=self.shm.buf, offset=slots * 8)
+    self.pixels = np.ndarray((slots, height, pitch), dtype=np.uint8, buffer=self.shm.buf,
+                             offset=header)
+    if self.owner:
+      self.states[:] = SLOT_FREE
+
+  def close(self):
+    self.states = self.frames = self.pixels = None
+    self.shm.close()
+    if self.owner:
+      self.shm.unlink()
+
+
+def _capture_worker(conn, ring_spec, layout, fps, seconds, directory):
+  # 書き込み済みのスロットを PNG にして直近の分だけ持っておき、指示されたら zip に書き出す
+  ring = _Ring(*ring_spec)
+  width, bytesize, channels = layout
+  history = collections.deque(maxlen=max(1, int(seconds * fps)))
+  index = 0
+
+  def take_ready():
+    # 書き込み済みのスロットを順に PNG にして空きに戻す
+    nonlocal index
+    while ring.states[index % ring.slots] == SLOT_FULL:
+      slot = index % ring.slots
+      pixels = ring.pixels[slot, :, :width * bytesize].reshape(ring.height, width, bytesize)
+      rgb = pixels[..., channels]     # 画面の画素形式から R, G, B の順に並べ替える
+      history.append((int(ring.frames[slot]), encode_png(rgb)))
+      ring.states[slot] = SLOT_FREE
+      index += 1
+      if conn.poll():
+        return
+
+  try:
+    while True:
+      if conn.poll(0.005):
+        command, arg = conn.recv()
+        if command == "stop":
+          break
+        if command == "save":
+          take_ready()     # 指示の時点までに届いていたフレームも入れる
+          try:
+            path = _write_clip(directory, arg, list(history), fps)
+          except OSError as e:
+            # 書けなくても (ディスクが一杯など) 取り込みは続け、次のゴールで試す
+            print(f"[WARNING] Failed to save clip: {e}")
+            path = None
+          conn.send(("saved", path))
+      take_ready()
+  finally:
+    ring.close()
+    conn.close()
+
+
+def _write_clip(directory, label, frames, fps):
+  if not frames:
+    return None
+  os.makedirs(directory, exist_ok=True)
+  path = os.path.join(directory, f"{time.strftime('%Y%m%d_%H%M%S')}_{label}.zip")
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+    archive.writestr("clip.json", json.dumps({"fps": fps, "frames": len(frames),
+                                              "first_frame": frames[0][0]}))
+    for number, (_, png) in enumerate(frames):
+      archive.writestr(f"frame_{number:05d}.png", png)
+  with open(path + ".tmp", "wb") as f:
+    f.write(buffer.getvalue())
+  os.replace(path + ".tmp", path)
+  return path
+
+
+class FrameCapture:
+  def __init__(self, scale=CAPTURE_SCALE, fps=CAPTURE_FPS, seconds=CLIP_SECONDS,
+               slots=RING_SLOTS, directory=CAPTURE_DIR):
+    self.scale = scale
+    self.fps = fps
+    self.seconds = seconds
+    self.slot_count = slots
+    self.directory = directory
+    self.ring = None
+    self.small = None
+    self.proc = None
+    self.conn = None
+    self.write_index = 0
+    self.frame = 0
+    self.captured = 0
+    self.dropped = 0
+    self.clips = []
+    self.saving = 0      # 書き出しを頼んでまだ終わっていないクリップの数
+    self._next_time = 0.0
+
+  def start(self, surface):
+    # 画面と同じ画素形式の縮小用 Surface を作り、その1行の長さでスロットを確保する
+    width = max(1, int(surface.get_width() * self.scale))
+    height = max(1, int(surface.get_height() * self.scale))
+    self.small = pygame.Surface((width, height), 0, surface)
+    bytesize = self.small.get_bytesize()
+    if bytesize not in (3, 4):
+      print(f"[WARNING] Capture disabled: unsupported pixel format ({bytesize} bytes/pixel)")
+      self.small = None
+      return False
+    channels = [shift // 8 for shift in self.small.get_shifts()[:3]]
+    self.ring = _Ring(self.slot_count, height, self.small.get_pitch())
+
+    # game.py は import しても初期化されないので spawn で起動する (SDL を fork しない)
+    context = mp.get_context("spawn")
+    self.conn, child_conn = context.Pipe()
+    ring_spec = (self.slot_count, height, self.small.get_pitch(), self.ring.shm.name)
+    self.proc = context.Process(target=_capture_worker, daemon=True,
+                                args=(child_conn, ring_spec, (width, bytesize, channels),
+                                      self.fps, self.seconds, self.directory))
+    self.proc.start()
+    child_conn.close()
+    print(f"[INFO] Capture: {width}x{height} at {self.fps} fps, keeping {self.seconds:.0f}s")
+    return True
+
+  def capture(self, surface):
+    # 表示した直後の画面を取り込む (空きスロットがなければ捨てる)
+    if self.ring is None:
+      return
+    if self.saving:
+      self.poll()
+    now = time.perf_counter()
+    if now < self._next_time:
+      return
+    self._next_time = max(self._next_time + 1.0 / self.fps, now)
+    self.frame += 1
+    slot = self.write_index % self.slot_count
+    if self.ring.states[slot] != SLOT_FREE:
+      self.dropped += 1
+      return
+    pygame.transform.scale(surface, self.small.get_size(), self.small)
+    self.ring.pixels[slot] = np.frombuffer(self.small.get_buffer(), dtype=np.uint8).reshape(
+        self.ring.height, self.ring.pitch)
+    self.ring.frames[slot] = self.frame
+    self.ring.states[slot] = SLOT_FULL     # 画素を書き終えてからワーカーに渡す
+    self.write_index += 1
+    self.captured += 1
+
+  def save_clip(self, label="clip"):
+    # 直近 seconds 秒を保存するようワーカーに頼む (書き出しの完了は待たない)
+    if self.proc is None:
+      return
+    try:
+      self.conn.send(("save", label))
+    except (BrokenPipeError, OSError) as e:
+      self._worker_lost(e)
+      return
+    self.saving += 1
+
+  def poll(self):
+    # ワーカーからの保存完了の知らせを受け取る
+    if self.conn is not None and not self._receive():
+      self._worker_lost("the capture worker exited")
+
+  def _receive(self):
+    # 届いている知らせを全部受け取る (ワーカーが終わってパイプが閉じていたら False)
+    while self.conn.poll():
+      try:
+        _, path = self.conn.recv()
+      except EOFError:
+        return False
+      self.saving -= 1
+      if path:
+        self.clips.append(path)
+        print(f"[INFO] Saved clip {path}")
+    return True
+
+  def _worker_lost(self, reason):
+    # ワーカーが落ちていたら取り込みをやめる (ゲームはそのまま続ける)
+    print(f"[WARNING] Capture disabled: {reason}")
+    self.conn.close()
+    self.proc.join(timeout=1)
+    self.proc = self.conn = None
+    self.saving = 0
+    if self.ring is not None:
+      self.ring.close()
+      self.ring = None
+
+  def readout(self):
+    pending = int(np.count_nonzero(self.ring.states == SLOT_FULL)) if self.ring is not None else 0
+    return f"CAP {self.fps}fps q {pending}/{self.slot_count} drop {self.dropped}"
+
+  def close(self):
+    if self.proc is not None:
+      try:
+        self.conn.send(("stop", None))
+      except (BrokenPipeError, OSError):
+        pass
+      # 保存中のクリップがあれば書き終わるまで待つ
+      self.proc.join(timeout=10)
+      self._receive()
+      self.conn.close()
+      self.proc = self.conn = None
+    if self.ring is not None:
+      self.ring.close()
+      self.ring = None
+    if self.captured or self.dropped:
+      print(f"[INFO] Capture: {self.captured} frames, {self.dropped} dropped, "
+            f"{len(self.clips)} clip(s)")
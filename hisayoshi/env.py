@@ -0,0 +1,416 @@
+# --- 学習・評価用の環境 (Gym 風 reset/step API) ---
+# 使い方 (リポジトリのルートで実行):
+#   python hisayoshi/env.py --bench            # 並列数ごとのステップ/秒を計測
+#   python hisayoshi/env.py --render --steps 600  # ランダム行動を画面に表示
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import tilemap
+
+# 離散行動: (左, 右, ジャンプ) のキー状態
+ACTIONS = (
+    (False, False, False),  # 0: 何もしない
+    (True, False, False),   # 1: 左
+    (False, True, False),   # 2: 右
+    (False, False, True),   # 3: ジャンプ
+    (True, False, True),    # 4: 左 + ジャンプ
+    (False, True, True),    # 5: 右 + ジャンプ
+)
+# ACTIONS のタプルを keys として Player.update に渡すための control_map
+ACTION_CONTROL_MAP = {'left': 0, 'right': 1, 'jump': 2}
+
+# 観測ベクトルの構成: [x, y, vx, vy, on_ground] + 周辺のタイルパッチ
+STATE_SIZE = 5
+PATCH_RADIUS = 48     # プレイヤー中心から上下左右に見る範囲 (px)
+PATCH_STRIDE = 4      # パッチの1セルが何 px 四方か (セル内の最大値を取る)
+
+_game_module = None
+_sim_player_class = None
+
+
+def load_game(headless=True):
+    # game.py を読み込む (ヘッドレス時はダミードライバで画面と音を出さない)
+    # import だけでは何も初期化されないので、必要な部分は呼び出し側で初期化する
+  global _game_module
+  if _game_module is None:
+    if headless:
+      os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+      os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import game
+    _game_module = game
+  return _game_module
+
+
+def load_grid():
+    # マップ画像を読み込んでタイル配列にする (画面・音は初期化しない)
+  game = load_game()
+  map_image = game.load_map()
+  if map_image is None:
+    raise FileNotFoundError(f"{game.IMAGE_PATH}/map_highres.png")
+  return tilemap.build_tile_grid(map_image)
+
+
+def init_rendering():
+    # render() 用に画面・フォント・画像を初期化する (2回目以降は何もしない)
+  game = load_game()
+  if game.screen is None:
+    game.init_display()
+    game.init_fonts()
+    if not game.init_images():
+      raise FileNotFoundError(f"{game.IMAGE_PATH}/map_highres.png")
+  return game
+
+
+def sim_player_class():
+    # 衝突判定をタイル配列で行い、効果音を鳴らさない Player の派生クラス
+  global _sim_player_class
+  if _sim_player_class is None:
+    game = load_game()
+
+    class SimPlayer(game.Player):
+      def __init__(self, grid, start_x, image_right=None, image_left=None):
+        super().__init__(1, image_right, image_left, start_x, None, None)
+        self.grid = grid
+        # Player.update のマップ端の判定用 (マップ画像を読まないプロセスでも動くように)
+        game.set_map_size(grid.shape[1], grid.shape[0])
+
+      def play_sound(self, sound):
+        pass
+
+      def play_voice(self, name):
+        pass
+
+      def check_collision(self, x, y):
+        return tilemap.grid_collision(self.grid, x, y, self.width, self.height)
+
+      def check_special_jump(self):
+        return tilemap.grid_special_jump(self.grid, self.x, self.y,
+                                         self.width, self.height)
+
+    _sim_player_class = SimPlayer
+  return _sim_player_class
+
+
+def observation_size(patch_radius=PATCH_RADIUS, patch_stride=PATCH_STRIDE):
+  patch_side = (2 * patch_radius) // patch_stride
+  return STATE_SIZE + patch_side * patch_side
+
+
+# --- 単体環境 ---
+class ClimbEnv:
+  def __init__(self, grid=None, start_x=2800.0, start_jitter=0.0, max_steps=None,
+               render_mode=None, patch_radius=PATCH_RADIUS, patch_stride=PATCH_STRIDE):
+    # render_mode: None (描画なし) / "human" (ウィンドウ) / "rgb_array"
+    self.render_mode = render_mode
+    self.game = load_game(headless=render_mode != "human")
+    if render_mode is not None:
+      init_rendering()
+    if grid is None:
+      grid = load_grid()
+    self.grid = grid
+    self.start_x = start_x
+    self.start_jitter = start_jitter
+    self.max_steps = max_steps or self.game.TIME_LIMIT * self.game.FPS
+    self.patch_radius = patch_radius
+    self.patch_stride = patch_stride
+    self.patch_side = (2 * patch_radius) // patch_stride
+    self.observation_size = observation_size(patch_radius, patch_stride)
+    self.action_count = len(ACTIONS)
+    self.rng = np.random.default_rng()
+    self._window = np.empty((self.patch_side * patch_stride,) * 2, dtype=np.uint8)
+
+    self.player = None
+    self.camera = None
+    self.steps = 0
+    self.best_y = 0.0
+
+  def reset(self, seed=None, out=None):
+    # 新しいエピソードを開始して (観測, info) を返す
+    if seed is not None:
+      self.rng = np.random.default_rng(seed)
+    start_x = self.start_x
+    if self.start_jitter:
+      start_x += float(self.rng.uniform(-self.start_jitter, self.start_jitter))
+
+    images = ()
+    if self.render_mode is not None:
+      images = (self.game.image_right, self.game.image_left)
+    self.player = sim_player_class()(self.grid, start_x, *images)
+    self.camera = None
+    self.steps = 0
+    self.best_y = self.player.y
+    return self._observe(out), self._info()
+
+  def step(self, action, out=None):
+    # 1フレーム進めて (観測, 報酬, 終了, 打ち切り, info) を返す
+    self.player.update(ACTIONS[int(action)], ACTION_CONTROL_MAP)
+    self.steps += 1
+
+    # 報酬: 最高到達点の更新分 (px)
+    reward = max(0.0, self.player.y - self.best_y)
+    self.best_y = max(self.best_y, self.player.y)
+
+    terminated = self.player.is_goal
+    truncated = not terminated and self.steps >= self.max_steps
+    return self._observe(out), reward, terminated, truncated, self._info()
+
+  def _info(self):
+    return {"y": self.player.y, "best_y": self.best_y,
+            "goal": self.player.is_goal, "steps": self.steps}
+
+  def _observe(self, out=None):
+    # 観測ベクトルを out (なければ新規配列) に書き込む
+    if out is None:
+      out = np.empty(self.observation_size, dtype=np.float32)
+    p = self.player
+    out[0] = p.x
+    out[1] = p.y
+    out[2] = p.vx
+    out[3] = p.vy
+    out[4] = 1.0 if p.on_ground else 0.0
+    out[STATE_SIZE:] = self._collision_patch().ravel()
+    return out
+
+  def _collision_patch(self):
+    # プレイヤー中心の周辺タイルを stride 四方ごとに最大値で縮約する
+    # (マップ外は壁扱い。細いジャンプ台も取りこぼさない)
+    grid = self.grid
+    map_h, map_w = grid.shape
+    size = self._window.shape[0]
+    left = int(self.player.x + self.player.width / 2) - self.patch_radius
+    bottom = int(self.player.y + self.player.height / 2) - self.patch_radius
+
+    window = self._window
+    window.fill(tilemap.TILE_SOLID)
+    src_x0, src_y0 = max(left, 0), max(bottom, 0)
+    src_x1, src_y1 = min(left + size, map_w), min(bottom + size, map_h)
+    if src_x0 < src_x1 and src_y0 < src_y1:
+      window[src_y0 - bottom:src_y1 - bottom, src_x0 - left:src_x1 - left] = \
+          grid[src_y0:src_y1, src_x0:src_x1]
+
+    s = self.patch_stride
+    n = self.patch_side
+    return window.reshape(n, s, n, s).max(axis=(1, 3))
+
+  def render(self):
+    # render_mode に応じて描画 (None のときは何もしない)
+    if self.render_mode is None:
+      return None
+    game = self.game
+    if self.camera is None:
+      self.camera = game.Camera(game.CAMERA_WIDTH_1P, game.CAMERA_HEIGHT)
+    self.camera.update(self.player, 0.15, 1.0)
+    game.draw_game_view(game.screen, self.player, self.camera, game.CAMERA_WIDTH_1P,
+                        game.CAMERA_HEIGHT, 1.0, None, game.font)
+    if self.render_mode == "human":
+      game.pygame.event.pump()
+      game.pygame.display.flip()
+      return None
+    return game.pygame.surfarray.array3d(game.screen).swapaxes(0, 1)
+
+
+# --- 共有メモリ上の配列 ---
+class _SharedArray:
+  def __init__(self, shape, dtype, name=None):
+    self.shape = tuple(shape)
+    self.dtype = np.dtype(dtype)
+    nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+    if name is None:
+      self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+      self.owner = True
+    else:
+      self.shm = shared_memory.SharedMemory(name=name)
+      self.owner = False
+    self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+  def spec(self):
+    return (self.shape, self.dtype.str, self.shm.name)
+
+  @classmethod
+  def attach(cls, spec):
+    shape, dtype, name = spec
+    return cls(shape, dtype, name)
+
+  def close(self):
+    self.array = None
+    self.shm.close()
+    if self.owner:
+      self.shm.unlink()
+
+
+def _vector_worker(conn, specs, lo, hi, env_kwargs):
+    # 担当範囲 [lo, hi) の環境を進めるワーカープロセス
+  shared = {key: _SharedArray.attach(spec) for key, spec in specs.items()}
+  grid = shared["grid"].array
+  obs = shared["obs"].array
+  rewards = shared["rewards"].array
+  terminated = shared["terminated"].array
+  truncated = shared["truncated"].array
+  actions = shared["actions"].array
+
+  envs = [ClimbEnv(grid=grid, **env_kwargs) for _ in range(lo, hi)]
+  try:
+    while True:
+      command, arg = conn.recv()
+      if command == "reset":
+        for i, env in enumerate(envs, lo):
+          env.reset(seed=None if arg is None else arg + i, out=obs[i])
+      elif command == "step":
+        for i, env in enumerate(envs, lo):
+          _, reward, term, trunc, _ = env.step(actions[i], out=obs[i])
+          rewards[i] = reward
+          terminated[i] = term
+          truncated[i] = trunc
+          if term or trunc:
+            # 自動リセット (次の観測は新しいエピソードの初期状態)
+            env.reset(out=obs[i])
+      elif command == "close":
+        break
+      conn.send(True)
+  finally:
+    envs.clear()
+    grid = obs = rewards = terminated = truncated = actions = None
+    for array in shared.values():
+      array.close()
+    conn.close()
+
+
+# --- 並列環境 (プロセスごとに環境をシャーディング) ---
+class VectorClimbEnv:
+  def __init__(self, num_envs, num_workers=None, **env_kwargs):
+    num_workers = min(num_workers or os.cpu_count() or 1, num_envs)
+    self.num_envs = num_envs
+    self.num_workers = num_workers
+    obs_size = observation_size(env_kwargs.get("patch_radius", PATCH_RADIUS),
+                                env_kwargs.get("patch_stride", PATCH_STRIDE))
+
+    # マップのタイル配列は親で1回だけ作り、全ワーカーで共有する
+    grid = load_grid()
+    self._shared = {
+        "grid": _SharedArray(grid.shape, grid.dtype),
+        "obs": _SharedArray((num_envs, obs_size), np.float32),
+        "rewards": _SharedArray((num_envs,), np.float32),
+        "terminated": _SharedArray((num_envs,), np.bool_),
+        "truncated": _SharedArray((num_envs,), np.bool_),
+        "actions": _SharedArray((num_envs,), np.int32),
+    }
+    self._shared["grid"].array[:] = grid
+    del grid
+    specs = {key: array.spec() for key, array in self._shared.items()}
+
+    self.observations = self._shared["obs"].array
+    self.rewards = self._shared["rewards"].array
+    self.terminated = self._shared["terminated"].array
+    self.truncated = self._shared["truncated"].array
+    self.actions = self._shared["actions"].array
+
+    self._conns = []
+    self._procs = []
+    # game.py は import しても初期化されないので、ワーカーは fork せず spawn で起動する
+    # (SDL を初期化済みのプロセスを fork しない)
+    context = mp.get_context("spawn")
+    bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+      parent_conn, child_conn = context.Pipe()
+      proc = context.Process(target=_vector_worker,
+                        args=(child_conn, specs, int(lo), int(hi), env_kwargs),
+                        daemon=True)
+      proc.start()
+      child_conn.close()
+      self._conns.append(parent_conn)
+      self._procs.append(proc)
+
+  def _broadcast(self, command, arg=None):
+    for conn in self._conns:
+      conn.send((command, arg))
+    for conn in self._conns:
+      conn.recv()
+
+  def reset(self, seed=None):
+    # 全環境をリセットして観測配列 (num_envs, obs_size) を返す
+    self._broadcast("reset", seed)
+    return self.observations
+
+  def step(self, actions):
+    # 全環境を1フレーム進める (返す配列は共有メモリのビュー)
+    self.actions[:] = actions
+    self._broadcast("step")
+    return self.observations, self.rewards, self.terminated, self.truncated
+
+  def close(self):
+    for conn in self._conns:
+      try:
+        conn.send(("close", None))
+      except (BrokenPipeError, OSError):
+        pass
+    for proc in self._procs:
+      proc.join(timeout=5)
+    for array in self._shared.values():
+      array.close()
+    self._conns = []
+    self._procs = []
+
+
+# --- ベンチマーク ---
+def benchmark(num_envs, steps, worker_counts):
+    # 並列数ごとの合計ステップ/秒を計測して表示する
+  rng = np.random.default_rng(0)
+  print(f"[INFO] envs={num_envs}, steps={steps}")
+  print(f"{'workers':>8} {'steps/s':>12} {'speedup':>8}")
+  baseline = None
+  for workers in worker_counts:
+    vec = VectorClimbEnv(num_envs, workers)
+    try:
+      vec.reset(seed=0)
+      actions = rng.integers(0, len(ACTIONS), size=(steps, num_envs))
+      start = time.perf_counter()
+      for t in range(steps):
+        vec.step(actions[t])
+      elapsed = time.perf_counter() - start
+    finally:
+      vec.close()
+    rate = num_envs * steps / elapsed
+    baseline = baseline or rate
+    print(f"{workers:>8} {rate:>12.0f} {rate / baseline:>7.2f}x")
+
+
+def _default_worker_counts():
+  cores = os.cpu_count() or 1
+  counts = []
+  n = 1
+  while n < cores:
+    counts.append(n)
+    n *= 2
+  counts.append(cores)
+  return counts
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Climb environment tools")
+  parser.add_argument("--bench", action="store_true", help="並列ランナーのベンチマーク")
+  parser.add_argument("--render", action="store_true", help="ランダム行動を画面に表示")
+  parser.add_argument("--envs", type=int, default=64)
+  parser.add_argument("--steps", type=int, default=300)
+  parser.add_argument("--workers", type=int, nargs="*")
+  args = parser.parse_args()
+
+  if args.bench:
+    benchmark(args.envs, args.steps, args.workers or _default_worker_counts())
+  else:
+    env = ClimbEnv(render_mode="human" if args.render else None)
+    obs, info = env.reset(seed=0)
+    total = 0.0
+    for _ in range(args.steps):
+      obs, reward, terminated, truncated, info = env.step(env.rng.integers(len(ACTIONS)))
+      total += reward
+      env.render()
+      if terminated or truncated:
+        break
+    print(f"[INFO] steps={info['steps']}, best_y={info['best_y']:.1f}, reward={total:.1f}")
+  sys.exit()
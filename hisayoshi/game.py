@@ -4,9 +4,28 @@ import sys
 import math
 import time
 import random
-
-pygame.init()
-pygame.mixer.init()
+import argparse
+import collections
+import contextlib
+import json
+import threading
+
+import assets
+import audio
+import bot
+import capture
+import ghost
+import heatmap
+import leaderboard
+import mapwatch
+import navgraph
+import netplay
+import pacing
+import scenes
+import teacher
+import telemetry
+import tilemap
+import ui
 
 # --- 定数設定 ---
 SCREEN_WIDTH = 1280
@@ -19,6 +38,7 @@ CAMERA_WIDTH_1P = int(CAMERA_HEIGHT * (SCREEN_WIDTH / SCREEN_HEIGHT))
 
 TIME_LIMIT = 300     # 制限時間（秒）
 GOAL_Y = 30000.0     # ゴールY座標
+WALL_JUMP_PROBE = 0.2     # 壁ジャンプの判定で左右にずらす距離 (px)
 ZOOM_OUT_SCALE = 0.5
 ZOOM_SMOOTHING = 0.1
 
@@ -29,13 +49,45 @@ EFFECT_PATH = f"{SOUND_PATH}/effect"
 VOICE_PATH = f"{SOUND_PATH}/voice"
 
 FONT_PATH = "./hisayoshi/font/NotoSansJP-VariableFont_wght.ttf"  # フォントファイルのパス
+# 同梱フォント (上から順に探す)
+BUNDLED_FONTS = [
+    FONT_PATH,
+    "./hisayoshi/font/Dela_Gothic_One/DelaGothicOne-Regular.ttf",
+]
+# 日本語対応システムフォントの候補リスト (同梱フォントがない場合)
+JAPANESE_SYSTEM_FONTS = ["meiryo", "hiragino sans",
+                         "ms gothic", "noto sans cjk jp", "arial unicode ms"]
+# 見つかったシステムフォントのパスを保存しておくファイル (次回からフォント一覧の走査を省く)
+FONT_CACHE_PATH = "./hisayoshi/font_cache.json"
 
 # 既存のフォントサイズ
 FONT_SIZE_SMALL = 36
 FONT_SIZE_BUTTON = 48
 FONT_SIZE_TITLE = 72
+FONT_SIZE_TABLE = 26     # ランキングの表 (10行が画面に収まる大きさ)
+
+# 1P/2Pの操作説明を修正した内容 (トリセツ画面)
+MANUAL_INSTRUCTIONS = [
+    "--- シングルプレイモード ---",
+    "移動: A (←), D (→)",
+    "ジャンプ: W (↑)",
+    "ズームアウト: R",
+    "フロアマップの表示/非表示: M",
+    "チャットボックスの表示/非表示: ~ (チルダ/バッククォート)",  # 修正
+    "",
+    "--- 2人プレイモード ---",
+    "1P (画面左): WASD, ジャンプ: W, ズームアウト: R",
+    "2P (画面右): 矢印キー (←↓→), ジャンプ: ↑, ズームアウト: . (ピリオド)",
+    "",
+    "--- Special Items ---",
+    "Blue Pad: High Jump",
+    "Green Pad: Super Jump (Highest)",
+    "",
+    "Climb high and reach the GOAL (Y: 30000) within 300 seconds!",
+]
 
 # --- Chat Box/Teacher Messages ---
+# 質問には teacher_qa.jsonl から一番近い回答を返し (teacher.py)、近いものがなければ以下から選ぶ
 TEACHER_MESSAGES = [
     "焦らず、一歩ずつ進みなさい。",
     "落ちてもめげずに、学びとして活かしなさい。",
@@ -57,81 +109,286 @@ TORUS_RESPONSE = (
 )
 
 # --- フォント初期化の修正 (日本語対応のロバスト化) ---
-try:
-  # 3つのフォントオブジェクトをグローバルスコープで定義
-  font = pygame.font.Font(FONT_PATH, FONT_SIZE_SMALL)
-  button_font = pygame.font.Font(FONT_PATH, FONT_SIZE_BUTTON)
-  title_font = pygame.font.Font(FONT_PATH, FONT_SIZE_TITLE)
-except FileNotFoundError:
-  print(f"[WARNING] 日本語フォントファイルが見つかりません: {FONT_PATH}。システムフォントにフォールバックします。")
+def _load_font_cache():
+  try:
+    with open(FONT_CACHE_PATH, encoding="utf-8") as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
 
-  # 日本語対応システムフォントの候補リスト
-  japanese_fonts = ["meiryo", "hiragino sans",
-                    "ms gothic", "noto sans cjk jp", "arial unicode ms"]
 
-  loaded_font = False
-  for font_name in japanese_fonts:
-    try:
-      # 各フォント名でロードを試みる
-      font = pygame.font.SysFont(font_name, FONT_SIZE_SMALL)
-      button_font = pygame.font.SysFont(font_name, FONT_SIZE_BUTTON)
-      title_font = pygame.font.SysFont(font_name, FONT_SIZE_TITLE)
-      loaded_font = True
-      print(f"[INFO] システムフォント '{font_name}' を使用します。")
-      break
-    except Exception:
-      continue  # 次のフォントを試す
+def _save_font_cache(cache):
+  try:
+    with open(FONT_CACHE_PATH, "w", encoding="utf-8") as f:
+      json.dump(cache, f, ensure_ascii=False, indent=1)
+  except OSError as e:
+    print(f"[WARNING] Failed to write font cache: {e}")
+
+
+def resolve_font_path():
+    # 使うフォントファイルのパスを返す (同梱フォント -> キャッシュ -> システムフォントの順)
+    # 見つからなければ None (pygame のデフォルトフォント)
+  for path in BUNDLED_FONTS:
+    if os.path.isfile(path):
+      return path
+  print(f"[WARNING] 日本語フォントファイルが見つかりません: {FONT_PATH}。システムフォントにフォールバックします。")
 
-  if not loaded_font:
+  # 候補リストが同じなら前回見つけたパスをそのまま使う
+  key = ",".join(JAPANESE_SYSTEM_FONTS)
+  cache = _load_font_cache()
+  cached = cache.get(key)
+  if cached and os.path.isfile(cached):
+    print(f"[INFO] キャッシュ済みのシステムフォントを使用します: {cached}")
+    return cached
+
+  # システムフォントの一覧を走査する (遅いので結果をキャッシュに残す)
+  for font_name in JAPANESE_SYSTEM_FONTS:
+    path = pygame.font.match_font(font_name)
+    if path:
+      print(f"[INFO] システムフォント '{font_name}' を使用します。")
+      cache[key] = path
+      _save_font_cache(cache)
+      return path
+  return None
+
+
+def init_fonts():
+    # フォントオブジェクトをグローバルスコープで定義
+  global font, button_font, title_font, table_font
+  pygame.font.init()
+  path = resolve_font_path()
+  if path:
+    try:
+      font = pygame.font.Font(path, FONT_SIZE_SMALL)
+      button_font = pygame.font.Font(path, FONT_SIZE_BUTTON)
+      title_font = pygame.font.Font(path, FONT_SIZE_TITLE)
+      table_font = pygame.font.Font(path, FONT_SIZE_TABLE)
+      return
+    except (OSError, pygame.error) as e:
+      print(f"[ERROR] フォント読み込み中に予期せぬエラーが発生しました: {e}。デフォルトフォントを使用します。")
+  else:
       # 全て失敗した場合、最終フォールバック
     print(f"[ERROR] 日本語フォントのロードに失敗しました。デフォルトフォントを使用します。")
-    font = pygame.font.SysFont(None, FONT_SIZE_SMALL)
-    button_font = pygame.font.SysFont(None, FONT_SIZE_BUTTON)
-    title_font = pygame.font.SysFont(None, FONT_SIZE_TITLE)
+  font = pygame.font.Font(None, FONT_SIZE_SMALL)
+  button_font = pygame.font.Font(None, FONT_SIZE_BUTTON)
+  title_font = pygame.font.Font(None, FONT_SIZE_TITLE)
+  table_font = pygame.font.Font(None, FONT_SIZE_TABLE)
+
+
+def prewarm_glyphs():
+    # 固定の UI 文字列を一度描画してグリフを読み込んでおく (最初のメニュー表示で引っかからないように)
+  small_texts = ["Press any key or click to proceed", "Waiting for opponent...", "Back",
+                 "Press '~' to chat", "Enter: Send, Esc: Close", "GOAL", "1P", "2P", "CPU",
+                 "TIME: 0123456789s", "Pos: (0123456789, -)", "先生: ", "あなた: "]
+  small_texts += [line for line in MANUAL_INSTRUCTIONS if line]
+  for text in small_texts:
+    font.render(text, True, (255, 255, 255))
+  for text in ("シングルプレイ", "2人プレイ", "CPU対戦", "Instructions"):
+    button_font.render(text, True, (255, 255, 255))
+  for text in ("Select Game Mode", "トリセツとコマンド", "LOADING...",
+               "TIME OVER!", "GOAL! YOU MADE IT!", "DRAW! Both players reached the goal!",
+               "1P WINS! (Goal Reached)", "2P WINS! (Goal Reached)", "CPU WINS! (Goal Reached)"):
+    title_font.render(text, True, (255, 255, 255))
+
+
+# --- 実行時に初期化するもの ---
+# import しただけでは pygame の初期化もファイルの読み込みも行わない。
+# ゲームは init_game() で必要なものをまとめて初期化し、
+# ツール (env.py など) は load_map() など必要な部分だけを呼ぶ。
+screen = None
+clock = None
+font = button_font = title_font = table_font = None
+opening_image = loading_background = None
+map_image = None
+original_image = None
+MAP_WIDTH = MAP_HEIGHT = 0
+image_right = image_left = None
+voice_dict = {}
+jump_sound = blue_sound = green_sound = fall_sound = wind_sound = None
+CHANNEL_P1_SFX = CHANNEL_P2_SFX = CHANNEL_P1_WIND = CHANNEL_P2_WIND = None
+
+# ゴースト用の半透明画像 (Player と同じく左右の画像を入れ替えて使う)
+GHOST_ALPHA = 110
+ghost_sprite_cache = {}
+# 全体マップのゴーストの点 (半透明の白、最初に使うときに作る)
+GHOST_DOT_ALPHA = 120
+GHOST_DOT_RADIUS = 3
+ghost_dot_image = None
+
+# 動的解像度の内部バッファ (draw_game_view)
+view_buffer_cache = {}
+# HUD を渡されなかったとき (env.py の表示など) に大きさごとに使い回す HUD
+hud_layer_cache = {}
+
+# 読み込んだアセットの大きさの記録 (F3 と --memory-report)
+asset_registry = assets.AssetRegistry()
+
+# 黒ピクセルまでの距離のテーブル (当たり判定用、起動後に裏のスレッドで作る)
+contact_tables = None
+_contact_thread = None
+
+# ゲーム中の音の遅延の計測 (F3、ミキサーが使えるときだけ)
+audio_monitor = None
 
-except Exception as e:
-  print(f"[ERROR] フォント読み込み中に予期せぬエラーが発生しました: {e}。デフォルトフォントを使用します。")
-  font = pygame.font.SysFont(None, FONT_SIZE_SMALL)
-  button_font = pygame.font.SysFont(None, FONT_SIZE_BUTTON)
-  title_font = pygame.font.SysFont(None, FONT_SIZE_TITLE)
+# 1/20 に縮小した全体マップ
+overview_width = 120
+overview_height = 0
+map_overview = None
 
 
 # --- ゲーム画面の初期化 ---
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("OnlyUp-style Game (1P/2P)")
-clock = pygame.time.Clock()
+def init_display():
+  global screen, clock
+  pygame.display.init()
+  screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+  pygame.display.set_caption("OnlyUp-style Game (1P/2P)")
+  clock = pygame.time.Clock()
 
-# キーリピート設定 (テキスト入力用) --- メインループ前で設定
-pygame.key.set_repeat(500, 50)
-
-# --- アセットのロード (一元管理) ---
+  # キーリピート設定 (テキスト入力用) --- メインループ前で設定
+  pygame.key.set_repeat(500, 50)
 
 
+# --- アセットのロード (一元管理) ---
 def load_image(filename):
   # 画像ファイルをロードし、エラー処理を行うヘルパー関数
   try:
-    return pygame.image.load(f"{IMAGE_PATH}/{filename}").convert_alpha()
+    image = pygame.image.load(f"{IMAGE_PATH}/{filename}")
   except pygame.error as e:
     print(f"Error loading {filename}: {e}.")
     return None
+  if pygame.display.get_surface() is None:
+    return image     # 画面を作らないツールから使うときは変換しない
+  return image.convert_alpha()
+
+
+def load_map():
+    # マップ画像を読み込み MAP_WIDTH / MAP_HEIGHT を設定する (失敗したら None)
+  global map_image, MAP_WIDTH, MAP_HEIGHT
+  if map_image is None:
+    image = load_image("map_highres.png")
+    if image is None:
+      return None
+    if image.get_bitsize() not in (24, 32):
+      # パレット画像などは配列化 (tilemap.build_tile_grid) できるよう 32bit にする
+      converted = pygame.Surface(image.get_size(), pygame.SRCALPHA, 32)
+      converted.blit(image, (0, 0))
+      image = converted
+    map_image = image
+    MAP_WIDTH, MAP_HEIGHT = map_image.get_size()
+  return map_image
+
+
+def set_map_size(width, height):
+    # マップ画像を読まずにタイル配列だけで Player を動かすとき (env.py のワーカーなど)
+  global MAP_WIDTH, MAP_HEIGHT
+  MAP_WIDTH, MAP_HEIGHT = width, height
+
+
+def init_images(palette_map=False):
+    # 画像を読み込む (マップとプレイヤー画像がなければ False)
+    # palette_map: 全体マップと接触テーブルを作った後、マップを 8bit のパレット画像にする
+  global opening_image, loading_background, original_image, map_image
+  global image_right, image_left, overview_height, map_overview
+  # 新機能に必要な画像をロード
+  opening_image = asset_registry.add("image", "opening_color.png", load_image("opening_color.png"))
+  loading_background = asset_registry.add("image", "manga_topology.png",
+                                          load_image("manga_topology.png"))
+
+  # 既存の画像をロード
+  if load_map() is None:
+    return False
+  original_image = asset_registry.add("image", "muroya.png", load_image("muroya.png"))
+  if not original_image:
+    return False
 
-
-# 新機能に必要な画像をロード
-opening_image = load_image("opening_color.png")
-loading_background = load_image("manga_topology.png")
-
-# 既存の画像をロード
-map_image = load_image("map_highres.png")
-if not map_image:
-  pygame.quit()
-  sys.exit()
-
-original_image = load_image("muroya.png")
-if not original_image:
-  pygame.quit()
-  sys.exit()
-
-MAP_WIDTH, MAP_HEIGHT = map_image.get_size()
+  # --- プレイヤー画像の設定 ---
+  scaled_image = pygame.transform.scale(original_image, (100, 150))
+  image_right = asset_registry.add("image", "player (right)", scaled_image)
+  image_left = asset_registry.add("image", "player (left)",
+                                  pygame.transform.flip(scaled_image, True, False))
+
+  overview_height = int(MAP_HEIGHT * (overview_width / MAP_WIDTH))
+  map_overview = asset_registry.add("map", "overview", pygame.transform.scale(
+      map_image, (overview_width, overview_height)))
+  start_contact_tables()
+  if palette_map:
+    palettized = assets.palettize(map_image)
+    if palettized is not None:
+      print(f"[INFO] Palette map: {assets.surface_bytes(map_image) / 2**20:.1f} MB -> "
+            f"{assets.surface_bytes(palettized) / 2**20:.1f} MB")
+      map_image = palettized
+  asset_registry.add("map", "map_highres.png", map_image)
+  return True
+
+
+def start_contact_tables():
+    # 接触テーブルを裏のスレッドで作る (できるまでは Player が画素を直接調べる)
+    # 描画中の map_image をロックしないよう、コピーを渡す
+  global _contact_thread
+  source = map_image.copy()
+
+  def build():
+    global contact_tables
+    start = time.perf_counter()
+    tables = tilemap.ContactTables.from_surface(source)
+    contact_tables = asset_registry.add("tables", "contact tables", tables, tables.nbytes())
+    print(f"[INFO] Contact tables ready ({tables.nbytes() / 2**20:.1f} MB, "
+          f"{(time.perf_counter() - start) * 1000:.0f} ms)")
+
+  _contact_thread = threading.Thread(target=build, name="contact-tables", daemon=True)
+  _contact_thread.start()
+
+
+def wait_contact_tables():
+  if _contact_thread is not None:
+    _contact_thread.join()
+
+
+def copy_pixels(dest, pos, source, area):
+    # source の area をそのまま (アルファ合成せずに) dest の pos へ写す
+  x, y = pos
+  area = pygame.Rect(area)
+  dest_rgb = pygame.surfarray.pixels3d(dest)
+  source_rgb = pygame.surfarray.pixels3d(source)
+  dest_rgb[x:x + area.width, y:y + area.height] = source_rgb[area.left:area.right, area.top:area.bottom]
+  del dest_rgb, source_rgb
+  if dest.get_flags() & pygame.SRCALPHA:
+    dest_alpha = pygame.surfarray.pixels_alpha(dest)
+    if source.get_flags() & pygame.SRCALPHA:
+      source_alpha = pygame.surfarray.pixels_alpha(source)
+      dest_alpha[x:x + area.width, y:y + area.height] = source_alpha[area.left:area.right,
+                                                                     area.top:area.bottom]
+      del source_alpha
+    else:
+      dest_alpha[x:x + area.width, y:y + area.height] = 255
+    del dest_alpha
+
+
+def update_map_region(source, rect):
+    # マップの rect (画像座標) だけを source で置き換え、そこから作るデータを作り直す
+    # (当たり判定とジャンプ台は map_image の画素を直接見るので、画像を更新すれば反映される)
+  global map_image
+  if map_image.get_bitsize() == 8 and not assets.copy_to_palette(map_image, rect.topleft, source, rect):
+    # パレットにない色が増えたら 32bit のマップに戻す
+    print("[WARNING] The reloaded map uses new colors, switching back to a 32-bit map")
+    map_image = asset_registry.add("map", "map_highres.png", map_image.convert_alpha())
+  if map_image.get_bitsize() != 8:
+    copy_pixels(map_image, rect.topleft, source, rect)
+  if contact_tables is not None:
+    contact_tables.update_region(map_image, rect)
+  # 全体マップはこの範囲にかかる行だけ縮小し直す
+  top = rect.top * overview_height // MAP_HEIGHT
+  bottom = min(overview_height, -(-rect.bottom * overview_height // MAP_HEIGHT))
+  if bottom <= top:
+    return
+  source_top = top * MAP_HEIGHT // overview_height
+  source_bottom = min(MAP_HEIGHT, -(-bottom * MAP_HEIGHT // overview_height))
+  rows = pygame.transform.scale(
+      map_image.subsurface((0, source_top, MAP_WIDTH, source_bottom - source_top)),
+      (overview_width, bottom - top))
+  if rows.get_bitsize() == 8:
+    rows = rows.convert_alpha()     # パレットのマップから縮小した行
+  copy_pixels(map_overview, (0, top), rows, rows.get_rect())
 
 
 def load_voice_files():
@@ -146,53 +403,115 @@ def load_voice_files():
       name = os.path.splitext(file)[0]
       full_path = os.path.join(VOICE_PATH, file)
       try:
-        voices[name] = pygame.mixer.Sound(full_path)
+        voices[name] = asset_registry.add("sound", f"voice/{file}", pygame.mixer.Sound(full_path))
       except pygame.error as e:
         print(f"[ERROR] Failed to load {file}: {e}")
   print(f"[INFO] Loaded {len(voices)} voice files.")
   return voices
 
 
-voice_dict = load_voice_files()
-
 # --- サウンド設定とチャンネル ---
-try:
-    # ファイル名が変更されている可能性を考慮して修正
-  jump_sound = pygame.mixer.Sound(f"{EFFECT_PATH}/kick.mp3")
-  blue_sound = pygame.mixer.Sound(f"{EFFECT_PATH}/boyon.mp3")
-  green_sound = pygame.mixer.Sound(f"{EFFECT_PATH}/explosion.mp3")
-  fall_sound = pygame.mixer.Sound(f"{EFFECT_PATH}/landing.mp3")
-  wind_sound = pygame.mixer.Sound(
-      f"{EFFECT_PATH}/Wind-Synthetic_Ambi01-1.mp3")
-except pygame.error as e:
-  print(
-      f"Error loading sound files. Check file paths and formats: {e}. Some sounds may not play.")
-  # ロードに失敗したサウンドにはNoneを割り当て
-  jump_sound = blue_sound = green_sound = fall_sound = wind_sound = None
-
-# チャンネル割り当て (SFXと風音)
-CHANNEL_P1_SFX = pygame.mixer.Channel(0)
-CHANNEL_P2_SFX = pygame.mixer.Channel(1)
-CHANNEL_P1_WIND = pygame.mixer.Channel(2)
-CHANNEL_P2_WIND = pygame.mixer.Channel(3)
-
-# 風音のループ再生を開始 (初期音量 0.0)
-if wind_sound:
-  CHANNEL_P1_WIND.play(wind_sound, loops=-1)
-  CHANNEL_P2_WIND.play(wind_sound, loops=-1)
-  CHANNEL_P1_WIND.set_volume(0.0)
-  CHANNEL_P2_WIND.set_volume(0.0)
-
-# --- プレイヤー画像の設定 ---
-scaled_image = pygame.transform.scale(original_image, (100, 150))
-image_right = scaled_image
-image_left = pygame.transform.flip(scaled_image, True, False)
+def init_mixer(calibrate=False, buffer=None):
+    # ミキサーとチャンネルを準備する (オーディオデバイスがなければ音なしで続行)
+    # 設定は audio_config.json (--calibrate-audio で測り直す、--audio-buffer で上書き)
+  global CHANNEL_P1_SFX, CHANNEL_P2_SFX, CHANNEL_P1_WIND, CHANNEL_P2_WIND, audio_monitor
+  config = audio.calibrate() if calibrate else audio.load_config()
+  if buffer:
+    config["buffer"] = buffer
+  try:
+    audio.init_mixer(config)
+  except pygame.error as e:
+    print(f"[WARNING] Audio is disabled: {e}")
+    return False
+  frequency, size, channels = pygame.mixer.get_init()
+  config.update(frequency=frequency, size=size, channels=channels)
+  print(f"[INFO] Mixer {frequency}Hz x{channels} buffer {config['buffer']} "
+        f"({audio.buffer_ms(config):.1f} ms)")
+  audio_monitor = audio.AudioMonitor(config)
+  # チャンネル割り当て (SFXと風音)
+  CHANNEL_P1_SFX = pygame.mixer.Channel(0)
+  CHANNEL_P2_SFX = pygame.mixer.Channel(1)
+  CHANNEL_P1_WIND = pygame.mixer.Channel(2)
+  CHANNEL_P2_WIND = pygame.mixer.Channel(3)
+  return True
+
+
+def init_sounds():
+  global jump_sound, blue_sound, green_sound, fall_sound, wind_sound
+  try:
+      # ファイル名が変更されている可能性を考慮して修正
+    jump_sound = pygame.mixer.Sound(f"{EFFECT_PATH}/kick.mp3")
+    blue_sound = pygame.mixer.Sound(f"{EFFECT_PATH}/boyon.mp3")
+    green_sound = pygame.mixer.Sound(f"{EFFECT_PATH}/explosion.mp3")
+    fall_sound = pygame.mixer.Sound(f"{EFFECT_PATH}/landing.mp3")
+    wind_sound = pygame.mixer.Sound(
+        f"{EFFECT_PATH}/Wind-Synthetic_Ambi01-1.mp3")
+    for name, sound in (("kick.mp3", jump_sound), ("boyon.mp3", blue_sound),
+                        ("explosion.mp3", green_sound), ("landing.mp3", fall_sound),
+                        ("Wind-Synthetic_Ambi01-1.mp3", wind_sound)):
+      asset_registry.add("sound", f"effect/{name}", sound)
+  except pygame.error as e:
+    print(
+        f"Error loading sound files. Check file paths and formats: {e}. Some sounds may not play.")
+    # ロードに失敗したサウンドにはNoneを割り当て
+    jump_sound = blue_sound = green_sound = fall_sound = wind_sound = None
+
+  # 風音のループ再生を開始 (初期音量 0.0)
+  if wind_sound:
+    CHANNEL_P1_WIND.play(wind_sound, loops=-1)
+    CHANNEL_P2_WIND.play(wind_sound, loops=-1)
+    CHANNEL_P1_WIND.set_volume(0.0)
+    CHANNEL_P2_WIND.set_volume(0.0)
+
+
+class StartupProfiler:
+  # --profile-startup: 初期化の各段階の開始時刻と所要時間を記録して表示する
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.origin = time.perf_counter()
+    self.phases = []     # (名前, 開始 [s], 所要時間 [s])
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.phases.append((name, start - self.origin, time.perf_counter() - start))
 
-# 1/20 に縮小した全体マップ
-overview_width = 120
-overview_height = int(MAP_HEIGHT * (overview_width / MAP_WIDTH))
-map_overview = pygame.transform.scale(
-    map_image, (overview_width, overview_height))
+  def mark(self, name):
+    # 所要時間のない時点 (最初のフレームの表示など) を記録する
+    self.phases.append((name, time.perf_counter() - self.origin, 0.0))
+
+  def report(self):
+    if not self.enabled:
+      return
+    print("[INFO] Startup timeline (ms):")
+    for name, start, duration in self.phases:
+      print(f"  {start * 1000:8.1f} -> {(start + duration) * 1000:8.1f}  "
+            f"{name:<14} {duration * 1000:8.1f}")
+
+
+def init_game(profiler=None, palette_map=False, calibrate_audio=False, audio_buffer=None):
+    # ゲームに必要なものを初期化する (マップかプレイヤー画像がなければ False)
+  profiler = profiler or StartupProfiler(enabled=False)
+  with profiler.phase("display"):
+    init_display()
+  with profiler.phase("fonts"):
+    init_fonts()
+  with profiler.phase("glyphs"):
+    prewarm_glyphs()
+  with profiler.phase("images"):
+    if not init_images(palette_map):
+      return False
+  with profiler.phase("mixer"):
+    audio_ready = init_mixer(calibrate_audio, audio_buffer)
+  if audio_ready:
+    with profiler.phase("sounds"):
+      init_sounds()
+    with profiler.phase("voices"):
+      voice_dict.update(load_voice_files())
+  return True
 
 
 # --- Player クラス ---
@@ -208,6 +527,9 @@ class Player:
     self.speed = 2.5
     self.jump_speed = 3.24
     self.gravity = 0.075
+    self.wall_jump_factor = 0.8     # 壁ジャンプの縦速度 (jump_speed に対する倍率)
+    self.blue_pad_vy = 8.66         # 青ジャンプ台の打ち上げ速度
+    self.green_pad_vy = 17.32       # 緑ジャンプ台の打ち上げ速度
     self.on_ground = False
     self.wall_jump_cooldown = 0
     self.is_goal = False
@@ -220,11 +542,22 @@ class Player:
     self.sfx_channel = sfx_channel
     self.wind_channel = wind_channel
     self.is_zooming_out = False
+    self.mute = False     # ロールバックの再シミュレーション中は音を鳴らさない
+    self.telemetry = None     # プレイの記録 (TelemetryWriter、None なら記録しない)
 
   def play_sound(self, sound):
-    if sound and self.sfx_channel:
+    if sound and self.sfx_channel and not self.mute:
       self.sfx_channel.play(sound)
 
+  def play_voice(self, name):
+    if name in voice_dict and not self.mute:
+      voice_dict[name].play()
+
+  def log_event(self, kind, value=0.0):
+    # 再シミュレーション中は同じ出来事を二重に記録しない
+    if self.telemetry and not self.mute:
+      self.telemetry.log(kind, self.player_id, self.x, self.y, value)
+
   def update(self, keys, control_map):
     if self.is_goal:
       return
@@ -278,13 +611,13 @@ class Player:
         self.vy = self.jump_speed
         self.on_ground = False
         self.play_sound(jump_sound)
-        if "yoisho" in voice_dict:
-          voice_dict["yoisho"].play()
+        self.play_voice("yoisho")
       elif self.wall_jump_cooldown == 0:
-          # 壁ジャンプの判定
-        if self.check_collision(self.x - 0.2, self.y) or self.check_collision(self.x + 0.2, self.y):
-          self.vy = self.jump_speed * 0.8
-          if self.check_collision(self.x - 0.2, self.y):
+          # 壁ジャンプの判定 (左右に少しずらすと壁に当たるか)
+        wall_left, wall_right = self.wall_contact()
+        if wall_left or wall_right:
+          self.vy = self.jump_speed * self.wall_jump_factor
+          if wall_left:
             self.vx = self.speed * 0.7     # 右壁から左へ
             self.facing_right = True
           else:
@@ -292,8 +625,8 @@ class Player:
             self.facing_right = False
           self.wall_jump_cooldown = 10
           self.play_sound(jump_sound)
-          if "yoisho" in voice_dict:
-            voice_dict["yoisho"].play()
+          self.play_voice("yoisho")
+          self.log_event(telemetry.EVENT_WALL_JUMP)
 
     if self.wall_jump_cooldown > 0:
       self.wall_jump_cooldown -= 1
@@ -317,6 +650,7 @@ class Player:
       if self.vy < 0:
         if not self.on_ground:
           self.play_sound(fall_sound)
+          self.log_event(telemetry.EVENT_LAND, self.vy)
         self.on_ground = True
       self.vy = 0
 
@@ -333,14 +667,18 @@ class Player:
     # 特殊ジャンプのチェック
     special = self.check_special_jump()
     if special == 'blue':
-      self.vy = 8.66
+      self.vy = self.blue_pad_vy
       self.play_sound(blue_sound)
+      self.log_event(telemetry.EVENT_PAD, self.vy)
     elif special == 'green':
-      self.vy = 17.32
+      self.vy = self.green_pad_vy
       self.play_sound(green_sound)
+      self.log_event(telemetry.EVENT_PAD, self.vy)
 
   def check_collision(self, x, y):
-      # 当たり判定 (黒い部分)
+      # 当たり判定 (黒い部分)。接触テーブルができていれば行ごとの距離を引くだけ
+    if contact_tables is not None:
+      return contact_tables.box_hit(x, y, self.width, self.height)
     left = int(x)
     right = int(math.ceil(x + self.width))
     bottom = int(y)
@@ -358,6 +696,14 @@ class Player:
             pass
     return False
 
+  def wall_contact(self):
+      # 左右に WALL_JUMP_PROBE px ずらした位置が壁に当たるか (左, 右)
+      # テーブルができるまで (と env.SimPlayer) は check_collision で同じ矩形を調べる
+    if contact_tables is not None:
+      return contact_tables.wall_within(self.x, self.y, self.width, self.height, WALL_JUMP_PROBE)
+    return (self.check_collision(self.x - WALL_JUMP_PROBE, self.y),
+            self.check_collision(self.x + WALL_JUMP_PROBE, self.y))
+
   def draw(self, surface, cam_x, cam_y, screen_width, screen_height, camera_width, camera_height, zoom):
       # プレイヤーの描画
     scale_x = screen_width / camera_width
@@ -371,6 +717,7 @@ class Player:
 
     scaled_image = pygame.transform.scale(
         image, (int(self.width * scale_x), int(self.height * scale_y)))
+    asset_registry.note_temporary("player sprite", scaled_image)
     surface.blit(scaled_image, (screen_x, screen_y))
 
   def check_special_jump(self):
@@ -433,8 +780,24 @@ def draw_text_border(surface, text, font, color, border_color, x, y, border_size
   surface.blit(text_surface, (x, y))
 
 
+def render_text_border(text, font, color, border_color, border_size=1):
+    # draw_text_border と同じ見た目の文字を透明なサーフェスに描いて返す (HUD の部品用)
+    # 文字は (border_size, border_size) の位置に置かれる
+  border_surface = font.render(text, True, border_color)
+  width, height = border_surface.get_size()
+  image = pygame.Surface((width + border_size * 2, height + border_size * 2), pygame.SRCALPHA)
+  for dx in range(-border_size, border_size + 1):
+    for dy in range(-border_size, border_size + 1):
+      if dx != 0 or dy != 0:
+        image.blit(border_surface, (border_size + dx, border_size + dy))
+  image.blit(font.render(text, True, color), (border_size, border_size))
+  return image
+
+
 def switch_bgm(target, current_bgm):
     # BGMを切り替える (pygame.mixer.musicを使用)
+  if not pygame.mixer.get_init():
+    return current_bgm     # 音なしで起動している
   if target != current_bgm:
     try:
       if pygame.mixer.music.get_busy():
@@ -461,17 +824,92 @@ def switch_bgm(target, current_bgm):
   return current_bgm
 
 
-def draw_overview_map(main_surface, player1, player2, ow_width, ow_height, map_w, map_h, font, overview_rect):
+def reset_session_audio():
+    # セッション終了時に BGM・効果音を止める (チャンネルと読み込み済みの音は使い回す)
+  if not pygame.mixer.get_init():
+    return
+  pygame.mixer.music.stop()
+  for channel in (CHANNEL_P1_SFX, CHANNEL_P2_SFX):
+    channel.stop()
+  for channel in (CHANNEL_P1_WIND, CHANNEL_P2_WIND):
+    channel.set_volume(0.0)     # 風音はループ再生したまま音量だけ戻す
+
+
+def create_net_session(options):
+    # コマンドライン引数から LAN 対戦のセッションを作る (ホストが 1P、参加側が 2P)
+  if options.join:
+    transport = netplay.UdpTransport(0, netplay.parse_address(options.join))
+    local_index = 1
+  else:
+    transport = netplay.UdpTransport(options.host)
+    local_index = 0
+  if options.net_latency or options.net_loss:
+    # 回線状態の模擬 (localhost での動作確認用)
+    transport = netplay.LossyTransport(
+        transport, options.net_latency, options.net_latency * 0.25, options.net_loss)
+  print(f"[INFO] LAN versus: {'joining' if options.join else 'hosting'} on port {transport.port}")
+  return netplay.RollbackSession(None, local_index, transport)
+
+
+def draw_ghosts(surface, ghosts, frame_index, cam_x, cam_y, camera_width, camera_height, player_size):
+    # ゴーストを半透明のスプライトで描画する (縮小済み画像はサイズごとにキャッシュ)
+  if not ghosts:
+    return
+  scale_x = surface.get_width() / camera_width
+  scale_y = surface.get_height() / camera_height
+  size = (int(player_size[0] * scale_x), int(player_size[1] * scale_y))
+  if len(ghost_sprite_cache) > 32:     # ズーム中はサイズが毎フレーム変わるので上限を設ける
+    ghost_sprite_cache.clear()
+  for g in ghosts:
+    x, y, flags = g.frame(frame_index)
+    facing_right = bool(flags & ghost.FLAG_FACING_RIGHT)
+    key = (facing_right, size)
+    sprite = ghost_sprite_cache.get(key)
+    if sprite is None:
+      sprite = pygame.transform.scale(image_left if facing_right else image_right, size)
+      sprite.set_alpha(GHOST_ALPHA)
+      ghost_sprite_cache[key] = asset_registry.add("cache", f"ghost sprite {size[0]}x{size[1]}"
+                                                   f"{' (right)' if facing_right else ''}", sprite)
+    screen_x = (x - cam_x) * scale_x
+    screen_y = surface.get_height() - ((y - cam_y) * scale_y) - size[1]
+    surface.blit(sprite, (screen_x, screen_y))
+
+
+def overview_ghost_dot():
+    # 全体マップに重ねるゴーストの点 (1枚だけ作って使い回す)
+  global ghost_dot_image
+  if ghost_dot_image is None:
+    size = GHOST_DOT_RADIUS * 2 + 1
+    ghost_dot_image = pygame.Surface((size, size), pygame.SRCALPHA)
+    pygame.draw.circle(ghost_dot_image, (200, 200, 200, GHOST_DOT_ALPHA),
+                       (GHOST_DOT_RADIUS, GHOST_DOT_RADIUS), GHOST_DOT_RADIUS)
+    asset_registry.add("cache", "ghost overview dot", ghost_dot_image)
+  return ghost_dot_image
+
+
+def draw_overview_map(main_surface, player1, player2, ow_width, ow_height, map_w, map_h, font, overview_rect, ghosts=None, ghost_frame=0, heatmap_overlay=None):
     # 全体マップ（オーバービュー）を描画するヘルパー関数
   overview_surface = pygame.Surface((ow_width, ow_height), pygame.SRCALPHA)
+  asset_registry.note_temporary("overview", overview_surface)
   overview_surface.set_alpha(200)
   overview_surface.blit(map_overview, (0, 0))
   main_surface.blit(overview_surface, overview_rect)
+  if heatmap_overlay:  # 集計したヒートマップ (H キー)
+    layer_surface, layer_name = heatmap_overlay
+    main_surface.blit(layer_surface, overview_rect)
+    text_layer = font.render(layer_name, True, (255, 200, 0))
+    main_surface.blit(text_layer, (overview_rect.left, overview_rect.bottom + 4))
   pygame.draw.rect(main_surface, (255, 255, 255), overview_rect, 2)
   scale_x = ow_width / map_w
   scale_y = ow_height / map_h
   PLAYER_DOT_RADIUS = 4
   BORDER_COLOR = (255, 215, 0)     # P1のドット（枠）
+  if ghosts:  # ゴーストのドット（半透明の白、プレイヤーの点を隠さないよう先に描く）
+    dot = overview_ghost_dot()
+    for g in ghosts:
+      x, y, _ = g.frame(ghost_frame)
+      main_surface.blit(dot, (overview_rect.left + int(x * scale_x) - GHOST_DOT_RADIUS,
+                              overview_rect.top + int((map_h - y) * scale_y) - GHOST_DOT_RADIUS))
   player1_dot_x = int(player1.x * scale_x)
   player1_dot_y = int((map_h - player1.y) * scale_y)
   dot_pos1 = (overview_rect.left + player1_dot_x,
@@ -498,8 +936,29 @@ def draw_overview_map(main_surface, player1, player2, ow_width, ow_height, map_w
                                   line_y_pos - text_goal.get_height() - 2))
 
 
-def draw_game_view(surface, player, camera, cam_width, cam_height, zoom_scale, player_label, font):
+def make_heatmap_overlay(data, layer, size):
+    # 集計結果の1レイヤーを全体マップと同じ大きさの半透明画像にする
+  rgba = heatmap.overlay_rgba(data, layer, size)
+  image = pygame.image.frombuffer(rgba.tobytes(), (rgba.shape[1], rgba.shape[0]), "RGBA")
+  return pygame.transform.smoothscale(image.convert_alpha(), size)
+
+
+def view_buffer(surface, render_scale):
+    # 縮小解像度で描くための内部バッファ (画面と同じピクセル形式、サイズごとに使い回す)
+  size = (max(1, int(surface.get_width() * render_scale)),
+          max(1, int(surface.get_height() * render_scale)))
+  buffer = view_buffer_cache.get(size)
+  if buffer is None:
+    buffer = pygame.Surface(size, 0, surface)
+    view_buffer_cache[size] = asset_registry.add("cache", f"view buffer {size[0]}x{size[1]}", buffer)
+  return buffer
+
+
+def draw_game_view(surface, player, camera, cam_width, cam_height, zoom_scale, player_label, font, ghosts=None, ghost_frame=0, render_scale=1.0, hud=None):
     # 個別のゲーム画面を描画するヘルパー関数
+    # render_scale < 1 のときはマップ・ゴースト・プレイヤーを縮小バッファに描いて拡大する
+    # (文字は画面の解像度のまま描く)
+    # ラベルと座標は hud (ui.HudLayer) の部品にし、最後にこのビューの HUD をまとめて重ねる
   display_width = cam_width / zoom_scale
   display_height = cam_height / zoom_scale
   rect_x = int(camera.x)
@@ -508,36 +967,107 @@ def draw_game_view(surface, player, camera, cam_width, cam_height, zoom_scale, p
       display_width), int(display_height))
   camera_rect.clamp_ip(pygame.Rect(0, 0, MAP_WIDTH, MAP_HEIGHT))
   sub_map = map_image.subsurface(camera_rect)
+  target = surface if render_scale >= 1.0 else view_buffer(surface, render_scale)
   scaled_map = pygame.transform.scale(
-      sub_map, (surface.get_width(), surface.get_height()))
-  surface.blit(scaled_map, (0, 0))
-  player.draw(surface, camera.x, camera.y, surface.get_width(),
-              surface.get_height(), display_width, display_height, zoom_scale)
-
+      sub_map, (target.get_width(), target.get_height()))
+  asset_registry.note_temporary("game view map", scaled_map)
+  target.blit(scaled_map, (0, 0))     # パレットのマップはここで画面の形式に変換される
+  draw_ghosts(target, ghosts, ghost_frame, camera.x, camera.y,
+              display_width, display_height, (player.width, player.height))
+  player.draw(target, camera.x, camera.y, target.get_width(),
+              target.get_height(), display_width, display_height, zoom_scale)
+  if target is not surface:
+    pygame.transform.scale(target, surface.get_size(), surface)
+
+  if hud is None:
+    hud = hud_layer_cache.get(surface.get_size())
+    if hud is None:
+      hud = hud_layer_cache[surface.get_size()] = ui.HudLayer(surface.get_size())
   if player_label:
     player_id_color = (255, 0, 0) if player.player_id == 1 else (0, 0, 255)
-    draw_text_border(surface, player_label, font,
-                     player_id_color, (255, 255, 255), 10, 10, border_size=2)
-
-  text_pos = font.render(
-      f"Pos: ({int(player.x)}, {int(player.y)})", True, (255, 255, 255))
-  surface.blit(text_pos, (surface.get_width() - text_pos.get_width() - 10, 10))
-
-
-def draw_end_screen(surface, message, font):
-    # ゲームオーバー画面を描画
+    hud.set("label", player_label,
+            lambda text: render_text_border(text, font, player_id_color, (255, 255, 255), 2),
+            topleft=(8, 8))
+  # 座標は整数の値が変わったときだけ描き直す
+  hud.set("pos", (int(player.x), int(player.y)),
+          lambda pos: font.render(f"Pos: ({pos[0]}, {pos[1]})", True, (255, 255, 255)),
+          topright=(surface.get_width() - 10, 10))
+  hud.blit(surface)
+
+
+def draw_end_screen(surface, message, font, rows=None, highlight=(), small_font=None, note=None):
+    # ゲームオーバー画面を描画 (表示時間は EndScene が管理する)
+    # rows を渡したときは、メッセージを上に寄せてその下にランキング (と note の1行) を描く
   surface.fill((0, 0, 0))
   text_render = font.render(message, True, (255, 255, 255))
-  rect = text_render.get_rect(
-      center=(surface.get_width() // 2, surface.get_height() // 2))
+  center_y = surface.get_height() // 2 if rows is None else surface.get_height() // 4
+  rect = text_render.get_rect(center=(surface.get_width() // 2, center_y))
   surface.blit(text_render, rect)
-  pygame.display.flip()
-  time.sleep(3)
+  if rows is not None:
+    area = draw_leaderboard(surface, rows, small_font, (surface.get_width() // 2, rect.bottom + 40),
+                            "TODAY'S TOP 10", highlight, centered=True)
+    if note:
+      note_render = small_font.render(note, True, (150, 150, 150))
+      surface.blit(note_render, note_render.get_rect(midtop=(surface.get_width() // 2, area.bottom + 10)))
+
+
+def draw_leaderboard(surface, rows, font, pos, title, highlight=(), centered=False):
+    # ランキングの表を描いて、描いた範囲の Rect を返す (highlight の finished_at の行は黄色)
+    # pos は表の左上 (centered なら上端の中央)
+  lines = []
+  for rank, (_, _, mode, clear_ms, player, finished_at) in enumerate(rows, 1):
+    lines.append((f"{rank}. {leaderboard.format_time(clear_ms)} {leaderboard.entry_label(mode, player)}",
+                  finished_at in highlight))
+  lines = lines or [("No records yet", False)]
+  x, y = pos
+  if centered:
+    x -= max(font.size(text)[0] for text in [title] + [line for line, _ in lines]) // 2
+  area = pygame.Rect(x, y, 0, 0)
+  title_render = font.render(title, True, (255, 215, 0))
+  surface.blit(title_render, (x, y))
+  area.union_ip(title_render.get_rect(topleft=(x, y)))
+  y += title_render.get_height() + 6
+  for line, mine in lines:
+    color = (255, 255, 0) if mine else (220, 220, 220)
+    draw_text_border(surface, line, font, color, (0, 0, 0), x, y, 1)
+    area.union_ip(pygame.Rect(x, y, *font.size(line)).inflate(2, 2))
+    y += font.get_linesize()
+  return area
+
+
+# モード選択ボタンの色と文字 (1P, 2P, CPU対戦, トリセツ の順)
+SELECT_BUTTONS = [
+    ((0, 100, 200), "シングルプレイ"),
+    ((200, 0, 100), "2人プレイ"),
+    ((200, 120, 0), "CPU対戦"),
+    ((50, 50, 50), "Instructions"),
+]
+BACK_BUTTON_COLOR = (150, 50, 50)
+SELECT_BACKGROUND_COLOR = (30, 30, 50)
+SELECT_NOTICE_COLOR = (255, 200, 80)
+NAVGRAPH_MISSING_TEXT = ("CPU対戦のグラフがありません", "python hisayoshi/navgraph.py", "を先に実行してください")
+SELECT_LEADERBOARD_POS = (1040, 290)    # モード選択画面のランキングの上端の中央 (ボタンの右側)
+
+
+def draw_button(surface, rect, color, label, font, border_color=(255, 255, 255)):
+    # 角丸のボタンを描画
+  pygame.draw.rect(surface, color, rect, border_radius=10)
+  pygame.draw.rect(surface, border_color, rect, 3, border_radius=10)
+  text = font.render(label, True, (255, 255, 255))
+  surface.blit(text, text.get_rect(center=rect.center))
 
 
-def draw_select_mode_screen(surface, title_font, button_font, btn_1p_rect, btn_2p_rect, btn_manual_rect, current_state):
+def make_hover_image(background, rect, color, label, font):
+    # ホバー中のボタン画像 (明るい色と黄色の枠、角の外側は背景のまま)
+  image = background.subsurface(rect).copy()
+  lighter = tuple(min(255, c + 50) for c in color)
+  draw_button(image, image.get_rect(), lighter, label, font, border_color=(255, 215, 0))
+  return image
+
+
+def draw_select_mode_screen(surface, title_font, button_font, btn_1p_rect, btn_2p_rect, btn_cpu_rect, btn_manual_rect, current_state):
     # モード選択画面を描画
-  surface.fill((30, 30, 50))     # 濃い青の背景
+  surface.fill(SELECT_BACKGROUND_COLOR)     # 濃い青の背景
   title_text = "Select Game Mode"
   title_width = title_font.size(title_text)[0]
   draw_text_border(surface, title_text, title_font, (255, 255, 255), (0, 0, 0),
@@ -545,23 +1075,9 @@ def draw_select_mode_screen(surface, title_font, button_font, btn_1p_rect, btn_2
                    surface.get_height() // 5, 2)
 
   if current_state == "MAIN_SELECT":
-      # 1P ボタン
-    pygame.draw.rect(surface, (0, 100, 200), btn_1p_rect, border_radius=10)
-    pygame.draw.rect(surface, (255, 255, 255), btn_1p_rect, 3, border_radius=10)
-    btn_1p_text = button_font.render("シングルプレイ", True, (255, 255, 255))
-    surface.blit(btn_1p_text, btn_1p_text.get_rect(center=btn_1p_rect.center))
-    # 2P ボタン
-    pygame.draw.rect(surface, (200, 0, 100), btn_2p_rect, border_radius=10)
-    pygame.draw.rect(surface, (255, 255, 255), btn_2p_rect, 3, border_radius=10)
-    btn_2p_text = button_font.render("2人プレイ", True, (255, 255, 255))
-    surface.blit(btn_2p_text, btn_2p_text.get_rect(center=btn_2p_rect.center))
-    # トリセツ ボタン
-    pygame.draw.rect(surface, (50, 50, 50), btn_manual_rect, border_radius=10)
-    pygame.draw.rect(surface, (255, 255, 255),
-                     btn_manual_rect, 3, border_radius=10)
-    btn_manual_text = button_font.render("Instructions", True, (255, 255, 255))
-    surface.blit(btn_manual_text, btn_manual_text.get_rect(
-        center=btn_manual_rect.center))
+    rects = (btn_1p_rect, btn_2p_rect, btn_cpu_rect, btn_manual_rect)
+    for rect, (color, label) in zip(rects, SELECT_BUTTONS):
+      draw_button(surface, rect, color, label, button_font)
 
 def draw_manual_screen(surface, title_font, font, btn_back_rect):
     # トリセツ（操作説明）画面を描画 (HTMLを使用しない従来の形式)
@@ -571,27 +1087,8 @@ def draw_manual_screen(surface, title_font, font, btn_back_rect):
   draw_text_border(surface, title_text, title_font, (255, 255, 255), (0, 0, 0),
                    surface.get_width() // 2 - title_width // 2, 50, 2)
 
-  # 1P/2Pの操作説明を修正した内容
-  instructions = [
-      "--- シングルプレイモード ---",
-      "移動: A (←), D (→)",
-      "ジャンプ: W (↑)",
-      "ズームアウト: R",
-      "フロアマップの表示/非表示: M",
-      "チャットボックスの表示/非表示: ~ (チルダ/バッククォート)",  # 修正
-      "",
-      "--- 2人プレイモード ---",
-      "1P (画面左): WASD, ジャンプ: W, ズームアウト: R",
-      "2P (画面右): 矢印キー (←↓→), ジャンプ: ↑, ズームアウト: . (ピリオド)",
-      "",
-      "--- Special Items ---",
-      "Blue Pad: High Jump",
-      "Green Pad: Super Jump (Highest)",
-      "",
-      "Climb high and reach the GOAL (Y: 30000) within 300 seconds!",
-  ]
   y_start = 150
-  for line in instructions:
+  for line in MANUAL_INSTRUCTIONS:
     color = (255, 255, 0) if "---" in line else (255, 255, 255)
     text_render = font.render(line, True, color)
     text_rect = text_render.get_rect(
@@ -600,54 +1097,29 @@ def draw_manual_screen(surface, title_font, font, btn_back_rect):
     y_start += 40
 
   # Back Button
-  pygame.draw.rect(surface, (150, 50, 50), btn_back_rect, border_radius=10)
-  pygame.draw.rect(surface, (255, 255, 255), btn_back_rect, 3, border_radius=10)
-  btn_back_text = font.render("Back", True, (255, 255, 255))
-  surface.blit(btn_back_text, btn_back_text.get_rect(
-      center=btn_back_rect.center))
-
-# --- オープニング画面 ---
-def run_opening_screen(surface, image, duration_seconds=3):
-    # オープニング画像を表示し、フェードアウトを行う
-  if not image:
-    return True
-
-  elapsed = time.time() - main.opening_start_time
-
-  # 画像を画面サイズに合わせる
-  scaled_img = pygame.transform.scale(image, (SCREEN_WIDTH, SCREEN_HEIGHT))
-  surface.blit(scaled_img, (0, 0))
-
-  # フェードアウト処理
-  if elapsed > duration_seconds - 1.0:  # 最後の1秒でフェードアウト
-    alpha = int(255 * (1.0 - (elapsed - (duration_seconds - 1.0))))
-    alpha = max(0, alpha)
-    fade_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-    fade_surface.fill((0, 0, 0))
-    fade_surface.set_alpha(alpha)
-    surface.blit(fade_surface, (0, 0))
-    return False  # 演出が続行中
-  return True  # 演出完了
-
+  draw_button(surface, btn_back_rect, BACK_BUTTON_COLOR, "Back", font)
 
 # --- ロード画面 ---
 def run_loading_screen(surface, background_image, font):
     # ロード画面とアニメーションを表示する (文字演出強化済み)
   if not background_image:
     surface.fill((0, 0, 0))     # 背景画像がない場合は黒
-  else:
+  elif background_image.get_size() != surface.get_size():
       # 背景画像を画面サイズに合わせる
     scaled_bg = pygame.transform.scale(
         background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
     surface.blit(scaled_bg, (0, 0))
+  else:
+    surface.blit(background_image, (0, 0))     # 縮小済み (LoadingScene.enter で作成)
 
   # ローディングアニメーション（回転と一文字表示）
   loading_message = "LOADING..."
-  anim_time = pygame.time.get_ticks() / 1000.0
+  anim_time = time.time()
 
   # 1. 文字全体を回転させる角度
   rotation_angle = (anim_time * 90) % 360     # 4秒で1周
   rotated_surface = pygame.Surface(surface.get_size(), pygame.SRCALPHA)
+  asset_registry.note_temporary("loading text", rotated_surface)
   rotated_surface.fill((0, 0, 0, 0))     # 透明なサーフェス
 
   # 2. 一文字ずつ表示 (だららら演出)
@@ -713,6 +1185,7 @@ def draw_chat_box(surface, font, is_active, input_text, history):
 
   # 背景と枠線
   chat_surface = pygame.Surface((CHAT_WIDTH, CHAT_HEIGHT), pygame.SRCALPHA)
+  asset_registry.note_temporary("chat box", chat_surface)
   chat_surface.fill((50, 50, 70, 200))  # 濃い背景 (半透明)
   pygame.draw.rect(chat_surface, (200, 200, 255),
                    chat_surface.get_rect(), 2, border_radius=5)  # 枠線
@@ -780,382 +1253,972 @@ def draw_chat_box(surface, font, is_active, input_text, history):
                box_rect.top - hint_render.get_height() - 5))
 
 
-# --- メインゲームループ ---
-def main():
-    # ゲームの状態
-  STATE_OPENING = 0      # オープニング画像表示 (キー入力待ち)
-  STATE_SELECT_MODE = 1    # 1P/2P/説明書選択
-  STATE_MANUAL = 11      # 説明書表示
-  STATE_LOADING = 2      # ロード画面
-  STATE_PLAYING = 3      # ゲームプレイ中
-  STATE_GAME_OVER = 4      # ゲーム終了
-
-  # --- 変数 ---
-  play_mode = 0      # 1: 1P, 2: 2P
-  player1 = None
-  player2 = None
-  camera1 = None
-  camera2 = None
-  current_zoom_p1 = 1.0
-  current_zoom_p2 = 1.0
-  show_overview_map = True
-
-  # P1をWASD、P2を矢印キーに固定
-  control_map_p1 = {'left': pygame.K_a, 'right': pygame.K_d,
-                    'jump': pygame.K_w, 'zoom_out': pygame.K_r}
-  control_map_p2 = {'left': pygame.K_LEFT, 'right': pygame.K_RIGHT,
-                    'jump': pygame.K_UP, 'zoom_out': pygame.K_PERIOD}
-
-  HALF_SCREEN_WIDTH = SCREEN_WIDTH // 2
-
-  # 初期値としてFull/Split画面用のSubsurfaceを定義
-  SCREEN_SURFACE_P1 = screen.subsurface(
-      pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
-  SCREEN_SURFACE_P2 = screen.subsurface(
-      pygame.Rect(0, 0, 0, 0))  # 2Pモード以外では使用しない
-
-  current_bgm = ""
-  game_start_time = 0
-  camera_smoothing = 0.15
-  game_end_message = ""
-
-  # 状態遷移変数
-  loading_start_time = 0
-  LOADING_DURATION = 3.0
-  voice_played_after_loading = False     # ロード完了時の音声再生フラグ
-  opening_show_duration = 3.0
-  main.opening_start_time = time.time()  # グローバルな時間として設定
-  is_opening_animation_done = False
-
-  # モード選択画面のサブステート
-  select_mode_substate = "MAIN_SELECT"
-
-  # フォント設定 (グローバル変数を使用)
-  global font, title_font, button_font
-
-  # --- チャット関連変数 ---
-  is_chat_active = False  # ~キーで表示されるチャットボックスがアクティブかどうか (初期値: False)
-  chat_input_text = ""
-  chat_history = []
-
-  # 全体マップの位置を画面左上 (10, 10) に変更
-  overview_rect = pygame.Rect(0, 0, overview_width, overview_height)
-  overview_rect.topleft = (10, 10)
-
-  # モード選択ボタンの矩形
-  BTN_WIDTH = 250
-  BTN_HEIGHT = 80
-  center_x = SCREEN_WIDTH // 2
-  center_y = SCREEN_HEIGHT // 2
-
-  # ボタン位置の調整
-  btn_1p_rect = pygame.Rect(center_x - BTN_WIDTH // 2,
-                            center_y - BTN_HEIGHT * 1.5, BTN_WIDTH, BTN_HEIGHT)
-  btn_2p_rect = pygame.Rect(center_x - BTN_WIDTH // 2,
-                            center_y - BTN_HEIGHT * 0.5, BTN_WIDTH, BTN_HEIGHT)
-  btn_manual_rect = pygame.Rect(
-      center_x - BTN_WIDTH // 2, center_y + BTN_HEIGHT * 0.5, BTN_WIDTH, BTN_HEIGHT)
-
-  # 戻るボタン (説明書画面用)
-  BTN_BACK_WIDTH = 150
-  BTN_BACK_HEIGHT = 50
-  btn_back_rect = pygame.Rect(
-      SCREEN_WIDTH // 2 - BTN_BACK_WIDTH // 2,
-      SCREEN_HEIGHT - BTN_BACK_HEIGHT - 30,
-      BTN_BACK_WIDTH, BTN_BACK_HEIGHT)
-
-  # 初期ステート
-  game_state = STATE_OPENING
-
-  running = True
-  while running:
-    clock.tick(FPS)
-    keys = pygame.key.get_pressed()
-
-    # --- イベント処理 ---
-    for event in pygame.event.get():
-      if event.type == pygame.QUIT:
-        running = False
-
-      if event.type == pygame.KEYDOWN:
-        # プレイ中のキー操作
-        if game_state == STATE_PLAYING:
-
-          # ~キーでのチャットトグル処理
-          if event.key == pygame.K_BACKQUOTE:  # ~または`キー
-            is_chat_active = not is_chat_active
-            if is_chat_active:
-              chat_input_text = ""  # 入力リセット
-
-          if is_chat_active:
-            # チャットがアクティブのときのみ、テキスト入力と送信を処理
-            if event.key == pygame.K_RETURN:
-              if chat_input_text.strip():
-                # プレイヤーメッセージを履歴に追加
-                player_msg = chat_input_text.strip()
-                chat_history.append(
-                    {"sender": "Player", "text": player_msg, "time": time.time()})
-
-                # --- 特殊応答チェック ---
-                if "ダブルトーラス" in player_msg:
-                  teacher_response = TORUS_RESPONSE
-                else:
-                  teacher_response = random.choice(TEACHER_MESSAGES)
-
-                # 先生のメッセージを履歴に追加
-                chat_history.append(
-                    {"sender": "Teacher", "text": teacher_response, "time": time.time()})
-                chat_input_text = ""  # 入力リセット
-
-            elif event.key == pygame.K_BACKSPACE:
-              chat_input_text = chat_input_text[:-1]
-            elif event.key == pygame.K_ESCAPE:
-              is_chat_active = False  # Escキーでチャットを閉じる
-
-            # 文字入力イベント (KEYDOWNイベントにunicode属性がある場合)
-            # IMEからの入力に対応するため、KEYDOWNで文字が送られてきた場合も捕捉
-            elif event.unicode and event.key != pygame.K_BACKQUOTE:
-                # 特殊キーや制御文字を除外してテキストに追加
-                # スペースや通常の文字であれば追加
-              if len(event.unicode) == 1:
-                chat_input_text += event.unicode
-
-          else:
-            # チャットが非アクティブのときのみ、ゲーム内操作キーを処理
-            if event.key == pygame.K_m:
-              show_overview_map = not show_overview_map
-
-        # オープニング後のキー待ち
-        if game_state == STATE_OPENING and is_opening_animation_done:
-          game_state = STATE_SELECT_MODE     # キーまたはクリックで遷移
-
-      # モード選択画面のクリック処理
-      if game_state == STATE_SELECT_MODE:
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:  # 左クリック
-          if btn_1p_rect.collidepoint(event.pos):
-            play_mode = 1
-            game_state = STATE_LOADING
-            loading_start_time = time.time()
-            voice_played_after_loading = False     # ロード毎にリセット
-          elif btn_2p_rect.collidepoint(event.pos):
-            play_mode = 2
-            game_state = STATE_LOADING
-            loading_start_time = time.time()
-            voice_played_after_loading = False     # ロード毎にリセット
-          elif btn_manual_rect.collidepoint(event.pos):
-            game_state = STATE_MANUAL     # 説明書画面へ
-
-      # 説明書画面のクリック処理
-      elif game_state == STATE_MANUAL:
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-          if btn_back_rect.collidepoint(event.pos):
-            game_state = STATE_SELECT_MODE     # モード選択画面へ戻る
-
-    # --- ゲームロジックと描画 ---
-    if game_state == STATE_OPENING:
-        # オープニングアニメーションを続行・描画
-      screen.fill((0, 0, 0))
-      if not is_opening_animation_done:
-        is_opening_animation_done = (
-            time.time() - main.opening_start_time) >= opening_show_duration
-
-      if (time.time() - main.opening_start_time) < opening_show_duration:
-          # アニメーション中
-        run_opening_screen(screen, opening_image, opening_show_duration)
+# --- 動的解像度 ---
+class ResolutionScaler:
+  # 直近のフレーム時間 (描画と更新にかかった時間、待ち時間は除く) の平均から
+  # ゲーム画面の描画倍率を決める。上げ下げの閾値を離し、変更後はしばらく様子を見る (ヒステリシス)
+  STEP = 0.125
+  WINDOW = 30             # 平均を取るフレーム数
+  DOWN_RATIO = 0.9        # 予算のこの割合を超えたら下げる
+  UP_RATIO = 0.6          # 予算のこの割合を下回ったら上げる
+  COOLDOWN = 60           # 変更後に判定を止めるフレーム数
+
+  def __init__(self, fixed_scale=None, budget_ms=1000.0 / FPS, min_scale=0.5, max_scale=1.0):
+    self.fixed = fixed_scale is not None
+    self.scale = max(0.1, min(1.0, fixed_scale)) if self.fixed else max_scale
+    self.budget_ms = budget_ms
+    self.min_scale = min_scale
+    self.max_scale = max_scale
+    self.samples = collections.deque(maxlen=self.WINDOW)
+    self.cooldown = 0
+    self.average_ms = 0.0
+
+  def update(self, frame_ms):
+    self.samples.append(frame_ms)
+    self.average_ms = sum(self.samples) / len(self.samples)
+    if self.fixed:
+      return
+    if self.cooldown:
+      self.cooldown -= 1
+      return
+    if len(self.samples) < self.WINDOW:
+      return
+    if self.average_ms > self.budget_ms * self.DOWN_RATIO and self.scale > self.min_scale:
+      self._set_scale(self.scale - self.STEP)
+    elif self.average_ms < self.budget_ms * self.UP_RATIO and self.scale < self.max_scale:
+      self._set_scale(self.scale + self.STEP)
+
+  def _set_scale(self, scale):
+    self.scale = max(self.min_scale, min(self.max_scale, scale))
+    self.samples.clear()
+    self.cooldown = self.COOLDOWN
+
+  def readout(self):
+    mode = "fixed" if self.fixed else "auto"
+    return f"RES {int(self.scale * 100)}% ({mode}) {self.average_ms:.1f}ms"
+
+
+# --- シーン ---
+# P1をWASD、P2を矢印キーに固定
+CONTROL_MAP_P1 = {'left': pygame.K_a, 'right': pygame.K_d,
+                  'jump': pygame.K_w, 'zoom_out': pygame.K_r}
+CONTROL_MAP_P2 = {'left': pygame.K_LEFT, 'right': pygame.K_RIGHT,
+                  'jump': pygame.K_UP, 'zoom_out': pygame.K_PERIOD}
+
+OPENING_SHOW_DURATION = 3.0
+LOADING_DURATION = 3.0
+END_SCREEN_DURATION = 3.0
+IDLE_FPS = 10        # 静止したメニュー画面でのフレームレート
+IDLE_AFTER = 1.0     # 見た目が変わらなくなってからフレームレートを落とすまでの秒数
+MAP_NOTICE_SECONDS = 3.0     # マップを再読み込みしたときの表示時間
+KIOSK_IDLE_SECONDS = 60.0    # キオスクモードで無操作ならオープニング (アトラクト) へ戻るまでの秒数
+
+
+class GameContext:
+  # シーンをまたいで共有する状態 (ボタン配置、LAN 対戦、CPU 用グラフなど)
+  def __init__(self, options=None):
+    self.options = options
+    self.net_session = None  # LAN 対戦のセッション (--host / --join 指定時)
+    if options is not None and (options.host is not None or options.join):
+      self.net_session = create_net_session(options)
+    self.nav_graph = None    # CPU 用ナビゲーショングラフ (初回選択時にロード)
+    self.show_overview_map = True
+    self.show_debug = False  # F3: 計測値の表示
+    # 全体マップに重ねるヒートマップ (H キーでレイヤーを切り替え、初回に読み込む)
+    self.heatmap = None
+    self.heatmap_loaded = False
+    self.heatmap_layer = None    # heatmap.LAYERS の添字 (None なら表示しない)
+    self.heatmap_overlays = {}   # レイヤー名 -> 全体マップ用の画像
+    # プレイの記録 (書き出しスレッドは main で起動する。--no-telemetry で無効)
+    if options is not None and options.no_telemetry:
+      self.telemetry = None
+    else:
+      self.telemetry = telemetry.TelemetryWriter()
+    self.last_frame_ms = 0.0   # 直前のフレームの処理時間 (待ち時間を除く)
+    # マップの自動再読み込み (--watch-map、開発用)
+    if options is not None and options.watch_map:
+      self.map_watcher = mapwatch.MapWatcher(f"{IMAGE_PATH}/map_highres.png")
+    else:
+      self.map_watcher = None
+    self.map_notice = None     # (表示する文字列, 表示を始めた時刻)
+    # 先生のチャットの検索 (索引の読み込みも検索も裏のスレッド、main で起動する)
+    self.teacher = teacher.TeacherWorker()
+    # ゴールまでの時間のランキング (書き込みも上位の検索も裏のスレッド、main で起動する)
+    self.leaderboard = leaderboard.Leaderboard()
+    # ゴーストの書き出しと古いゴーストの削除 (裏のスレッド、main で起動する)
+    self.ghost_writer = ghost.GhostWriter()
+    # ゴールの瞬間の動画 (--capture、ワーカープロセスは main で画面を作った後に起動する)
+    if options is not None and options.capture:
+      self.capture = capture.FrameCapture(seconds=options.capture_seconds)
+    else:
+      self.capture = None
+
+    # ゲーム画面の描画倍率 (--render-scale で固定、指定がなければフレーム時間に合わせて自動)
+    fixed_scale = options.render_scale if options is not None else None
+    self.resolution = ResolutionScaler(fixed_scale)
+    # フレームの待ち方と入力遅延の計測
+    if options is not None:
+      self.pacer = pacing.FramePacer(FPS, options.pacing, clock, options.late_input)
+    else:
+      self.pacer = pacing.FramePacer(FPS, clock=clock)
+
+    # キオスクモード (文化祭の展示用: プロセスを終了せずにセッションを繰り返す)
+    self.kiosk = options is not None and options.kiosk
+    self.kiosk_idle = options.kiosk_idle if self.kiosk else None
+    self.session_count = 0
+    self.teardown_ms = 0.0     # 直前のセッションの後片付けにかかった時間
+    self.last_reset_ms = None
+    if self.kiosk:
+      # 途中で読み込みが入らないよう CPU 用グラフも先に読んでおく
+      self.nav_graph = navgraph.load_graph(map_size=(MAP_WIDTH, MAP_HEIGHT))
+
+    # 全体マップの位置を画面左上 (10, 10) に変更
+    self.overview_rect = pygame.Rect(0, 0, overview_width, overview_height)
+    self.overview_rect.topleft = (10, 10)
+
+    # モード選択ボタンの矩形
+    BTN_WIDTH = 250
+    BTN_HEIGHT = 80
+    center_x = SCREEN_WIDTH // 2
+    center_y = SCREEN_HEIGHT // 2
+
+    # ボタン位置の調整
+    self.btn_1p_rect = pygame.Rect(center_x - BTN_WIDTH // 2,
+                                   center_y - BTN_HEIGHT * 1.5, BTN_WIDTH, BTN_HEIGHT)
+    self.btn_2p_rect = pygame.Rect(center_x - BTN_WIDTH // 2,
+                                   center_y - BTN_HEIGHT * 0.5, BTN_WIDTH, BTN_HEIGHT)
+    self.btn_cpu_rect = pygame.Rect(
+        center_x - BTN_WIDTH // 2, center_y + BTN_HEIGHT * 0.5, BTN_WIDTH, BTN_HEIGHT)
+    self.btn_manual_rect = pygame.Rect(
+        center_x - BTN_WIDTH // 2, center_y + BTN_HEIGHT * 1.5, BTN_WIDTH, BTN_HEIGHT)
+
+    # 戻るボタン (説明書画面用)
+    BTN_BACK_WIDTH = 150
+    BTN_BACK_HEIGHT = 50
+    self.btn_back_rect = pygame.Rect(
+        SCREEN_WIDTH // 2 - BTN_BACK_WIDTH // 2,
+        SCREEN_HEIGHT - BTN_BACK_HEIGHT - 30,
+        BTN_BACK_WIDTH, BTN_BACK_HEIGHT)
+
+
+class OpeningScene(scenes.Scene):
+  # オープニング画像を表示してフェードアウトし、キー入力を待つ
+  def enter(self, manager):
+    super().enter(manager)
+    self.image = None
+    if opening_image:
+      # 画像を画面サイズに合わせる
+      self.image = asset_registry.add("screen", "opening image", pygame.transform.scale(
+          opening_image, (SCREEN_WIDTH, SCREEN_HEIGHT)))
+    self.fade_surface = asset_registry.add("screen", "opening fade",
+                                           pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)))
+    self.fade_surface.fill((0, 0, 0))
+
+    # キー待ち画面は変化しないので先に描いておく
+    self.waiting_surface = asset_registry.add("screen", "opening waiting",
+                                              pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)))
+    self.waiting_surface.fill((0, 0, 0))
+    if self.image:
+      self.waiting_surface.blit(self.image, (0, 0))
+    self.fade_surface.set_alpha(150)     # 少し暗くする
+    self.waiting_surface.blit(self.fade_surface, (0, 0))
+    press_key_text = "Press any key or click to proceed"
+    draw_text_border(self.waiting_surface, press_key_text, font, (255, 255, 255), (0, 0, 0),
+                     SCREEN_WIDTH // 2 - font.size(press_key_text)[0] // 2,
+                     SCREEN_HEIGHT - 50, 2)
+    self.waiting_drawn = False
+
+  def handle_event(self, event):
+    # 演出が終わった後のキー入力で遷移
+    if event.type == pygame.KEYDOWN and self.elapsed() >= OPENING_SHOW_DURATION:
+      if self.manager.context.net_session:
+        # LAN 対戦はモード選択を飛ばして接続待ちへ
+        self.manager.switch(LoadingScene(2))
+      else:
+        self.manager.switch(SelectModeScene())
+
+  def frame_rate(self):
+    # キー待ち画面は静止しているのでフレームレートを落とす
+    return IDLE_FPS if self.waiting_drawn else None
+
+  def render(self, surface):
+    elapsed = self.elapsed()
+    if elapsed >= OPENING_SHOW_DURATION:
+      if self.waiting_drawn:
+        return []     # 前のフレームから変化なし (画面を送らない)
+      surface.blit(self.waiting_surface, (0, 0))
+      self.waiting_drawn = True
+      return None
+    surface.fill((0, 0, 0))
+    if self.image:
+      surface.blit(self.image, (0, 0))
+      # フェードアウト処理 (最後の1秒)
+      if elapsed > OPENING_SHOW_DURATION - 1.0:
+        alpha = int(255 * (1.0 - (elapsed - (OPENING_SHOW_DURATION - 1.0))))
+        self.fade_surface.set_alpha(max(0, alpha))
+        surface.blit(self.fade_surface, (0, 0))
+
+
+class SelectModeScene(scenes.Scene):
+  # 1P/2P/CPU対戦/説明書の選択
+  def enter(self, manager):
+    super().enter(manager)
+    ctx = manager.context
+    self.background = asset_registry.add("screen", f"{type(self).__name__} background",
+                                         pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)))
+    draw_select_mode_screen(self.background, title_font, button_font, ctx.btn_1p_rect,
+                            ctx.btn_2p_rect, ctx.btn_cpu_rect, ctx.btn_manual_rect, "MAIN_SELECT")
+    if ctx.kiosk:
+      self.idle_timeout = ctx.kiosk_idle
+      kiosk_text = f"KIOSK  session {ctx.session_count}"
+      if ctx.last_reset_ms is not None:
+        kiosk_text += f"  reset {ctx.last_reset_ms:.2f} ms"
+      kiosk_render = font.render(kiosk_text, True, (150, 150, 150))
+      self.background.blit(kiosk_render, (10, SCREEN_HEIGHT - kiosk_render.get_height() - 10))
+    self.board_rect = None
+    self.draw_board()
+
+    # 画面は背景として一度だけ描き、ホバーで変わったボタンだけを送る
+    self.ui = ui.RetainedScreen(self.background)
+    rects = (ctx.btn_1p_rect, ctx.btn_2p_rect, ctx.btn_cpu_rect, ctx.btn_manual_rect)
+    for rect, (color, label), action in zip(rects, SELECT_BUTTONS, ("1p", "2p", "cpu", "manual")):
+      self.ui.add_button(rect, make_hover_image(self.background, rect, color, label, button_font),
+                         action)
+    self.ui.update_hover(pygame.mouse.get_pos())
+
+  def handle_event(self, event):
+    action = self.ui.handle_event(event)
+    ctx = self.manager.context
+    if action == "1p":
+      self.manager.switch(LoadingScene(1))
+    elif action == "2p":
+      self.manager.switch(LoadingScene(2))
+    elif action == "cpu":
+      if ctx.nav_graph is None:
+        ctx.nav_graph = navgraph.load_graph(map_size=(MAP_WIDTH, MAP_HEIGHT))
+      if ctx.nav_graph:     # グラフがなければ CPU 対戦は選べない
+        self.manager.switch(LoadingScene(2, vs_cpu=True))
       else:
-          # アニメーション終了後、キー待ち状態の描画
-        if opening_image:
-          scaled_img = pygame.transform.scale(
-              opening_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
-          screen.blit(scaled_img, (0, 0))
-
-        # フェードアウト後の透明度調整 (キー待ち状態を示す)
-        fade_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-        fade_surface.fill((0, 0, 0))
-        fade_surface.set_alpha(150)     # 少し暗くする
-        screen.blit(fade_surface, (0, 0))
-
-        # キー入力待ちのメッセージ
-        press_key_text = "Press any key or click to proceed"
-        draw_text_border(screen, press_key_text, font, (255, 255, 255), (0, 0, 0),
-                         SCREEN_WIDTH // 2 -
-                         font.size(press_key_text)[0] // 2,
-                         SCREEN_HEIGHT - 50, 2)
-
-    elif game_state == STATE_SELECT_MODE:
-      draw_select_mode_screen(
-          screen, title_font, button_font, btn_1p_rect, btn_2p_rect, btn_manual_rect, "MAIN_SELECT")
-
-    elif game_state == STATE_MANUAL:
-      draw_manual_screen(screen, title_font, font, btn_back_rect)
-
-    elif game_state == STATE_LOADING:
-      run_loading_screen(screen, loading_background, title_font)
-
-      # 音声再生の制御 (一度だけ再生)
-      if not voice_played_after_loading and "areyouready" in voice_dict:
-        try:
-          if voice_dict["areyouready"].get_length() > 0:
-            voice_dict["areyouready"].play()
-        except Exception:
+        self.show_notice(NAVGRAPH_MISSING_TEXT)
+    elif action == "manual":
+      self.manager.switch(ManualScene())     # 説明書画面へ
+
+  def show_notice(self, lines):
+    # ボタンの下に注意書きを出す (背景に描き、その範囲だけ送る)
+    y = self.manager.context.btn_manual_rect.bottom + 20
+    for line in lines:
+      width, height = table_font.size(line)
+      x = SCREEN_WIDTH // 2 - width // 2
+      rect = pygame.Rect(x - 1, y - 1, width + 2, height + 2)
+      self.background.fill(SELECT_BACKGROUND_COLOR, rect)     # 2回目以降のクリックで縁が重ならないように
+      draw_text_border(self.background, line, table_font, SELECT_NOTICE_COLOR, (0, 0, 0), x, y, 1)
+      self.ui.invalidate(rect)
+      y += height
+
+  def draw_board(self):
+    # 今日のランキング (裏のスレッドが作った控え) を背景の右側に描き、変わった範囲を返す
+    board = self.manager.context.leaderboard
+    self.board_version = board.version
+    old_rect = self.board_rect
+    if old_rect:
+      self.background.fill(SELECT_BACKGROUND_COLOR, old_rect)
+    self.board_rect = draw_leaderboard(self.background, board.top_day(), table_font,
+                                       SELECT_LEADERBOARD_POS, "TODAY'S TOP 10", centered=True)
+    return self.board_rect.union(old_rect) if old_rect else self.board_rect
+
+  def update(self, keys):
+    # 記録が書き込まれて控えが変わったら表だけ描き直す
+    if self.manager.context.leaderboard.version != self.board_version:
+      self.ui.invalidate(self.draw_board())
+
+  def on_idle(self):
+    self.manager.switch(OpeningScene())     # キオスクモード: アトラクト画面へ
+
+  def frame_rate(self):
+    # しばらく見た目が変わっていなければフレームレートを落とす
+    return IDLE_FPS if self.ui.idle_for() > IDLE_AFTER else None
+
+  def render(self, surface):
+    return self.ui.render(surface)
+
+
+class ManualScene(scenes.Scene):
+  # 説明書表示
+  def enter(self, manager):
+    super().enter(manager)
+    self.background = asset_registry.add("screen", f"{type(self).__name__} background",
+                                         pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)))
+    draw_manual_screen(self.background, title_font, font, manager.context.btn_back_rect)
+    if manager.context.kiosk:
+      self.idle_timeout = manager.context.kiosk_idle
+
+    rect = manager.context.btn_back_rect
+    self.ui = ui.RetainedScreen(self.background)
+    self.ui.add_button(rect, make_hover_image(self.background, rect, BACK_BUTTON_COLOR, "Back", font),
+                       "back")
+    self.ui.update_hover(pygame.mouse.get_pos())
+
+  def on_idle(self):
+    self.manager.switch(OpeningScene())
+
+  def handle_event(self, event):
+    if self.ui.handle_event(event) == "back":
+      self.manager.switch(SelectModeScene())     # モード選択画面へ戻る
+
+  def frame_rate(self):
+    return IDLE_FPS if self.ui.idle_for() > IDLE_AFTER else None
+
+  def render(self, surface):
+    return self.ui.render(surface)
+
+
+class LoadingScene(scenes.Scene):
+  # ロード画面 (LAN 対戦では相手の接続もここで待つ)
+  def __init__(self, play_mode, vs_cpu=False):
+    self.play_mode = play_mode     # 1: 1P, 2: 2P
+    self.vs_cpu = vs_cpu           # 2P 側を CPU が操作する
+
+  def enter(self, manager):
+    super().enter(manager)
+    self.background = None
+    if loading_background:
+      self.background = asset_registry.add("screen", "LoadingScene background",
+                                           pygame.transform.scale(loading_background,
+                                                                  (SCREEN_WIDTH, SCREEN_HEIGHT)))
+    self.waiting = False
+
+    # 音声再生 (ロード毎に一度だけ)
+    if "areyouready" in voice_dict:
+      try:
+        if voice_dict["areyouready"].get_length() > 0:
           voice_dict["areyouready"].play()
-        voice_played_after_loading = True
-
-      if time.time() - loading_start_time >= LOADING_DURATION:
-          # ロード完了後の初期化処理
-        game_start_time = time.time()
-        current_bgm = switch_bgm("original", "")
-
-        if play_mode == 1:
-            # 1P 初期化
-          player1 = Player(1, image_right, image_left,
-                           2800.0, CHANNEL_P1_SFX, CHANNEL_P1_WIND)
-          camera1 = Camera(CAMERA_WIDTH_1P, CAMERA_HEIGHT)
-          # Fullscreen P1 screen surface
-          SCREEN_SURFACE_P1 = screen.subsurface(
-              pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
-
-        elif play_mode == 2:
-            # 2P 初期化
-          player1 = Player(1, image_right, image_left,
-                           2800.0, CHANNEL_P1_SFX, CHANNEL_P1_WIND)
-          player2 = Player(2, image_right, image_left,
-                           3200.0, CHANNEL_P2_SFX, CHANNEL_P2_WIND)
-          camera1 = Camera(CAMERA_WIDTH_2P, CAMERA_HEIGHT)
-          camera2 = Camera(CAMERA_WIDTH_2P, CAMERA_HEIGHT)
-          # Split screen surfaces
-          SCREEN_SURFACE_P1 = screen.subsurface(
-              pygame.Rect(0, 0, HALF_SCREEN_WIDTH, SCREEN_HEIGHT))
-          SCREEN_SURFACE_P2 = screen.subsurface(pygame.Rect(
-              HALF_SCREEN_WIDTH, 0, HALF_SCREEN_WIDTH, SCREEN_HEIGHT))
-
-        game_state = STATE_PLAYING
-
-    elif game_state == STATE_PLAYING:
-        # --- 時間の計算 --- (チャットアクティブ/非アクティブに関わらず進行)
-      current_time = time.time()
-      elapsed_time = current_time - game_start_time
-      remaining_time = max(0, TIME_LIMIT - elapsed_time)
-      timer_text = f"TIME: {int(remaining_time):03d}s"
-
-      # チャットがアクティブでない場合のみプレイヤーを更新
-      if not is_chat_active:
-        # --- プレイヤー更新 (モードに基づく) ---
-        if play_mode == 1 and player1 and camera1:
-          player1.update(keys, control_map_p1)
-          highest_y = player1.y
-        elif play_mode == 2 and player1 and player2 and camera1 and camera2:
-          player1.update(keys, control_map_p1)
-          player2.update(keys, control_map_p2)
-          highest_y = max(player1.y, player2.y)
-        else:
-          highest_y = 0
+      except Exception:
+        voice_dict["areyouready"].play()
+
+  def update(self, keys):
+    net_session = self.manager.context.net_session
+    self.waiting = bool(net_session) and not net_session.poll_handshake()
+    if not self.waiting and self.elapsed() >= LOADING_DURATION:
+      self.manager.switch(PlayingScene(self.play_mode, self.vs_cpu))
+
+  def render(self, surface):
+    run_loading_screen(surface, self.background, title_font)
+    if self.waiting:
+      waiting_text = "Waiting for opponent..."
+      draw_text_border(surface, waiting_text, font, (255, 255, 255), (0, 0, 0),
+                       SCREEN_WIDTH // 2 - font.size(waiting_text)[0] // 2,
+                       SCREEN_HEIGHT - 80, 2)
+
+
+class PlayingScene(scenes.Scene):
+  # ゲームプレイ中
+  def __init__(self, play_mode, vs_cpu=False):
+    self.play_mode = play_mode
+    self.vs_cpu = vs_cpu
+
+  def enter(self, manager):
+    # セッションごとの状態だけを作り直す (画像・音声・フォントは読み込み済みのものを使う)
+    setup_start = time.perf_counter()
+    super().enter(manager)
+    ctx = manager.context
+    self.net_session = ctx.net_session
+    self.ghost_save_ms = 0.0
+    self.player2 = None
+    self.camera2 = None
+    self.cpu_bot = None
+    self.current_zoom_p1 = 1.0
+    self.current_zoom_p2 = 1.0
+    self.camera_smoothing = 0.15
+    self.timer_text = ""
+    self.remaining_time = TIME_LIMIT
+
+    # --- チャット関連変数 ---
+    self.is_chat_active = False  # ~キーで表示されるチャットボックスがアクティブかどうか
+    self.chat_input_text = ""
+    self.chat_history = []
+
+    self.game_start_time = time.time()
+    self.current_bgm = switch_bgm("original", "")
+
+    half_screen_width = SCREEN_WIDTH // 2
+    if self.play_mode == 1:
+        # 1P 初期化
+      self.player1 = Player(1, image_right, image_left,
+                            2800.0, CHANNEL_P1_SFX, CHANNEL_P1_WIND)
+      self.camera1 = Camera(CAMERA_WIDTH_1P, CAMERA_HEIGHT)
+      # Fullscreen P1 screen surface
+      self.surface_p1 = screen.subsurface(
+          pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
+      self.surface_p2 = None
+    else:
+        # 2P 初期化
+      self.player1 = Player(1, image_right, image_left,
+                            2800.0, CHANNEL_P1_SFX, CHANNEL_P1_WIND)
+      self.player2 = Player(2, image_right, image_left,
+                            3200.0, CHANNEL_P2_SFX, CHANNEL_P2_WIND)
+      self.camera1 = Camera(CAMERA_WIDTH_2P, CAMERA_HEIGHT)
+      self.camera2 = Camera(CAMERA_WIDTH_2P, CAMERA_HEIGHT)
+      if self.vs_cpu:
+        self.cpu_bot = bot.BotController(ctx.nav_graph, CONTROL_MAP_P2)
+      if self.net_session:
+        self.net_session.players = [self.player1, self.player2]
+      # Split screen surfaces
+      self.surface_p1 = screen.subsurface(
+          pygame.Rect(0, 0, half_screen_width, SCREEN_HEIGHT))
+      self.surface_p2 = screen.subsurface(pygame.Rect(
+          half_screen_width, 0, half_screen_width, SCREEN_HEIGHT))
+
+    # HUD はビューごとに1枚 (2人のときは中央のタイマー用に画面全体の分も)
+    self.hud_p1 = ui.HudLayer(self.surface_p1.get_size())
+    self.hud_p2 = ui.HudLayer(self.surface_p2.get_size()) if self.surface_p2 else None
+    self.hud_screen = ui.HudLayer((SCREEN_WIDTH, SCREEN_HEIGHT)) if self.surface_p2 else None
+
+    # ゴーストの読み込みと記録の準備 (操作しているプレイヤーのみ記録)
+    self.ghosts = ghost.load_best_ghosts()
+    self.ghost_frame = 0     # プレイ開始からのフレーム数 (ゴースト再生位置)
+    meta = {"mode": self.play_mode}
+    self.ghost_recorders = [(self.player1, ghost.GhostRecorder(FPS, meta))]
+    if self.net_session:
+      if self.net_session.local == 1:
+        self.ghost_recorders = [(self.player2, ghost.GhostRecorder(FPS, meta))]
+    elif self.play_mode == 2 and not self.cpu_bot:
+      self.ghost_recorders.append((self.player2, ghost.GhostRecorder(FPS, meta)))
+
+    self.telemetry = ctx.telemetry
+    if self.telemetry:
+      self.telemetry.begin_session(3 if self.cpu_bot else self.play_mode)
+      for player in (self.player1, self.player2):
+        if player:
+          player.telemetry = self.telemetry
+
+    if ctx.kiosk and not self.net_session:
+      # 無操作のまま放置されたら (遊んでいた人が帰った) セッションを打ち切る
+      self.idle_timeout = ctx.kiosk_idle * 2
+
+    # 前のセッションの後片付け + 今回の準備 = セッションのリセット時間
+    setup_ms = (time.perf_counter() - setup_start) * 1000
+    ctx.session_count += 1
+    ctx.last_reset_ms = ctx.teardown_ms + setup_ms
+    print(f"[INFO] Session {ctx.session_count} reset in {ctx.last_reset_ms:.2f} ms "
+          f"(teardown {ctx.teardown_ms:.2f} ms, setup {setup_ms:.2f} ms)")
+
+  def exit(self):
+    teardown_start = time.perf_counter()
+    if self.telemetry:
+      # 途中で打ち切られたセッション (無操作・終了) も終わりを記録する
+      goal_player = next((p.player_id for p in (self.player1, self.player2) if p and p.is_goal), 0)
+      self.telemetry.end_session(self.ghost_frame / FPS, goal_player)
+    reset_session_audio()
+    ctx = self.manager.context
+    if ctx.net_session:
+      # LAN 対戦は1回ごと (終わったら以降はローカルで遊ぶ)。試合の途中で抜けたときはここで閉じる
+      ctx.net_session.close()
+      ctx.net_session = None
+    ctx.teardown_ms = self.ghost_save_ms + (time.perf_counter() - teardown_start) * 1000
+
+  def on_idle(self):
+    print("[INFO] Session abandoned (idle)")
+    self.manager.switch(OpeningScene())
+
+  def handle_event(self, event):
+    if event.type != pygame.KEYDOWN:
+      return
+    # ~キーでのチャットトグル処理
+    if event.key == pygame.K_BACKQUOTE:  # ~または`キー
+      self.is_chat_active = not self.is_chat_active
+      if self.is_chat_active:
+        self.chat_input_text = ""  # 入力リセット
+
+    if self.is_chat_active:
+      # チャットがアクティブのときのみ、テキスト入力と送信を処理
+      if event.key == pygame.K_RETURN:
+        if self.chat_input_text.strip():
+          # プレイヤーメッセージを履歴に追加
+          player_msg = self.chat_input_text.strip()
+          self.chat_history.append(
+              {"sender": "Player", "text": player_msg, "time": time.time()})
+          if self.telemetry:
+            self.telemetry.log(telemetry.EVENT_CHAT, 1, self.player1.x, self.player1.y,
+                               len(player_msg))
+
+          # 先生の回答は裏のスレッドで探し、届いたら update で履歴に追加する
+          self.manager.context.teacher.ask(player_msg, self)
+          self.chat_input_text = ""  # 入力リセット
+
+      elif event.key == pygame.K_BACKSPACE:
+        self.chat_input_text = self.chat_input_text[:-1]
+      elif event.key == pygame.K_ESCAPE:
+        self.is_chat_active = False  # Escキーでチャットを閉じる
+
+      # 文字入力イベント (KEYDOWNイベントにunicode属性がある場合)
+      # IMEからの入力に対応するため、KEYDOWNで文字が送られてきた場合も捕捉
+      elif event.unicode and event.key != pygame.K_BACKQUOTE:
+          # 特殊キーや制御文字を除外してテキストに追加
+        if len(event.unicode) == 1:
+          self.chat_input_text += event.unicode
 
-        # BGM 切り替え
-        if highest_y < 9500:
-          current_bgm = switch_bgm("original", current_bgm)
-        elif highest_y < 25000:
-          current_bgm = switch_bgm("mid", current_bgm)
+    else:
+      # チャットが非アクティブのときのみ、ゲーム内操作キーを処理
+      ctx = self.manager.context
+      if event.key == pygame.K_m:
+        ctx.show_overview_map = not ctx.show_overview_map
+      elif event.key == pygame.K_F3:
+        ctx.show_debug = not ctx.show_debug
+      elif event.key == pygame.K_h:
+        self.cycle_heatmap()
+
+  def cycle_heatmap(self):
+    # 表示なし -> 各レイヤー -> 表示なし
+    ctx = self.manager.context
+    if not ctx.heatmap_loaded:
+      ctx.heatmap_loaded = True
+      ctx.heatmap = heatmap.load_heatmap()
+      if ctx.heatmap is None:
+        print(f"[WARNING] {heatmap.HEATMAP_PATH} not found (run hisayoshi/heatmap.py)")
+      elif ctx.heatmap["map_size"] != (MAP_WIDTH, MAP_HEIGHT):
+        print(f"[WARNING] Heatmap was built for map size {ctx.heatmap['map_size']}, ignoring")
+        ctx.heatmap = None
+    if ctx.heatmap is None:
+      return
+    if ctx.heatmap_layer is None:
+      ctx.heatmap_layer = 0
+    elif ctx.heatmap_layer + 1 < len(heatmap.LAYERS):
+      ctx.heatmap_layer += 1
+    else:
+      ctx.heatmap_layer = None
+
+  def heatmap_overlay(self):
+    ctx = self.manager.context
+    if ctx.heatmap_layer is None:
+      return None
+    layer = heatmap.LAYERS[ctx.heatmap_layer]
+    if layer not in ctx.heatmap_overlays:
+      overlay = make_heatmap_overlay(ctx.heatmap, layer, (overview_width, overview_height))
+      ctx.heatmap_overlays[layer] = asset_registry.add("cache", f"heatmap {layer}", overlay)
+    return ctx.heatmap_overlays[layer], f"{layer} ({ctx.heatmap['sessions']})"
+
+  def receive_teacher_answers(self):
+    # 届いた先生の回答を履歴に追加する (前のセッションで聞いた分は捨てる)
+    for asker, question, answer, _ in self.manager.context.teacher.poll():
+      if asker is not self:
+        continue
+      if answer is None:
+        # 近い回答がなければ (索引がないときも) 従来どおりの決まり文句
+        answer = TORUS_RESPONSE if "ダブルトーラス" in question else random.choice(TEACHER_MESSAGES)
+      self.chat_history.append({"sender": "Teacher", "text": answer, "time": time.time()})
+
+  def update(self, keys):
+    player1, player2 = self.player1, self.player2
+    net_session = self.net_session
+    self.receive_teacher_answers()
+
+    # --- 時間の計算 --- (チャットアクティブ/非アクティブに関わらず進行)
+    elapsed_time = time.time() - self.game_start_time
+    if net_session:
+      # LAN 対戦では両方の画面で結果が一致するようフレーム数で計時する
+      elapsed_time = net_session.frame / FPS
+    self.remaining_time = max(0, TIME_LIMIT - elapsed_time)
+    self.timer_text = f"TIME: {int(self.remaining_time):03d}s"
+
+    # チャットがアクティブでない場合のみプレイヤーを更新
+    # (LAN 対戦では相手が止まらないので、入力を空にして進め続ける)
+    if not self.is_chat_active or net_session:
+      # --- プレイヤー更新 (モードに基づく) ---
+      frame_advanced = True
+      if net_session:
+        local_input = 0 if self.is_chat_active else netplay.encode_input(
+            keys, CONTROL_MAP_P1)
+        frame_advanced = net_session.advance(local_input)
+        highest_y = max(player1.y, player2.y)
+      elif self.play_mode == 1:
+        player1.update(keys, CONTROL_MAP_P1)
+        highest_y = player1.y
+      else:
+        player1.update(keys, CONTROL_MAP_P1)
+        if self.cpu_bot:
+          player2.update(self.cpu_bot.update(player2), CONTROL_MAP_P2)
         else:
-          current_bgm = switch_bgm("high", current_bgm)
-
-        # ズームとカメラ更新
-        if player1 and camera1:
-          target_zoom_p1 = ZOOM_OUT_SCALE if player1.is_zooming_out else 1.0
-          current_zoom_p1 += (target_zoom_p1 - current_zoom_p1) * ZOOM_SMOOTHING
-          camera1.update(player1, camera_smoothing, current_zoom_p1)
-
-        if play_mode == 2 and player2 and camera2:
-          target_zoom_p2 = ZOOM_OUT_SCALE if player2.is_zooming_out else 1.0
-          current_zoom_p2 += (target_zoom_p2 - current_zoom_p2) * ZOOM_SMOOTHING
-          camera2.update(player2, camera_smoothing, current_zoom_p2)
-
-      # --- ゲームオーバー判定 ---
-      game_over = False
-      if remaining_time <= 0:
-        game_over = True
-        game_end_message = "TIME OVER!"
-      elif play_mode == 1 and player1 and player1.is_goal:
-        game_over = True
-        game_end_message = "GOAL! YOU MADE IT!"
-      elif play_mode == 2 and (player1 or player2):
-        if (player1 and player1.is_goal) or (player2 and player2.is_goal):
-          game_over = True
-          if player1 and player1.is_goal and player2 and player2.is_goal:
-            game_end_message = "DRAW! Both players reached the goal!"
-          elif player1 and player1.is_goal:
-            game_end_message = "1P WINS! (Goal Reached)"
-          else:
-            game_end_message = "2P WINS! (Goal Reached)"
-
-      if game_over:
-        game_state = STATE_GAME_OVER
-        pygame.mixer.music.stop()
-
-      # --- 描画 ---
-      screen.fill((0, 0, 0))
-
-      # タイマー描画の準備
-      timer_text_render = font.render(timer_text, True, (255, 0, 0))
-      timer_rect = timer_text_render.get_rect()
-
-      if play_mode == 1 and player1 and camera1:
-          # 1P ゲームビューを描画 (フルスクリーン)
-        draw_game_view(screen, player1, camera1, CAMERA_WIDTH_1P,
-                       CAMERA_HEIGHT, current_zoom_p1, None, font)
-
-        # タイマーを描画 (フルスクリーンの右上)
-        timer_rect.topright = (SCREEN_WIDTH - 10, 50)
-        screen.blit(timer_text_render, timer_rect)
-
-        # 全体マップを描画 (左上に設定した overview_rect を使用)
-        if show_overview_map:
-          # 1Pモードでは overview_rect の位置をそのまま使用 (左上)
-          draw_overview_map(screen, player1, None, overview_width,
-                            overview_height, MAP_WIDTH, MAP_HEIGHT, font, overview_rect)
-
-      elif play_mode == 2 and player1 and player2 and camera1 and camera2:
-          # 1P ゲームビューを描画 (左側)
-        draw_game_view(SCREEN_SURFACE_P1, player1, camera1,
-                       CAMERA_WIDTH_2P, CAMERA_HEIGHT, current_zoom_p1, "1P", font)
-
-        # 2P ゲームビューを描画 (右側)
-        draw_game_view(SCREEN_SURFACE_P2, player2, camera2,
-                       CAMERA_WIDTH_2P, CAMERA_HEIGHT, current_zoom_p2, "2P", font)
-
-        # 中央に区切り線を描画 (色を黒に変更)
-        pygame.draw.line(screen, (0, 0, 0),
-                         (HALF_SCREEN_WIDTH, 0), (HALF_SCREEN_WIDTH, SCREEN_HEIGHT), 3)
-
-        # タイマーを描画 (中央上部)
-        timer_rect.centerx = SCREEN_WIDTH // 2
-        timer_rect.top = 10
-        draw_text_border(screen, timer_text, font, (255, 0, 0), (0, 0, 0),
-                         timer_rect.left, timer_rect.top, 2)
-
-        # 全体マップを描画 (P1画面の左上に表示)
-        if show_overview_map:
-          # P1画面用の概要マップ矩形 (左画面の左上)
-          # overview_rectは既に(10, 10)になっているため、これをそのまま使用
-          draw_overview_map(screen, player1, player2, overview_width,
-                            overview_height, MAP_WIDTH, MAP_HEIGHT, font, overview_rect)
+          player2.update(keys, CONTROL_MAP_P2)
+        highest_y = max(player1.y, player2.y)
+
+      # ゴーストの記録と再生位置
+      if frame_advanced:
+        for recorded_player, recorder in self.ghost_recorders:
+          recorder.record(recorded_player)
+        self.ghost_frame += 1
+        if self.telemetry:
+          self.log_frame()
+
+      # BGM 切り替え
+      if highest_y < 9500:
+        self.current_bgm = switch_bgm("original", self.current_bgm)
+      elif highest_y < 25000:
+        self.current_bgm = switch_bgm("mid", self.current_bgm)
+      else:
+        self.current_bgm = switch_bgm("high", self.current_bgm)
+
+      # ズームとカメラ更新
+      target_zoom_p1 = ZOOM_OUT_SCALE if player1.is_zooming_out else 1.0
+      self.current_zoom_p1 += (target_zoom_p1 - self.current_zoom_p1) * ZOOM_SMOOTHING
+      self.camera1.update(player1, self.camera_smoothing, self.current_zoom_p1)
+
+      if player2:
+        target_zoom_p2 = ZOOM_OUT_SCALE if player2.is_zooming_out else 1.0
+        self.current_zoom_p2 += (target_zoom_p2 - self.current_zoom_p2) * ZOOM_SMOOTHING
+        self.camera2.update(player2, self.camera_smoothing, self.current_zoom_p2)
+
+    # --- ゲームオーバー判定 ---
+    goals = (player1.is_goal, bool(player2 and player2.is_goal))
+    time_over = self.remaining_time <= 0
+    clear_ms = (time.time() - self.game_start_time) * 1000
+    connection_lost = False
+    if net_session:
+      # 予測した相手の入力を含む今の状態で決めると2台で結果が分かれるので、
+      # 両方の入力が確定したフレームの状態で決める (どちらも同じフレームで終わる)
+      result = net_session.confirmed_result(TIME_LIMIT * FPS - 1)
+      goals = result[1] if result else (False, False)
+      time_over = result is not None and not any(goals)
+      connection_lost = net_session.disconnected and result is None
+      if result:
+        clear_ms = (result[0] + 1) * 1000 / FPS
+
+    game_end_message = None
+    if connection_lost:
+      game_end_message = "CONNECTION LOST"
+    elif time_over:
+      game_end_message = "TIME OVER!"
+    elif self.play_mode == 1 and goals[0]:
+      game_end_message = "GOAL! YOU MADE IT!"
+    elif self.play_mode == 2 and any(goals):
+      if all(goals):
+        game_end_message = "DRAW! Both players reached the goal!"
+      elif goals[0]:
+        game_end_message = "1P WINS! (Goal Reached)"
+      else:
+        game_end_message = "CPU WINS! (Goal Reached)" if self.cpu_bot else "2P WINS! (Goal Reached)"
+
+    if game_end_message:
+      ctx = self.manager.context
+      mode = 3 if self.cpu_bot else self.play_mode
+      if ctx.capture:
+        for player in (player1, player2):
+          if player and goals[player.player_id - 1]:
+            ctx.capture.save_clip(f"goal_p{player.player_id}")     # 直近の数秒を保存 (待たない)
+            break
+      save_start = time.perf_counter()
+      for recorded_player, recorder in self.ghost_recorders:
+        recorder.meta["goal"] = goals[recorded_player.player_id - 1]
+        ctx.ghost_writer.submit(recorder, f"p{recorded_player.player_id}")
+      # ゴールした操作中のプレイヤーの時間をランキングへ (書き込みは裏のスレッド)
+      records = [ctx.leaderboard.submit(mode, clear_ms, f"{recorded_player.player_id}P")
+                 for recorded_player, _ in self.ghost_recorders
+                 if goals[recorded_player.player_id - 1]]
+      self.ghost_recorders = []
+      self.ghost_save_ms = (time.perf_counter() - save_start) * 1000
+      # LAN 対戦のセッションは終了画面に渡し、相手に入力が届くまで送り続ける
+      self.manager.switch(EndScene(game_end_message, records, mode, net_session))
+      ctx.net_session = None
+
+  def log_frame(self):
+    # 1フレーム分の記録 (フレーム時間は毎フレーム、位置は POSITION_INTERVAL ごと)
+    tele = self.telemetry
+    tele.frame = self.ghost_frame
+    tele.log(telemetry.EVENT_FRAME_TIME, value=self.manager.context.last_frame_ms)
+    if self.ghost_frame % telemetry.POSITION_INTERVAL == 0:
+      for player in (self.player1, self.player2):
+        if player:
+          tele.log(telemetry.EVENT_POSITION, player.player_id, player.x, player.y, player.vy)
+
+  def render(self, surface):
+    ctx = self.manager.context
+    surface.fill((0, 0, 0))
+
+    if self.play_mode == 1:
+      # タイマー (フルスクリーンの右上) は 1P のビューの HUD に置く (1秒に1回だけ描き直す)
+      self.hud_p1.set("timer", self.timer_text,
+                      lambda text: font.render(text, True, (255, 0, 0)),
+                      topright=(SCREEN_WIDTH - 10, 50))
+        # 1P ゲームビューを描画 (フルスクリーン)
+      draw_game_view(self.surface_p1, self.player1, self.camera1, CAMERA_WIDTH_1P,
+                     CAMERA_HEIGHT, self.current_zoom_p1, None, font,
+                     self.ghosts, self.ghost_frame, ctx.resolution.scale, self.hud_p1)
+
+      # 全体マップを描画 (左上に設定した overview_rect を使用)
+      if ctx.show_overview_map:
+        draw_overview_map(surface, self.player1, None, overview_width,
+                          overview_height, MAP_WIDTH, MAP_HEIGHT, font, ctx.overview_rect,
+                          self.ghosts, self.ghost_frame, self.heatmap_overlay())
 
-      # --- Chat Boxの描画 (ゲーム画面の上に重ねて描画) ---
-      if is_chat_active or (game_state == STATE_PLAYING and not is_chat_active):
-          # is_chat_activeがTrueの時、またはプレイ中にヒントのために常に描画
-        draw_chat_box(screen, font, is_chat_active,
-                      chat_input_text, chat_history)
+    else:
+        # 1P ゲームビューを描画 (左側)
+      draw_game_view(self.surface_p1, self.player1, self.camera1,
+                     CAMERA_WIDTH_2P, CAMERA_HEIGHT, self.current_zoom_p1, "1P", font,
+                     self.ghosts, self.ghost_frame, ctx.resolution.scale, self.hud_p1)
+
+      # 2P ゲームビューを描画 (右側)
+      draw_game_view(self.surface_p2, self.player2, self.camera2,
+                     CAMERA_WIDTH_2P, CAMERA_HEIGHT, self.current_zoom_p2,
+                     "CPU" if self.cpu_bot else "2P", font, self.ghosts, self.ghost_frame,
+                     ctx.resolution.scale, self.hud_p2)
+
+      # 中央に区切り線を描画 (色を黒に変更)
+      pygame.draw.line(surface, (0, 0, 0),
+                       (SCREEN_WIDTH // 2, 0), (SCREEN_WIDTH // 2, SCREEN_HEIGHT), 3)
+
+      # タイマーを描画 (中央上部、縁の分だけ左上にずらして置く)
+      self.hud_screen.set("timer", self.timer_text,
+                          lambda text: render_text_border(text, font, (255, 0, 0), (0, 0, 0), 2),
+                          midtop=(SCREEN_WIDTH // 2, 8))
+
+      # LAN 対戦の計測値 (巻き戻しフレーム数と再シミュレーション時間)
+      if self.net_session:
+        stats = self.net_session.stats()
+        net_text = (f"RB {stats['rollback_avg']:.1f}/{stats['rollback_max']}f "
+                    f"{stats['resim_ms_avg']:.2f}ms")
+        self.hud_screen.set("net", net_text, lambda text: font.render(text, True, (255, 255, 255)),
+                            midtop=(SCREEN_WIDTH // 2, 10 + font.get_height() + 5))
+      self.hud_screen.blit(surface)
+
+      # 全体マップを描画 (P1画面の左上に表示)
+      if ctx.show_overview_map:
+        draw_overview_map(surface, self.player1, self.player2, overview_width,
+                          overview_height, MAP_WIDTH, MAP_HEIGHT, font, ctx.overview_rect,
+                          self.ghosts, self.ghost_frame, self.heatmap_overlay())
+
+    # --- Chat Boxの描画 (ゲーム画面の上に重ねて描画、非アクティブ時もヒントのために表示) ---
+    draw_chat_box(surface, font, self.is_chat_active,
+                  self.chat_input_text, self.chat_history)
+
+    if ctx.show_debug:
+      huds = [hud for hud in (self.hud_p1, self.hud_p2, self.hud_screen) if hud]
+      draw_debug_overlay(surface, font, ctx, self.player1, huds)
+    if ctx.map_notice and time.time() - ctx.map_notice[1] < MAP_NOTICE_SECONDS:
+      draw_text_border(surface, ctx.map_notice[0], font, (255, 255, 0), (0, 0, 0),
+                       10, SCREEN_HEIGHT - 40, 2)
+
+
+class EndScene(scenes.TimedScene):
+  # ゲームオーバー画面 (一定時間表示してモード選択へ戻る)
+  duration = END_SCREEN_DURATION
+
+  def __init__(self, message, records=(), mode=None, net_session=None):
+    self.message = message
+    self.records = records     # 今回書き込んだ記録の finished_at (ランキングで色を変える)
+    self.mode = mode           # 遊んだモード (leaderboard の番号、そのモードの歴代1位を添える)
+    self.net_session = net_session     # 終わった LAN 対戦 (相手が結果を決めるまで入力を送る)
+
+  def enter(self, manager):
+    super().enter(manager)
+    self.background = asset_registry.add("screen", f"{type(self).__name__} background",
+                                         pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)))
+    self.draw_background()
+
+  def draw_background(self):
+    board = self.manager.context.leaderboard
+    self.board_version = board.version
+    best = board.top_mode(self.mode)
+    note = (f"{leaderboard.MODE_NAMES[self.mode]} BEST {leaderboard.format_time(best[0][3])}"
+            if best else None)
+    draw_end_screen(self.background, self.message, title_font, board.top_day(), self.records,
+                    table_font, note)
+
+  def update(self, keys):
+    # 今回の記録は少し遅れて控えに入るので、入ったら描き直す
+    if self.manager.context.leaderboard.version != self.board_version:
+      self.draw_background()
+    if self.net_session:
+      # 先に結果が決まった側も、相手がこちらの入力を全部受け取るまでは送り続ける
+      self.net_session.pump()
+      if self.net_session.finished_sending() or self.net_session.disconnected:
+        self.close_net_session()
+    super().update(keys)
+
+  def close_net_session(self):
+    if self.net_session:
+      self.net_session.close()
+      self.net_session = None
+
+  def exit(self):
+    self.close_net_session()
+
+  def next_scene(self):
+    return SelectModeScene()
+
+  def render(self, surface):
+    surface.blit(self.background, (0, 0))
+
+
+def apply_map_update(ctx):
+    # 監視スレッドが読み込んだマップの更新があれば、変わった範囲だけ反映する
+  update = ctx.map_watcher.poll()
+  if update is None:
+    return
+  image, rects, diff_ms = update
+  wait_contact_tables()     # 作りかけのテーブルが古いマップのままにならないように
+  # 大きさが同じでもグラフは古いマップのものなので、次に CPU 対戦を選んだときに読み直す
+  ctx.nav_graph = None
+  start = time.perf_counter()
+  for rect in rects:
+    update_map_region(image, rect)
+  rebuild_ms = (time.perf_counter() - start) * 1000
+  area = sum(rect.width * rect.height for rect in rects) / (MAP_WIDTH * MAP_HEIGHT)
+  print(f"[INFO] Map reloaded: {len(rects)} band(s), {area:.1%} of map, "
+        f"rebuild {rebuild_ms:.1f} ms (diff {diff_ms:.0f} ms)")
+  ctx.map_notice = (f"MAP RELOADED {len(rects)} bands {rebuild_ms:.1f}ms", time.time())
+
+
+def draw_debug_overlay(surface, font, ctx, player=None, huds=()):
+    # F3 で表示する計測値 (画面左下)
+  lines = [ctx.resolution.readout()] + ctx.pacer.readout()
+  if huds:
+    lines.append(ui.hud_readout(huds))
+  if player and contact_tables is not None:
+    # 足元・左右の壁・頭上までの距離 (ステージ調整用)
+    args = (player.x, player.y, player.width, player.height)
+    distances = [contact_tables.free_distance(*args, d) for d in ("down", "left", "right", "up")]
+    lines.append("CONTACT down {} left {} right {} up {}".format(*distances))
+  if ctx.telemetry:
+    lines.append(ctx.telemetry.readout())
+  if ctx.capture:
+    lines.append(ctx.capture.readout())
+  lines += asset_registry.readout()
+  if audio_monitor:
+    lines.append(audio_monitor.readout())
+  y = surface.get_height() - 10
+  for line in reversed(lines):
+    text_render = font.render(line, True, (255, 255, 255))
+    y -= text_render.get_height()
+    draw_text_border(surface, line, font, (255, 255, 255), (0, 0, 0), 10, y, 1)
 
-    elif game_state == STATE_GAME_OVER:
-      draw_end_screen(screen, game_end_message, title_font)
-      running = False
 
-    pygame.display.flip()
+# --- メインゲームループ ---
+def main(options=None):
+  profiler = StartupProfiler(enabled=options is not None and options.profile_startup)
+  if not init_game(profiler, palette_map=options is not None and options.palette_map,
+                   calibrate_audio=options is not None and options.calibrate_audio,
+                   audio_buffer=options.audio_buffer if options is not None else None):
+    print(f"[ERROR] Required images are missing in {IMAGE_PATH} (map_highres.png, muroya.png).")
+    return
+  with profiler.phase("scenes"):
+    manager = scenes.SceneManager(GameContext(options))
+    manager.start(OpeningScene())
+  pacer = manager.context.pacer
+  tele = manager.context.telemetry
+  if tele:
+    tele.start()
+  recorder = manager.context.capture
+  if recorder and not recorder.start(screen):
+    recorder = manager.context.capture = None
+  watcher = manager.context.map_watcher
+  if watcher:
+    watcher.start()
+  manager.context.teacher.start()
+  manager.context.leaderboard.start()
+  manager.context.ghost_writer.start()
+  if audio_monitor:
+    audio_monitor.start()
+  first_frame = True
+  try:
+    while manager.running:
+      pacer.wait(manager.frame_rate())
+      if not pacer.late_input:
+        keys = pygame.key.get_pressed()
+        pacer.keys_sampled()
+
+      # --- イベント処理 --- (どのシーンでも毎フレーム処理する)
+      events = pygame.event.get()
+      pacer.events_polled(events)
+      for event in events:
+        if event.type == pygame.QUIT:
+          manager.quit()
+        else:
+          manager.handle_event(event)
+      if pacer.late_input:
+        # イベントを取り出した後 (= 更新の直前) のキー状態を使う
+        keys = pygame.key.get_pressed()
+        pacer.keys_sampled()
+
+      # --- ゲームロジックと描画 ---
+      work_start = time.perf_counter()
+      if watcher:
+        apply_map_update(manager.context)
+      manager.update(keys)
+      dirty = manager.render(screen)
+      if dirty is None:
+        pygame.display.flip()
+      elif dirty:
+        pygame.display.update(dirty)     # 変わった部分だけ送る
+      pacer.frame_presented()
+      if recorder:
+        recorder.capture(screen)
+      work_ms = (time.perf_counter() - work_start) * 1000
+      manager.context.resolution.update(work_ms)
+      manager.context.last_frame_ms = work_ms
+      if first_frame:
+        profiler.mark("first frame")
+        profiler.report()
+        first_frame = False
+  finally:
+    manager.close()
+    if tele:
+      tele.close()     # 残りの記録を書き出してから終わる
+    if recorder:
+      recorder.close()
+    if watcher:
+      watcher.close()
+    manager.context.teacher.close()
+    manager.context.leaderboard.close()     # 残りの記録を書いてから終わる
+    manager.context.ghost_writer.close()
+    if audio_monitor:
+      audio_monitor.close()
+    if options is not None and options.pacing_report:
+      pacer.report()
+    if options is not None and options.memory_report:
+      asset_registry.report()
 
 
 if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Hisayoshi ~星にあこがれて~")
+  parser.add_argument("--host", nargs="?", type=int, const=netplay.DEFAULT_PORT,
+                      metavar="PORT", help="LAN 対戦のホストになる (1P)")
+  parser.add_argument("--join", metavar="HOST[:PORT]", help="LAN 対戦に参加する (2P)")
+  parser.add_argument("--net-latency", type=float, default=0.0, metavar="MS",
+                      help="送信に遅延を加える (動作確認用)")
+  parser.add_argument("--net-loss", type=float, default=0.0, metavar="RATE",
+                      help="送信パケットを確率で捨てる (動作確認用)")
+  parser.add_argument("--kiosk", action="store_true",
+                      help="展示用: 終了せずにセッションを繰り返し、無操作ならアトラクト画面へ戻る")
+  parser.add_argument("--kiosk-idle", type=float, default=KIOSK_IDLE_SECONDS, metavar="SECONDS",
+                      help="キオスクモードの無操作タイムアウト")
+  parser.add_argument("--render-scale", type=float, default=None, metavar="SCALE",
+                      help="ゲーム画面の描画倍率を固定する (0.5-1.0、指定なしはフレーム時間に合わせて自動)")
+  parser.add_argument("--pacing", choices=pacing.STRATEGIES, default="sleep",
+                      help="フレームの待ち方 (sleep: Clock.tick / busy: 回して待つ / hybrid: 眠ってから回す)")
+  parser.add_argument("--late-input", action="store_true",
+                      help="キー状態をイベント処理の後 (更新の直前) に読む")
+  parser.add_argument("--pacing-report", action="store_true",
+                      help="終了時にフレーム間隔のジッタと入力→表示の遅延のヒストグラムを出力する")
+  parser.add_argument("--no-telemetry", action="store_true",
+                      help=f"プレイの記録 ({telemetry.TELEMETRY_DIR}) を書き出さない")
+  parser.add_argument("--capture", action="store_true",
+                      help=f"プレイ画面を取り込み、ゴールしたら直前の動画を {capture.CAPTURE_DIR} に保存する")
+  parser.add_argument("--capture-seconds", type=float, default=capture.CLIP_SECONDS, metavar="SECONDS",
+                      help="ゴール時に保存する長さ")
+  parser.add_argument("--watch-map", action="store_true",
+                      help="開発用: map_highres.png が更新されたら変わった部分だけ読み直す")
+  parser.add_argument("--palette-map", action="store_true",
+                      help="マップを 8bit のパレット画像として持つ (メモリが約 1/4 になる)")
+  parser.add_argument("--memory-report", action="store_true",
+                      help="終了時に読み込んだ画像・音・テーブルの大きさの一覧を出力する")
+  parser.add_argument("--calibrate-audio", action="store_true",
+                      help=f"ミキサーの設定ごとに音の遅延を測り、遅れの出ない一番短いバッファを {audio.AUDIO_CONFIG_PATH} に保存する")
+  parser.add_argument("--audio-buffer", type=int, default=None, metavar="SAMPLES",
+                      help="ミキサーのバッファの長さを指定する (保存した設定より優先)")
+  parser.add_argument("--profile-startup", action="store_true",
+                      help="起動時の初期化の各段階にかかった時間を表示する")
+  args = parser.parse_args()
   try:
-    main()
+    main(args)
   except Exception as e:
     print(f"An unexpected error occurred: {e}")
   finally:
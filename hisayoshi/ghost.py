@@ -0,0 +1,279 @@
+# --- ゴースト (過去の走りの記録と再生) ---
+# 形式: 位置を 1/8 px に量子化し、毎フレーム「速度の変化量 (2階差分)」を
+# zigzag + varint で書く。KEYFRAME_INTERVAL フレームごとに絶対値のキーフレームを置き、
+# ヘッダのオフセット表から任意フレームへ O(1) でシークできる。
+# 300秒 (18000フレーム) の走りがおよそ 2 バイト/フレーム = 数十 KB に収まる。
+import os
+import json
+import time
+import queue
+import struct
+import threading
+
+GHOST_DIR = "./hisayoshi/ghosts"
+GHOST_EXT = ".ghost"
+GHOST_MAGIC = b'HGST'
+GHOST_VERSION = 1
+POSITION_SCALE = 8          # 1/8 px 単位で記録
+KEYFRAME_INTERVAL = 60      # キーフレーム間隔 (1秒)
+KEEP_PER_DAY = 5            # 1日に残す上位ゴースト数
+
+FLAG_FACING_RIGHT = 1
+FLAG_ON_GROUND = 2
+
+_HEADER = struct.Struct('<4sBHHIH')    # magic, version, fps, keyframe間隔, フレーム数, メタ情報長
+
+
+def _zigzag(value):
+  return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+  return (value >> 1) ^ -(value & 1)
+
+
+def _write_varint(out, value):
+  while value >= 0x80:
+    out.append((value & 0x7F) | 0x80)
+    value >>= 7
+  out.append(value)
+
+
+def _read_varint(data, pos):
+  result = 0
+  shift = 0
+  while True:
+    byte = data[pos]
+    pos += 1
+    result |= (byte & 0x7F) << shift
+    if byte < 0x80:
+      return result, pos
+    shift += 7
+
+
+def player_flags(player):
+  flags = 0
+  if player.facing_right:
+    flags |= FLAG_FACING_RIGHT
+  if player.on_ground:
+    flags |= FLAG_ON_GROUND
+  return flags
+
+
+# --- 記録 ---
+class GhostRecorder:
+  def __init__(self, fps=60, meta=None):
+    self.fps = fps
+    self.meta = dict(meta or {})
+    self.data = bytearray()
+    self.keyframe_offsets = []
+    self.frame_count = 0
+    self.best_y = 0.0
+    self._prev = None       # 直前フレームの (qx, qy)
+    self._velocity = (0, 0)
+
+  def record(self, player):
+    # 1フレーム分の状態を追記する (Player.update の直後に呼ぶ)
+    qx = int(round(player.x * POSITION_SCALE))
+    qy = int(round(player.y * POSITION_SCALE))
+    flags = player_flags(player)
+    self.best_y = max(self.best_y, player.y)
+
+    if self.frame_count % KEYFRAME_INTERVAL == 0:
+      # キーフレーム: 絶対位置とフラグ
+      self.keyframe_offsets.append(len(self.data))
+      _write_varint(self.data, _zigzag(qx))
+      _write_varint(self.data, _zigzag(qy))
+      self.data.append(flags)
+      self._velocity = (0, 0)
+    else:
+      # 差分フレーム: 速度の変化量 (フラグは x 側の下位2ビットに埋め込む)
+      dx = qx - self._prev[0]
+      dy = qy - self._prev[1]
+      _write_varint(self.data, (_zigzag(dx - self._velocity[0]) << 2) | flags)
+      _write_varint(self.data, _zigzag(dy - self._velocity[1]))
+      self._velocity = (dx, dy)
+    self._prev = (qx, qy)
+    self.frame_count += 1
+
+  def to_bytes(self):
+    meta = dict(self.meta)
+    meta.setdefault("best_y", round(self.best_y, 1))
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    header = _HEADER.pack(GHOST_MAGIC, GHOST_VERSION, self.fps, KEYFRAME_INTERVAL,
+                          self.frame_count, len(meta_bytes))
+    index = struct.pack(f'<{len(self.keyframe_offsets)}I', *self.keyframe_offsets)
+    return header + meta_bytes + index + bytes(self.data)
+
+
+# --- 再生 ---
+class Ghost:
+  def __init__(self, blob, path=None):
+    magic, version, fps, interval, frame_count, meta_len = _HEADER.unpack_from(blob)
+    if magic != GHOST_MAGIC or version != GHOST_VERSION:
+      raise ValueError("not a ghost file")
+    self.path = path
+    self.fps = fps
+    self.interval = interval
+    self.frame_count = frame_count
+    pos = _HEADER.size
+    self.meta = json.loads(blob[pos:pos + meta_len].decode("utf-8"))
+    pos += meta_len
+    keyframes = (frame_count + interval - 1) // interval
+    offsets = struct.unpack_from(f'<{keyframes}I', blob, pos)
+    self.data_start = pos + keyframes * 4
+    self.offsets = offsets
+    self.blob = blob
+    self._chunk_index = -1
+    self._chunk = []
+
+  def _decode_chunk(self, chunk_index):
+    # キーフレームから次のキーフレームまでを展開する
+    data = self.blob
+    pos = self.data_start + self.offsets[chunk_index]
+    first = chunk_index * self.interval
+    count = min(self.interval, self.frame_count - first)
+
+    zx, pos = _read_varint(data, pos)
+    zy, pos = _read_varint(data, pos)
+    qx, qy = _unzigzag(zx), _unzigzag(zy)
+    flags = data[pos]
+    pos += 1
+    frames = [(qx / POSITION_SCALE, qy / POSITION_SCALE, flags)]
+    vx = vy = 0
+    for _ in range(count - 1):
+      packed, pos = _read_varint(data, pos)
+      zy, pos = _read_varint(data, pos)
+      flags = packed & 3
+      vx += _unzigzag(packed >> 2)
+      vy += _unzigzag(zy)
+      qx += vx
+      qy += vy
+      frames.append((qx / POSITION_SCALE, qy / POSITION_SCALE, flags))
+    self._chunk_index = chunk_index
+    self._chunk = frames
+
+  def frame(self, index):
+    # フレーム index の (x, y, flags)。記録の終わりを過ぎたら最後のフレーム
+    index = max(0, min(index, self.frame_count - 1))
+    chunk_index = index // self.interval
+    if chunk_index != self._chunk_index:
+      self._decode_chunk(chunk_index)
+    return self._chunk[index - chunk_index * self.interval]
+
+  def score(self):
+    return _score(self.meta, self.frame_count)
+
+
+def _score(meta, frame_count):
+    # 良い走りほど大きい値 (ゴール > 到達高度、ゴール同士は速いほうが上)
+  if meta.get("goal"):
+    return (1, -frame_count)
+  return (0, meta.get("best_y", 0.0))
+
+
+def read_score(path):
+    # ヘッダとメタ情報だけを読んで score を返す (走りの本体は読まない)
+  with open(path, "rb") as f:
+    head = f.read(_HEADER.size)
+    magic, version, _, _, frame_count, meta_len = _HEADER.unpack(head)
+    if magic != GHOST_MAGIC or version != GHOST_VERSION:
+      raise ValueError("not a ghost file")
+    return _score(json.loads(f.read(meta_len).decode("utf-8")), frame_count)
+
+
+def load_ghost(path):
+  with open(path, "rb") as f:
+    return Ghost(f.read(), path)
+
+
+def _day_dir(day=None):
+  return os.path.join(GHOST_DIR, day or time.strftime("%Y%m%d"))
+
+
+def ranked_paths(day=None):
+    # その日のゴーストのパスを良い順に並べる (ヘッダだけ読む、壊れたファイルは無視)
+  directory = _day_dir(day)
+  if not os.path.isdir(directory):
+    return []
+  ranked = []
+  for name in os.listdir(directory):
+    if name.endswith(GHOST_EXT):
+      path = os.path.join(directory, name)
+      try:
+        ranked.append((read_score(path), path))
+      except (OSError, ValueError, struct.error) as e:
+        print(f"[WARNING] Failed to load ghost {name}: {e}")
+  ranked.sort(reverse=True)
+  return [path for _, path in ranked]
+
+
+def load_best_ghosts(limit=3, day=None):
+    # その日の上位ゴーストを読み込む (本体を読むのは上位 limit 件だけ)
+  ghosts = []
+  for path in ranked_paths(day):
+    if limit is not None and len(ghosts) >= limit:
+      break
+    try:
+      ghosts.append(load_ghost(path))
+    except (OSError, ValueError, struct.error) as e:
+      print(f"[WARNING] Failed to load ghost {os.path.basename(path)}: {e}")
+  return ghosts
+
+
+def save_ghost(recorder, label="run"):
+    # 走りを保存し、その日の上位 KEEP_PER_DAY 件以外は削除する (書けなければ None)
+  if recorder.frame_count == 0:
+    return None
+  directory = _day_dir()
+  path = os.path.join(directory, f"{time.strftime('%H%M%S')}_{label}{GHOST_EXT}")
+  blob = recorder.to_bytes()
+  try:
+    os.makedirs(directory, exist_ok=True)
+    # 書きかけのファイルを次のセッションの読み込みが拾わないよう、別名で書いてから置き換える
+    with open(path + ".tmp", "wb") as f:
+      f.write(blob)
+    os.replace(path + ".tmp", path)
+  except OSError as e:
+    print(f"[WARNING] Failed to save ghost: {e}")
+    return None
+
+  for old in ranked_paths()[KEEP_PER_DAY:]:
+    try:
+      os.remove(old)
+    except OSError:
+      pass
+  print(f"[INFO] Saved ghost {path} ({len(blob)} bytes, {recorder.frame_count} frames)")
+  return path
+
+
+class GhostWriter:
+  # ゴーストの書き出しと古いゴーストの削除を裏のスレッドで行う (ゲームの終わりで止まらない)
+  def __init__(self):
+    self.requests = queue.Queue()    # (GhostRecorder, label)、None で終了
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(target=self._run, name="ghost-writer", daemon=True)
+    self._thread.start()
+
+  def close(self):
+    # 残っている走りを書いてから終わる
+    if self._thread is not None:
+      self.requests.put(None)
+      self._thread.join()
+      self._thread = None
+
+  def submit(self, recorder, label="run"):
+    # 記録を渡すだけで待たない (渡した recorder はもう書き足さない)
+    if self._thread is None:
+      save_ghost(recorder, label)     # スレッドを起動していない (ツールなど) ときはその場で書く
+    else:
+      self.requests.put((recorder, label))
+
+  def _run(self):
+    while True:
+      request = self.requests.get()
+      if request is None:
+        break
+      save_ghost(*request)
@@ -0,0 +1,253 @@
+# --- ヒートマップ (プレイ記録の集計) ---
+# オフライン集計:
+#   python hisayoshi/heatmap.py [INPUT ...] [--out hisayoshi/heatmap.npz] [--workers N]
+# INPUT はテレメトリ (.tlm.gz) / ゴースト (.ghost) のファイルかディレクトリ
+# (省略時は hisayoshi/telemetry/ の全部。ゴーストは同じ走りを二重に数えないよう指定したときだけ)。
+# どこで落ちたか・どこで止まっているか・どこで壁ジャンプしているかを、
+# マップ画像と同じ向き (行 0 = 画像の上端) の密度グリッドにする。
+# 一番細かいグリッドだけを足し込み、粗い解像度はブロックごとの和で作るので、
+# ファイルを何件読んでもメモリはグリッドの大きさで決まり、ワーカーの部分結果も足すだけでまとまる。
+# ゲーム中は全体マップの上に重ねて表示できる (H キー)。
+import os
+import sys
+import time
+import struct
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+
+import ghost
+import telemetry
+
+HEATMAP_PATH = "./hisayoshi/heatmap.npz"
+MAP_PATH = "./hisayoshi/image/map_highres.png"
+LAYERS = ("presence", "falls", "stalls", "wall_jumps")
+BASE_CELL = 8               # 足し込むグリッドのセルの大きさ (px)
+LEVEL_CELLS = (8, 32, 128)  # 出力する解像度 (BASE_CELL の倍数)
+FPS = 60
+FALL_SPEED = -6.0           # 着地時の縦速度がこれより速ければ「落下」とみなす
+STALL_SECONDS = 10.0        # 最高到達点がこの秒数更新されなければ「停滞」とみなす
+FILES_PER_TASK = 16         # ワーカー1回分のファイル数
+
+# telemetry.RECORD と同じ並び (詰めて 20 バイト)
+RECORD_DTYPE = np.dtype([("kind", "u1"), ("player", "u1"), ("session", "<u2"),
+                         ("frame", "<u4"), ("x", "<f4"), ("y", "<f4"), ("value", "<f4")])
+
+
+def png_size(path=MAP_PATH):
+  # PNG のヘッダから (幅, 高さ) だけを読む (画像全体は読み込まない)
+  with open(path, "rb") as f:
+    head = f.read(24)
+  if head[:8] != b'\x89PNG\r\n\x1a\n':
+    raise ValueError(f"not a PNG file: {path}")
+  return struct.unpack('>II', head[16:24])
+
+
+class HeatmapAccumulator:
+  def __init__(self, map_size, cell=BASE_CELL):
+    self.map_width, self.map_height = map_size
+    self.cell = cell
+    self.cols = -(-self.map_width // cell)
+    self.rows = -(-self.map_height // cell)
+    self.grids = {name: np.zeros(self.rows * self.cols, dtype=np.float32) for name in LAYERS}
+    self.sessions = 0
+    self.files = 0
+    self.skipped = 0
+
+  def add_points(self, layer, x, y, weight=None):
+    # ゲームの座標 (y は下から上) をマップ画像の向きのセルに足し込む
+    col = np.clip((np.asarray(x) // self.cell).astype(np.int64), 0, self.cols - 1)
+    image_y = self.map_height - 1 - np.asarray(y)
+    row = np.clip((image_y // self.cell).astype(np.int64), 0, self.rows - 1)
+    self.grids[layer] += np.bincount(row * self.cols + col, weights=weight,
+                                     minlength=self.rows * self.cols)
+
+  def add_trace(self, frames, x, y):
+    # 1人分の位置の列 (フレーム順)。滞在時間と停滞区間を足し込む
+    if len(frames) == 0:
+      return
+    frames = np.asarray(frames, dtype=np.int64)
+    y = np.asarray(y, dtype=np.float64)
+    # 各サンプルが表す秒数 (次のサンプルまでの間隔、最後は直前と同じ)
+    step = np.diff(frames, append=frames[-1] + (frames[-1] - frames[-2] if len(frames) > 1 else 1))
+    seconds = step / FPS
+    self.add_points("presence", x, y, seconds)
+
+    best = np.maximum.accumulate(y)
+    improved = np.empty(len(y), dtype=bool)
+    improved[0] = True
+    improved[1:] = best[1:] > best[:-1]
+    last_improved = np.maximum.accumulate(np.where(improved, np.arange(len(y)), 0))
+    stalled = frames - frames[last_improved] >= STALL_SECONDS * FPS
+    if stalled.any():
+      self.add_points("stalls", np.asarray(x)[stalled], y[stalled], seconds[stalled])
+
+  def add_telemetry(self, path):
+    _, body = telemetry.read_file(path)
+    records = np.frombuffer(body, dtype=RECORD_DTYPE)
+    kind = records["kind"]
+    self.sessions += int(np.count_nonzero(kind == telemetry.EVENT_SESSION_START))
+
+    falls = records[(kind == telemetry.EVENT_LAND) & (records["value"] <= FALL_SPEED)]
+    self.add_points("falls", falls["x"], falls["y"])
+    walls = records[kind == telemetry.EVENT_WALL_JUMP]
+    self.add_points("wall_jumps", walls["x"], walls["y"])
+
+    # 位置はセッション・プレイヤーごとの列に分けてから
+    positions = records[kind == telemetry.EVENT_POSITION]
+    if len(positions):
+      key = positions["session"].astype(np.int64) * 256 + positions["player"]
+      order = np.argsort(key, kind="stable")
+      positions, key = positions[order], key[order]
+      bounds = np.flatnonzero(np.diff(key)) + 1
+      for trace in np.split(positions, bounds):
+        self.add_trace(trace["frame"], trace["x"], trace["y"])
+
+  def add_ghost(self, path):
+    g = ghost.load_ghost(path)
+    frames = np.arange(g.frame_count)
+    xy = np.array([g.frame(i)[:2] for i in range(g.frame_count)]).reshape(-1, 2)
+    self.sessions += 1
+    self.add_trace(frames, xy[:, 0], xy[:, 1])
+
+  def add_file(self, path):
+    try:
+      if path.endswith(telemetry.TELEMETRY_EXT):
+        self.add_telemetry(path)
+      else:
+        self.add_ghost(path)
+      self.files += 1
+    except (OSError, ValueError, EOFError, struct.error) as e:
+      print(f"[WARNING] Skipped {path}: {e}")
+      self.skipped += 1
+
+  def merge(self, other):
+    for name in LAYERS:
+      self.grids[name] += other.grids[name]
+    self.sessions += other.sessions
+    self.files += other.files
+    self.skipped += other.skipped
+
+  def levels(self, cells=LEVEL_CELLS):
+    # {セルの大きさ: {レイヤー: 2次元配列}} (粗い解像度はブロックの和)
+    result = {}
+    for cell in cells:
+      factor = cell // self.cell
+      rows = -(-self.rows // factor)
+      cols = -(-self.cols // factor)
+      result[cell] = {}
+      for name in LAYERS:
+        grid = np.zeros((rows * factor, cols * factor))
+        grid[:self.rows, :self.cols] = self.grids[name].reshape(self.rows, self.cols)
+        result[cell][name] = grid.reshape(rows, factor, cols, factor).sum(axis=(1, 3))
+    return result
+
+
+# --- 並列集計 ---
+def _accumulate(task):
+  map_size, paths = task
+  acc = HeatmapAccumulator(map_size)
+  for path in paths:
+    acc.add_file(path)
+  return acc
+
+
+def collect_inputs(inputs):
+  paths = []
+  for item in inputs:
+    if os.path.isdir(item):
+      for root, _, names in os.walk(item):
+        paths.extend(os.path.join(root, name) for name in names
+                     if name.endswith((telemetry.TELEMETRY_EXT, ghost.GHOST_EXT)))
+    else:
+      paths.append(item)
+  return sorted(paths)
+
+
+def build_heatmap(paths, map_size, workers=1, progress=True):
+  total = HeatmapAccumulator(map_size)
+  tasks = [(map_size, paths[i:i + FILES_PER_TASK]) for i in range(0, len(paths), FILES_PER_TASK)]
+  start = time.perf_counter()
+  if workers > 1 and len(tasks) > 1:
+    # 部分結果はグリッドの和なので、届いた順に足していけばよい
+    context = mp.get_context("spawn")
+    with context.Pool(workers) as pool:
+      for partial in pool.imap_unordered(_accumulate, tasks):
+        total.merge(partial)
+        if progress:
+          print(f"[INFO] {total.files + total.skipped}/{len(paths)} files")
+      pool.close()
+      pool.join()
+  else:
+    for task in tasks:
+      total.merge(_accumulate(task))
+      if progress:
+        print(f"[INFO] {total.files + total.skipped}/{len(paths)} files")
+  print(f"[INFO] {total.files} files, {total.sessions} sessions "
+        f"({time.perf_counter() - start:.1f}s)")
+  return total
+
+
+def save_heatmap(acc, path=HEATMAP_PATH):
+  arrays = {"map_size": np.array([acc.map_width, acc.map_height]),
+            "sessions": np.array(acc.sessions)}
+  for cell, layers in acc.levels().items():
+    for name, grid in layers.items():
+      arrays[f"{name}_{cell}"] = grid.astype(np.float32)
+  tmp = path + ".tmp.npz"
+  np.savez_compressed(tmp, **arrays)
+  os.replace(tmp, path)
+
+
+def load_heatmap(path=HEATMAP_PATH):
+  # {"map_size": (w, h), "sessions": n, "levels": {セル: {レイヤー: 配列}}}。なければ None
+  if not os.path.exists(path):
+    return None
+  with np.load(path) as data:
+    levels = {}
+    for key in data.files:
+      name, _, cell = key.rpartition("_")
+      if name in LAYERS:
+        levels.setdefault(int(cell), {})[name] = data[key]
+    return {"map_size": tuple(int(v) for v in data["map_size"]),
+            "sessions": int(data["sessions"]), "levels": levels}
+
+
+def overlay_rgba(heatmap, layer, size):
+  # 全体マップに重ねる RGBA 配列 (高さ, 幅, 4)。1セルが size の1画素に近い解像度を使う
+  width, _ = size
+  map_w, _ = heatmap["map_size"]
+  per_pixel = map_w / width
+  cell = min(heatmap["levels"], key=lambda c: abs(np.log(c / per_pixel)))
+  grid = heatmap["levels"][cell][layer]
+  # 少数の大きな値に引っ張られないよう対数で 0-1 にする
+  value = np.log1p(grid)
+  peak = value.max()
+  t = value / peak if peak > 0 else value
+  rgba = np.zeros(grid.shape + (4,), dtype=np.uint8)
+  # 少ない所は赤、多い所ほど黄色。一度でも記録があるセルは見える濃さにする
+  rgba[..., 0] = 255
+  rgba[..., 1] = (255 * t).astype(np.uint8)
+  rgba[..., 3] = np.where(grid > 0, 80 + 160 * t, 0).astype(np.uint8)
+  return rgba
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Aggregate telemetry and ghosts into heatmaps")
+  parser.add_argument("inputs", nargs="*", default=[telemetry.TELEMETRY_DIR],
+                      help="テレメトリ・ゴーストのファイルかディレクトリ (省略時はテレメトリ全部)")
+  parser.add_argument("--out", default=HEATMAP_PATH)
+  parser.add_argument("--map", default=MAP_PATH, help="グリッドの大きさを決めるマップ画像")
+  parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+  args = parser.parse_args()
+
+  paths = collect_inputs(args.inputs)
+  if not paths:
+    print("[ERROR] No telemetry or ghost files found.")
+    sys.exit(1)
+  acc = build_heatmap(paths, png_size(args.map), workers=args.workers)
+  save_heatmap(acc, args.out)
+  peaks = ", ".join(f"{name} {acc.grids[name].max():.1f}" for name in LAYERS)
+  print(f"[INFO] Saved {args.out} (peak per {BASE_CELL}px cell: {peaks})")
+  sys.exit()
@@ -0,0 +1,218 @@
+# --- ランキング (ゴールまでの時間) ---
+# SQLite (WAL) の1テーブルに記録し、(日付, 時間) と (モード, 時間) の索引で上位を引く。
+# 書き込みと検索は裏のスレッドが自分の接続で行い、上位 N 件 (今日 / モードごと) を
+# 作り直しては丸ごと差し替える。画面側はその控えを読むだけなので、ゲームの終わりに
+# 記録してもフレームは止まらない。
+#   python hisayoshi/leaderboard.py           今日の上位を表示
+#   python hisayoshi/leaderboard.py --bench   件数ごとの上位 10 件の検索時間
+import os
+import sys
+import time
+import queue
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+DB_PATH = "./hisayoshi/leaderboard.db"
+TOP_N = 10
+MODES = (1, 2, 3)     # シングル / 2人プレイ / CPU対戦 (telemetry と同じ番号)
+MODE_NAMES = {1: "SOLO", 2: "VS", 3: "CPU"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+  id INTEGER PRIMARY KEY,
+  day TEXT NOT NULL,          -- YYYYMMDD (ゴーストと同じ区切り)
+  mode INTEGER NOT NULL,
+  clear_ms INTEGER NOT NULL,
+  player TEXT NOT NULL,
+  finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_day_time ON results (day, clear_ms);
+CREATE INDEX IF NOT EXISTS results_mode_time ON results (mode, clear_ms);
+"""
+_COLUMNS = "id, day, mode, clear_ms, player, finished_at"
+
+
+def today():
+  return time.strftime("%Y%m%d")
+
+
+def connect(path=DB_PATH):
+  # WAL にしておけば、書き込み中でも別の接続から読める (コミットごとの fsync も減る)
+  connection = sqlite3.connect(path)
+  connection.execute("PRAGMA journal_mode=WAL")
+  connection.execute("PRAGMA synchronous=NORMAL")
+  connection.executescript(_SCHEMA)
+  return connection
+
+
+def insert(connection, entries):
+  # entries: [(day, mode, clear_ms, player, finished_at)] を1回のトランザクションで書く
+  with connection:
+    connection.executemany(
+        "INSERT INTO results (day, mode, clear_ms, player, finished_at) VALUES (?, ?, ?, ?, ?)",
+        entries)
+
+
+def top_day(connection, day, n=TOP_N):
+  return connection.execute(
+      f"SELECT {_COLUMNS} FROM results WHERE day = ? ORDER BY clear_ms, id LIMIT ?",
+      (day, n)).fetchall()
+
+
+def top_mode(connection, mode, n=TOP_N):
+  return connection.execute(
+      f"SELECT {_COLUMNS} FROM results WHERE mode = ? ORDER BY clear_ms, id LIMIT ?",
+      (mode, n)).fetchall()
+
+
+def entry_label(mode, player):
+  # 表示用のモード名 (2人プレイのときだけどちらのプレイヤーかを付ける)
+  name = MODE_NAMES.get(mode, str(mode))
+  return f"{name} {player}" if mode == 2 else name
+
+
+def format_time(clear_ms):
+  minutes, ms = divmod(clear_ms, 60000)
+  return f"{minutes}:{ms / 1000:06.3f}"
+
+
+class Leaderboard:
+  # 記録の書き込みと上位の控えの作り直しを裏のスレッドで行う
+  def __init__(self, path=DB_PATH, n=TOP_N):
+    self.path = path
+    self.n = n
+    self.requests = queue.Queue()    # (day, mode, clear_ms, player, finished_at)、None で終了
+    self.tops = {}          # ("day", YYYYMMDD) / ("mode", mode) -> 上位の行のリスト
+    self.version = 0        # 控えを差し替えるたびに増える (画面の描き直しの判定用)
+    self.write_ms = 0.0     # 直近の書き込み + 控えの作り直しにかかった時間
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(target=self._run, name="leaderboard", daemon=True)
+    self._thread.start()
+
+  def close(self):
+    # 残っている記録を書いてから終わる
+    if self._thread is not None:
+      self.requests.put(None)
+      self._thread.join()
+      self._thread = None
+
+  def submit(self, mode, clear_ms, player):
+    # 記録を渡すだけで待たない。返した値は行の finished_at (上位の中から自分の記録を探す用)
+    finished_at = time.time()
+    self.requests.put((time.strftime("%Y%m%d", time.localtime(finished_at)), mode,
+                       int(clear_ms), player, finished_at))
+    return finished_at
+
+  def top_day(self, day=None):
+    # 今日 (day) の上位 (まだ控えがなければ空)。メインのスレッドから呼ぶ
+    return self.tops.get(("day", day or today()), [])
+
+  def top_mode(self, mode):
+    return self.tops.get(("mode", mode), [])
+
+  def _refresh(self, connection, days, modes):
+    tops = dict(self.tops)
+    for day in days:
+      tops[("day", day)] = top_day(connection, day, self.n)
+    for mode in modes:
+      tops[("mode", mode)] = top_mode(connection, mode, self.n)
+    self.tops = tops       # 辞書ごと差し替える (読む側はロックなしで古いか新しいかのどちらかを見る)
+    self.version += 1
+
+  def _run(self):
+    connection = None
+    try:
+      connection = connect(self.path)
+      self._refresh(connection, [today()], MODES)
+    except sqlite3.Error as e:
+      print(f"[WARNING] Leaderboard is disabled: {e}")
+      if connection is not None:
+        connection.close()
+        connection = None
+    try:
+      running = True
+      while running:
+        entries = [self.requests.get()]
+        # 溜まっている分はまとめて1回で書く
+        while True:
+          try:
+            entries.append(self.requests.get_nowait())
+          except queue.Empty:
+            break
+        if None in entries:
+          running = False
+          entries = [entry for entry in entries if entry is not None]
+        if not entries or connection is None:
+          continue
+        start = time.perf_counter()
+        try:
+          insert(connection, entries)
+          self._refresh(connection, {today()} | {entry[0] for entry in entries},
+                        {entry[1] for entry in entries})
+        except sqlite3.Error as e:
+          print(f"[WARNING] Failed to write leaderboard: {e}")
+        self.write_ms = (time.perf_counter() - start) * 1000
+    finally:
+      if connection is not None:
+        connection.close()
+
+
+# --- ベンチマーク ---
+def fill_synthetic(connection, size, rng, days=30):
+  # days 日分に散らばった size 件の記録を作る
+  start = time.time() - days * 86400
+  entries = []
+  for _ in range(size):
+    finished_at = start + rng.random() * days * 86400
+    entries.append((time.strftime("%Y%m%d", time.localtime(finished_at)), rng.choice(MODES),
+                    rng.randint(40000, 300000), rng.choice(("1P", "2P")), finished_at))
+  insert(connection, entries)
+
+
+def bench(sizes=(1000, 10000, 50000), queries=2000):
+  rng = random.Random(0)
+  print(f"{'entries':>8} {'day p50':>8} {'day p99':>8} {'mode p50':>9} {'mode p99':>9}  (ms)")
+  for size in sizes:
+    with tempfile.TemporaryDirectory() as directory:
+      connection = connect(os.path.join(directory, "bench.db"))
+      fill_synthetic(connection, size, rng)
+      days = [row[0] for row in connection.execute("SELECT DISTINCT day FROM results")]
+      timings = {"day": [], "mode": []}
+      for _ in range(queries):
+        start = time.perf_counter()
+        top_day(connection, rng.choice(days))
+        timings["day"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        top_mode(connection, rng.choice(MODES))
+        timings["mode"].append((time.perf_counter() - start) * 1000)
+      plan = connection.execute("EXPLAIN QUERY PLAN SELECT * FROM results WHERE mode = 1 "
+                                "ORDER BY clear_ms, id LIMIT 10").fetchall()
+      connection.close()
+    for values in timings.values():
+      values.sort()
+    day, mode = timings["day"], timings["mode"]
+    print(f"{size:>8} {day[len(day) // 2]:>8.3f} {day[len(day) * 99 // 100]:>8.3f} "
+          f"{mode[len(mode) // 2]:>9.3f} {mode[len(mode) * 99 // 100]:>9.3f}")
+  print(f"[INFO] Query plan: {plan[-1][-1]}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="ランキングの表示とベンチマーク")
+  parser.add_argument("--bench", action="store_true", help="件数ごとの上位 10 件の検索時間を測る")
+  parser.add_argument("--day", default=None, help="表示する日 (YYYYMMDD、省略時は今日)")
+  args = parser.parse_args()
+  if args.bench:
+    bench()
+    sys.exit()
+  day = args.day or today()
+  connection = connect()
+  rows = top_day(connection, day)
+  connection.close()
+  print(f"[INFO] Top {TOP_N} on {day}:")
+  for rank, (_, _, mode, clear_ms, player, _) in enumerate(rows, 1):
+    print(f"  {rank:2d}. {format_time(clear_ms)}  {entry_label(mode, player)}")
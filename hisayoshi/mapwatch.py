@@ -0,0 +1,107 @@
+# --- マップの自動再読み込み (開発用、game.py --watch-map) ---
+# map_highres.png の更新を監視し、裏のスレッドで読み込んで前の版と横長の帯ごとに比べる。
+# 変わった帯 (とその中で変わった列の範囲) の矩形だけをゲームに渡し、
+# ゲーム側はその範囲の派生データ (マップ画像・全体マップ) だけを作り直す。
+# 比較用の前の版はこのスレッドが自分で持つので、描画中の map_image には触らない。
+import os
+import time
+import queue
+import threading
+
+import numpy as np
+import pygame
+
+BAND_HEIGHT = 64        # 比較する帯の高さ (px)
+POLL_INTERVAL = 0.5     # 更新日時を確認する間隔 (秒)
+
+
+def changed_rects(old, new, band_height=BAND_HEIGHT):
+  # 同じ大きさの2枚の画像を帯ごとに比べ、変わった範囲の Rect のリストを返す (画像座標)
+  old_rgb = pygame.surfarray.pixels3d(old)
+  new_rgb = pygame.surfarray.pixels3d(new)
+  try:
+    rects = []
+    width, height = old.get_size()
+    for top in range(0, height, band_height):
+      bottom = min(top + band_height, height)
+      columns = np.flatnonzero((old_rgb[:, top:bottom] != new_rgb[:, top:bottom]).any(axis=(1, 2)))
+      if columns.size:
+        rects.append(pygame.Rect(int(columns[0]), top, int(columns[-1]) + 1 - int(columns[0]),
+                                 bottom - top))
+    return rects
+  finally:
+    # pixels3d はサーフェスをロックするので確実に解放する
+    del old_rgb, new_rgb
+
+
+class MapWatcher:
+  def __init__(self, path, band_height=BAND_HEIGHT, interval=POLL_INTERVAL):
+    self.path = path
+    self.band_height = band_height
+    self.interval = interval
+    self.updates = queue.Queue()    # (新しい画像, 変わった Rect のリスト, 比較にかかった ms)
+    self._current = None
+    self._stamp = None
+    self._stop = threading.Event()
+    self._thread = None
+
+  def start(self):
+    self._stamp = self._file_stamp()
+    self._thread = threading.Thread(target=self._run, name="mapwatch", daemon=True)
+    self._thread.start()
+
+  def close(self):
+    if self._thread is not None:
+      self._stop.set()
+      self._thread.join()
+      self._thread = None
+
+  def poll(self):
+    # 読み込み済みの更新を1つ返す (なければ None)。メインのスレッドから呼ぶ
+    try:
+      return self.updates.get_nowait()
+    except queue.Empty:
+      return None
+
+  def _file_stamp(self):
+    try:
+      stat = os.stat(self.path)
+    except OSError:
+      return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+  def _load(self):
+    try:
+      image = pygame.image.load(self.path)
+    except (pygame.error, OSError) as e:
+      print(f"[WARNING] Failed to reload {self.path}: {e}")
+      return None
+    if image.get_bitsize() not in (24, 32):
+      # パレット画像は比較できるよう 32bit にする (game.load_map と同じ)
+      converted = pygame.Surface(image.get_size(), pygame.SRCALPHA, 32)
+      converted.blit(image, (0, 0))
+      image = converted
+    return image
+
+  def _run(self):
+    self._current = self._load()
+    while not self._stop.wait(self.interval):
+      stamp = self._file_stamp()
+      if stamp is None or stamp == self._stamp:
+        continue
+      # 書き込みの途中を読まないよう、もう1回同じ値になるまで待つ
+      if self._stop.wait(self.interval) or self._file_stamp() != stamp:
+        continue
+      self._stamp = stamp
+      image = self._load()
+      if image is None:
+        continue
+      if self._current is None or image.get_size() != self._current.get_size():
+        print(f"[WARNING] {self.path} changed size ({image.get_size()}), restart the game to use it")
+        continue
+      start = time.perf_counter()
+      rects = changed_rects(self._current, image, self.band_height)
+      diff_ms = (time.perf_counter() - start) * 1000
+      self._current = image
+      if rects:
+        self.updates.put((image, rects, diff_ms))
@@ -0,0 +1,446 @@
+# --- ナビゲーショングラフ (CPU 対戦相手用) ---
+# オフライン解析:
+#   python hisayoshi/navgraph.py [--out hisayoshi/navgraph.json.gz] [--workers N]
+# マップの「立てる面」をノードにし、歩き・落下・ジャンプ・壁ジャンプ・
+# 青/緑ジャンプ台の移動を Player の物理で実際にシミュレートしてエッジを張る。
+# 実行時は load_graph() で読み込み、AStarSearch で経路を求める。
+import os
+import sys
+import gzip
+import json
+import time
+import heapq
+import bisect
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+
+import env
+import tilemap
+
+NAVGRAPH_PATH = "./hisayoshi/navgraph.json.gz"
+GRAPH_VERSION = 2       # Player の移動の判定を変えたら上げる (古いグラフは読み込まない)
+
+NODE_WIDTH = 32          # 面をこの幅 (px) ごとのノードに分割する
+STAND_TOLERANCE = 12.0   # 着地直後の y と面の高さのずれの許容量
+MAX_SIM_FRAMES = 900     # 1つの移動のシミュレーション上限 (15秒)
+FALL_PROBE_FRAMES = 40   # 崖から歩いて落ちるまで待つフレーム数
+WALK_OVERHEAD = 4        # 位置合わせのための追加コスト (フレーム)
+
+# 行動コード (env.ACTIONS の添字)
+ACT_NONE, ACT_LEFT, ACT_RIGHT, ACT_JUMP, ACT_LEFT_JUMP, ACT_RIGHT_JUMP = range(6)
+EDGE_KINDS = ('walk', 'fall', 'jump', 'wall_jump', 'blue', 'green')
+
+
+def _action(direction, jump):
+  if direction < 0:
+    return ACT_LEFT_JUMP if jump else ACT_LEFT
+  if direction > 0:
+    return ACT_RIGHT_JUMP if jump else ACT_RIGHT
+  return ACT_JUMP if jump else ACT_NONE
+
+
+# 試す移動パターン: (助走フレーム数, 助走方向, 空中での方向, ジャンプするか, 壁ジャンプするか)
+def _macros():
+  macros = set()
+  for direction in (-1, 1):
+    # 崖から歩いて落ちる
+    macros.add((FALL_PROBE_FRAMES, direction, direction, False, False))
+    for run in (0, 8, 24):
+      for wall in (False, True):
+        macros.add((run, direction, direction, True, wall))
+  for air_dir in (-1, 0, 1):
+    for wall in (False, True):
+      if air_dir or not wall:
+        macros.add((0, 0, air_dir, True, wall))
+      if air_dir:
+        macros.add((0, -air_dir, air_dir, True, wall))
+  return sorted(macros)
+
+
+MACROS = _macros()
+
+
+# --- 立てる面の抽出 ---
+def find_surfaces(grid, player_width, player_height):
+    # (面の高さ y, プレイヤー左端 x の最小, 最大) のリストを返す
+  solid = grid == tilemap.TILE_SOLID
+  map_h, map_w = solid.shape
+  # 小数座標では当たり判定が1px広がるので余裕を持たせる
+  box_w = player_width + 1
+  clear_h = player_height + 1
+  max_x = map_w - player_width
+
+  edge_rows = np.flatnonzero((solid[:-1] & ~solid[1:]).any(axis=1)) + 1
+  surfaces = []
+  for y in edge_rows:
+    blocked = solid[y:y + clear_h].any(axis=0)
+    blocked_sum = np.concatenate(([0], np.cumsum(blocked)))
+    box_free = (blocked_sum[box_w:] - blocked_sum[:-box_w]) == 0
+    support_sum = np.concatenate(([0], np.cumsum(solid[y - 1])))
+    supported = (support_sum[player_width:] - support_sum[:-player_width]) > 0
+    n = min(len(box_free), len(supported), max_x + 1)
+    standable = box_free[:n] & supported[:n]
+    if not standable.any():
+      continue
+    # 連続区間に分解
+    padded = np.concatenate(([False], standable, [False])).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    for start, end in zip(changes[::2], changes[1::2]):
+      surfaces.append((int(y), int(start), int(end - 1)))
+  return surfaces
+
+
+def split_nodes(surfaces):
+    # 面を NODE_WIDTH ごとのノード [y, x0, x1] に分割し、同じ面の隣接ノード対も返す
+  nodes = []
+  neighbours = []
+  for y, x0, x1 in surfaces:
+    first = len(nodes)
+    for start in range(x0, x1 + 1, NODE_WIDTH):
+      nodes.append([y, start, min(start + NODE_WIDTH - 1, x1)])
+    for i in range(first, len(nodes) - 1):
+      neighbours.append((i, i + 1))
+  return nodes, neighbours
+
+
+# --- ノード検索 ---
+class NodeLocator:
+  def __init__(self, nodes):
+    by_y = {}
+    for index, (y, x0, x1) in enumerate(nodes):
+      by_y.setdefault(y, []).append((x0, x1, index))
+    self.ys = sorted(by_y)
+    self.rows = [sorted(by_y[y]) for y in self.ys]
+    self.starts = [[x0 for x0, _, _ in row] for row in self.rows]
+
+  def locate(self, x, y, tolerance=STAND_TOLERANCE, slack=2.0):
+    # 座標 (x, y) のプレイヤーが立っているノード番号 (なければ None)
+    i = bisect.bisect_right(self.ys, y + 0.5) - 1
+    while i >= 0 and y - self.ys[i] < tolerance:
+      row = self.rows[i]
+      j = bisect.bisect_right(self.starts[i], x + slack) - 1
+      if j >= 0 and x <= row[j][1] + slack:
+        return row[j][2]
+      i -= 1
+    return None
+
+
+# --- 移動のシミュレーション ---
+# 種類の優先度 (1回の移動で複数起きたら強いほうで分類する)
+KIND_RANK = {'fall': 0, 'jump': 1, 'wall_jump': 2, 'blue': 3, 'green': 4}
+
+
+def _simulate(player, macro):
+    # マクロを実行し (行動列, 経過フレーム, 種類, 終了状態) を返す
+  run, run_dir, air_dir, jump, wall = macro
+  actions = []
+  kind = 'fall'
+  left_ground = False
+  for frame in range(MAX_SIM_FRAMES):
+    airborne = not player.on_ground
+    if frame < run and not left_ground:
+      act = _action(run_dir, False)
+    elif frame == run and jump and not left_ground:
+      act = _action(air_dir if run == 0 else run_dir, True)
+    else:
+      # 壁に触れたら壁ジャンプ (それ以外はジャンプキーを離す)
+      press = (wall and airborne and player.wall_jump_cooldown == 0 and
+               any(player.wall_contact()))
+      act = _action(air_dir, press)
+
+    cooldown_before = player.wall_jump_cooldown
+    player.update(env.ACTIONS[act], env.ACTION_CONTROL_MAP)
+    actions.append(act)
+
+    event = None
+    if player.vy == player.green_pad_vy:
+      event = 'green'
+    elif player.vy == player.blue_pad_vy:
+      event = 'blue'
+    elif airborne and cooldown_before == 0 and player.wall_jump_cooldown > 0:
+      event = 'wall_jump'
+    elif not airborne and act >= ACT_JUMP and not player.on_ground:
+      event = 'jump'
+    if event and KIND_RANK[event] > KIND_RANK[kind]:
+      kind = event
+
+    if player.is_goal:
+      return actions, frame + 1, kind, 'goal'
+    if not player.on_ground:
+      left_ground = True
+    elif left_ground:
+      return actions, frame + 1, kind, 'landed'
+    elif frame >= run and not jump:
+      # 助走しても崖から落ちなかった (歩きエッジで十分)
+      return actions, frame + 1, kind, 'stayed'
+  return actions, MAX_SIM_FRAMES, kind, 'timeout'
+
+
+def _run_length(actions):
+  rle = []
+  for act in actions:
+    if rle and rle[-1][0] == act:
+      rle[-1][1] += 1
+    else:
+      rle.append([act, 1])
+  return rle
+
+
+_worker_state = {}
+
+
+def _init_worker(grid, nodes):
+  _worker_state["grid"] = grid
+  _worker_state["nodes"] = nodes
+  _worker_state["player_class"] = env.sim_player_class()
+  _worker_state["locator"] = NodeLocator(nodes)
+
+
+def _takeoff_samples(grid, node, player_width, player_height):
+    # ノード中央と、ノードに重なるジャンプ台の位置を離陸点として試す
+  y, x0, x1 = node
+  samples = [(x0 + x1) // 2]
+  region = grid[y:y + player_height + 1, x0:x1 + player_width]
+  pad_cols = np.flatnonzero((region >= tilemap.TILE_BLUE).any(axis=0))
+  if pad_cols.size:
+    pad_x = x0 + int(pad_cols.mean()) - player_width // 2
+    pad_x = max(x0, min(pad_x, x1))
+    if pad_x not in samples:
+      samples.append(pad_x)
+  return samples
+
+
+def _node_edges(index):
+    # ノード index から出るエッジをシミュレーションで求める
+  grid = _worker_state["grid"]
+  nodes = _worker_state["nodes"]
+  locator = _worker_state["locator"]
+  player_class = _worker_state["player_class"]
+  goal_index = len(nodes)
+
+  y, _, _ = nodes[index]
+  best = {}
+  probe = player_class(grid, 0.0)
+  for start_x in _takeoff_samples(grid, nodes[index], probe.width, probe.height):
+    for macro in MACROS:
+      player = player_class(grid, float(start_x))
+      player.y = float(y)
+      player.on_ground = True
+      actions, frames, kind, result = _simulate(player, macro)
+      if result == 'goal':
+        dest = goal_index
+      elif result == 'landed':
+        dest = locator.locate(player.x, player.y)
+      else:
+        continue
+      if dest is None or dest == index:
+        continue
+      cost = frames + WALK_OVERHEAD
+      if dest not in best or cost < best[dest][4]:
+        best[dest] = [index, dest, kind, start_x, cost, _run_length(actions)]
+  return list(best.values())
+
+
+# --- グラフ構築 ---
+def build_graph(grid, workers=1, progress=True):
+  game = env.load_game()
+  probe = game.Player(0, None, None, 0.0, None, None)
+  surfaces = find_surfaces(grid, probe.width, probe.height)
+  nodes, neighbours = split_nodes(surfaces)
+  print(f"[INFO] {len(surfaces)} surfaces, {len(nodes)} nodes")
+
+  edges = []
+  for a, b in neighbours:
+    ya, xa0, xa1 = nodes[a]
+    yb, xb0, xb1 = nodes[b]
+    frames = int(abs((xb0 + xb1) - (xa0 + xa1)) / 2 / probe.speed) + WALK_OVERHEAD
+    edges.append([a, b, 'walk', None, frames, []])
+    edges.append([b, a, 'walk', None, frames, []])
+
+  start = time.perf_counter()
+  if workers > 1:
+    # SDL を初期化済みのプロセスを fork すると子が固まることがあるので spawn を使う
+    context = mp.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(grid, nodes)) as pool:
+      for done, node_edges in enumerate(pool.imap(_node_edges, range(len(nodes)), chunksize=8)):
+        edges.extend(node_edges)
+        if progress and done % 100 == 0:
+          print(f"[INFO] simulated {done}/{len(nodes)} nodes")
+      # terminate() で終わらせるとワーカーがキューのロックを持ったまま止まることがある
+      pool.close()
+      pool.join()
+  else:
+    _init_worker(grid, nodes)
+    for index in range(len(nodes)):
+      edges.extend(_node_edges(index))
+      if progress and index % 100 == 0:
+        print(f"[INFO] simulated {index}/{len(nodes)} nodes")
+  print(f"[INFO] {len(edges)} edges ({time.perf_counter() - start:.1f}s)")
+
+  graph = {
+      "version": GRAPH_VERSION,
+      "map_size": [int(grid.shape[1]), int(grid.shape[0])],
+      "params": {
+          "speed": probe.speed, "jump_speed": probe.jump_speed,
+          "gravity": probe.gravity, "wall_jump_factor": probe.wall_jump_factor,
+          "blue_pad_vy": probe.blue_pad_vy, "green_pad_vy": probe.green_pad_vy,
+      },
+      "nodes": nodes,
+      "edges": edges,
+  }
+  graph["goal"] = len(nodes)
+  graph["h"] = cost_to_goal(graph)
+  return graph
+
+
+def cost_to_goal(graph):
+    # 逆向きダイクストラでゴールまでの最短コストを求める (A* のヒューリスティック)
+  nodes = graph["nodes"]
+  goal = graph["goal"]
+  reverse = {}
+  for src, dst, _, _, cost, _ in graph["edges"]:
+    reverse.setdefault(dst, []).append((src, cost))
+
+  targets = [goal] if goal in reverse else []
+  if not targets and nodes:
+    # ゴールに届くエッジがない場合は最も高いノードを目標にする
+    top = max(y for y, _, _ in nodes)
+    targets = [i for i, (y, _, _) in enumerate(nodes) if y == top]
+
+  dist = {t: 0 for t in targets}
+  queue = [(0, t) for t in targets]
+  while queue:
+    d, node = heapq.heappop(queue)
+    if d > dist.get(node, float("inf")):
+      continue
+    for src, cost in reverse.get(node, ()):
+      nd = d + cost
+      if nd < dist.get(src, float("inf")):
+        dist[src] = nd
+        heapq.heappush(queue, (nd, src))
+  # 到達不能なノードは -1
+  return [dist.get(i, -1) for i in range(len(nodes) + 1)]
+
+
+def save_graph(graph, path=NAVGRAPH_PATH):
+  with gzip.open(path, "wt", encoding="utf-8") as f:
+    json.dump(graph, f, separators=(",", ":"))
+
+
+# --- 実行時のグラフ ---
+class NavGraph:
+  def __init__(self, data):
+    self.nodes = data["nodes"]
+    self.goal = data["goal"]
+    self.params = data["params"]
+    self.h = data["h"]
+    self.edges = data["edges"]
+    self.out_edges = [[] for _ in range(len(self.nodes) + 1)]
+    for index, edge in enumerate(self.edges):
+      self.out_edges[edge[0]].append(index)
+    self.locator = NodeLocator(self.nodes)
+    # ゴールへのエッジがなければ最高ノードが目標
+    self.targets = {i for i, h in enumerate(self.h) if h == 0}
+
+  def locate(self, x, y):
+    return self.locator.locate(x, y)
+
+  def heuristic(self, node):
+    h = self.h[node]
+    return h if h >= 0 else None
+
+
+def load_graph(path=NAVGRAPH_PATH, map_size=None):
+    # グラフを読み込む (ファイルがない・マップと合わない場合は None)
+  if not os.path.exists(path):
+    print(f"[WARNING] Navigation graph not found: {path}")
+    return None
+  try:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+      data = json.load(f)
+  except (OSError, ValueError) as e:
+    print(f"[ERROR] Failed to load navigation graph: {e}")
+    return None
+  if data.get("version") != GRAPH_VERSION:
+    print(f"[WARNING] Navigation graph version mismatch: {path} "
+          f"(rebuild it with python hisayoshi/navgraph.py)")
+    return None
+  if map_size is not None and list(map_size) != data["map_size"]:
+    print(f"[WARNING] Navigation graph was built for a different map: {path}")
+    return None
+  return NavGraph(data)
+
+
+class AStarSearch:
+  # 時間予算つきで少しずつ進められる A* (1フレームに収まらなければ次フレームで続行)
+  def __init__(self, graph, start, banned_edges=()):
+    self.graph = graph
+    self.start = start
+    self.banned = set(banned_edges)
+    self.came_from = {start: None}
+    self.g = {start: 0}
+    self.open = [(self._h(start), 0, start)]
+    self.closed = set()
+    self.path = None     # 見つかったエッジ番号の列
+    self.done = False
+
+  def _h(self, node):
+    h = self.graph.heuristic(node)
+    return h if h is not None else 10 ** 9
+
+  def run(self, budget_s):
+    # budget_s 秒まで探索を進め、終わったら True
+    deadline = time.perf_counter() + budget_s
+    graph = self.graph
+    expanded = 0
+    while self.open:
+      f, g, node = heapq.heappop(self.open)
+      if node in self.closed:
+        continue
+      if node in graph.targets:
+        self._finish(node)
+        return True
+      self.closed.add(node)
+      for edge_index in graph.out_edges[node]:
+        if edge_index in self.banned:
+          continue
+        dst, cost = graph.edges[edge_index][1], graph.edges[edge_index][4]
+        ng = g + cost
+        if ng < self.g.get(dst, float("inf")):
+          self.g[dst] = ng
+          self.came_from[dst] = edge_index
+          heapq.heappush(self.open, (ng + self._h(dst), ng, dst))
+      expanded += 1
+      if expanded % 16 == 0 and time.perf_counter() >= deadline:
+        return False
+    # 目標に届かない: 到達できた中で最も高いノードを目指す
+    best = max(self.closed, key=lambda n: graph.nodes[n][0] if n < len(graph.nodes) else 0,
+               default=self.start)
+    self._finish(best)
+    return True
+
+  def _finish(self, node):
+    path = []
+    while self.came_from.get(node) is not None:
+      edge_index = self.came_from[node]
+      path.append(edge_index)
+      node = self.graph.edges[edge_index][0]
+    path.reverse()
+    self.path = path
+    self.done = True
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Build the navigation graph for CPU players")
+  parser.add_argument("--out", default=NAVGRAPH_PATH)
+  parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+  args = parser.parse_args()
+
+  grid = env.load_grid()
+  graph = build_graph(grid, workers=args.workers)
+  save_graph(graph, args.out)
+  reachable = sum(1 for h in graph["h"] if h >= 0)
+  print(f"[INFO] Saved {args.out} ({reachable}/{len(graph['h'])} nodes can reach the target)")
+  sys.exit()
@@ -0,0 +1,544 @@
+# --- LAN 対戦 (UDP + ロールバック) ---
+# 毎フレームの入力だけを送り合い、相手の入力は直前の値で予測して先に進める。
+# 遅れて届いた入力が予測と違っていたら、その直前のスナップショットに戻して
+# Player.update を再シミュレーションする (ローカル操作の入力遅延はゼロ)。
+#
+# ローカルでの動作確認 (1プロセスで2台分を localhost で接続):
+#   python hisayoshi/netplay.py --latency 80 --jitter 20 --loss 0.1 --frames 900
+import sys
+import time
+import heapq
+import random
+import socket
+import struct
+import argparse
+
+DEFAULT_PORT = 50620
+MAX_ROLLBACK = 16          # 巻き戻せる最大フレーム数 (これ以上離れたら待つ)
+INPUT_REDUNDANCY = 32      # 1パケットに載せる未確認入力の最大フレーム数
+SNAPSHOT_INTERVAL = 30     # 同期確認用スナップショットを送る間隔 (フレーム)
+HELLO_INTERVAL = 0.1
+DISCONNECT_TIMEOUT = 5.0   # この秒数だけ相手から何も届かなければ切断とみなす
+STATS_WINDOW = 120
+
+# 入力ビット (1フレーム1バイト)
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+INPUT_ZOOM = 8
+# 入力バイトを keys として Player.update に渡すための control_map
+NET_CONTROL_MAP = {'left': 0, 'right': 1, 'jump': 2, 'zoom_out': 3}
+INPUT_KEYS = tuple(tuple(bool(bits & (1 << i)) for i in range(4)) for bits in range(16))
+
+PACKET_MAGIC = b'HY'
+PACKET_HELLO = 1
+PACKET_INPUT = 2
+NO_FRAME = 0xFFFFFFFF
+_HEADER = struct.Struct('<2sBIIIB')     # magic, type, 入力確認済み, スナップショット確認済み, 開始フレーム, ラン数
+_SNAP_HEADER = struct.Struct('<IIH')    # フレーム, 差分の基準フレーム, 変更フィールドのビット
+
+# スナップショットのフィールド (型は struct の書式)
+SNAPSHOT_FIELDS = (
+    ('x', 'd'), ('y', 'd'), ('vx', 'd'), ('vy', 'd'),
+    ('on_ground', '?'), ('facing_right', '?'), ('is_goal', '?'),
+    ('is_zooming_out', '?'), ('wall_jump_cooldown', 'B'),
+)
+_FIELD_STRUCTS = [struct.Struct('<' + fmt) for _, fmt in SNAPSHOT_FIELDS]
+
+
+def encode_input(keys, control_map):
+    # pygame のキー状態から入力バイトを作る
+  bits = 0
+  for name, bit in (('left', INPUT_LEFT), ('right', INPUT_RIGHT),
+                    ('jump', INPUT_JUMP), ('zoom_out', INPUT_ZOOM)):
+    key = control_map.get(name)
+    if key is not None and keys[key]:
+      bits |= bit
+  return bits
+
+
+def capture_state(player):
+  return tuple(getattr(player, name) for name, _ in SNAPSHOT_FIELDS)
+
+
+def restore_state(player, state):
+  for (name, _), value in zip(SNAPSHOT_FIELDS, state):
+    setattr(player, name, value)
+
+
+def encode_snapshot(state, base=None):
+    # base からの差分だけを詰める (base が None なら全フィールド)
+  mask = 0
+  payload = []
+  for i, value in enumerate(state):
+    if base is None or base[i] != value:
+      mask |= 1 << i
+      payload.append(_FIELD_STRUCTS[i].pack(value))
+  return mask, b''.join(payload)
+
+
+def decode_snapshot(mask, data, offset, base=None):
+    # encode_snapshot の逆。(state, 次の offset) を返す
+  values = []
+  for i, field in enumerate(_FIELD_STRUCTS):
+    if mask & (1 << i):
+      values.append(field.unpack_from(data, offset)[0])
+      offset += field.size
+    else:
+      values.append(base[i])
+  return tuple(values), offset
+
+
+def _run_length(inputs):
+  runs = []
+  for bits in inputs:
+    if runs and runs[-1][0] == bits and runs[-1][1] < 255:
+      runs[-1][1] += 1
+    else:
+      runs.append([bits, 1])
+  return runs
+
+
+# --- 送受信 ---
+class UdpTransport:
+  def __init__(self, bind_port=0, peer=None):
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sock.bind(("0.0.0.0", bind_port))
+    self.sock.setblocking(False)
+    self.peer = peer     # 接続先 (ホスト側は最初の受信で決まる)
+
+  @property
+  def port(self):
+    return self.sock.getsockname()[1]
+
+  def send(self, data):
+    if self.peer is not None:
+      try:
+        self.sock.sendto(data, self.peer)
+      except OSError:
+        pass
+
+  def receive(self):
+    # 届いているパケットを全て返す
+    packets = []
+    while True:
+      try:
+        data, addr = self.sock.recvfrom(2048)
+      except (BlockingIOError, InterruptedError):
+        break
+      except OSError:
+        # Windows では相手が閉じていると ConnectionResetError が出る
+        break
+      if self.peer is None:
+        self.peer = addr
+      if addr == self.peer:
+        packets.append(data)
+    return packets
+
+  def close(self):
+    self.sock.close()
+
+
+class LossyTransport:
+  # 遅延・揺らぎ・パケットロスを模擬するラッパー (localhost での検証用)
+  def __init__(self, inner, latency_ms=0.0, jitter_ms=0.0, loss=0.0, seed=None):
+    self.inner = inner
+    self.latency = latency_ms / 1000.0
+    self.jitter = jitter_ms / 1000.0
+    self.loss = loss
+    self.rng = random.Random(seed)
+    self.outgoing = []
+    self.counter = 0
+
+  @property
+  def port(self):
+    return self.inner.port
+
+  def send(self, data):
+    if self.rng.random() < self.loss:
+      return
+    delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+    self.counter += 1
+    heapq.heappush(self.outgoing, (time.perf_counter() + delay, self.counter, data))
+    self.flush()
+
+  def flush(self):
+    now = time.perf_counter()
+    while self.outgoing and self.outgoing[0][0] <= now:
+      self.inner.send(heapq.heappop(self.outgoing)[2])
+
+  def receive(self):
+    self.flush()
+    return self.inner.receive()
+
+  def close(self):
+    self.inner.close()
+
+
+# --- ロールバックセッション ---
+class RollbackSession:
+  def __init__(self, players, local_index, transport):
+    # players: [1P, 2P] の Player、local_index: このマシンが操作する側 (0 / 1)
+    self.players = players
+    self.local = local_index
+    self.remote = 1 - local_index
+    self.transport = transport
+    self.frame = 0                 # 次にシミュレーションするフレーム
+    self.connected = False
+    self.disconnected = False      # 相手からの受信が DISCONNECT_TIMEOUT 秒途絶えた
+    self.last_receive = None       # 最後に相手のパケットが届いた時刻 (perf_counter)
+    self._last_hello = 0.0
+
+    self.inputs = [{}, {}]         # フレーム -> 入力バイト (確定分)
+    self.predicted = {}            # 相手入力を予測で使ったフレーム -> 予測値
+    self.remote_confirmed = -1     # 相手入力が連続して確定している最後のフレーム
+    self.peer_ack = -1             # 相手が受け取り済みのこちらの入力の最後のフレーム
+    self.snapshots = {}            # フレーム -> シミュレーション前の状態
+    self.rollback_from = None      # 巻き戻しが必要な最も古いフレーム
+    self.goal_flags = {}           # フレーム -> そのフレームを進めた後のプレイヤーごとのゴール
+    self.result_checked = -1       # 試合の結果の判定で見た最後のフレーム
+
+    # 同期確認用スナップショット (自分が操作するプレイヤーのみ送る)
+    self.sent_snapshots = {}       # フレーム -> 送った状態
+    self.peer_snapshot_ack = None  # 相手が受け取った最新スナップショットのフレーム
+    self.remote_snapshots = {}     # 相手から届いた状態 (差分の基準)
+    self.last_remote_snapshot = None
+    self.desyncs = 0
+
+    # 計測値
+    self.rollback_depths = []
+    self.resim_times = []
+    self.stalls = 0
+    self.bytes_sent = 0
+    self.packets_sent = 0
+
+  # --- 接続 ---
+  def poll_handshake(self):
+    # 相手から何か届くまで HELLO を送り続ける。接続できたら True
+    now = time.perf_counter()
+    if now - self._last_hello >= HELLO_INTERVAL:
+      self._last_hello = now
+      self._send_raw(_HEADER.pack(PACKET_MAGIC, PACKET_HELLO, NO_FRAME, NO_FRAME, 0, 0))
+    for data in self.transport.receive():
+      if data[:2] == PACKET_MAGIC:
+        self.connected = True
+        self._handle(data)
+    if self.connected:
+      # 相手側も確実に接続済みにするためもう1回送る
+      self._send_raw(_HEADER.pack(PACKET_MAGIC, PACKET_HELLO, NO_FRAME, NO_FRAME, 0, 0))
+    return self.connected
+
+  # --- 1フレーム進める ---
+  def advance(self, local_input):
+    # ローカル入力を登録して1フレーム進める。相手が遅れすぎていれば False (待機)
+    self._receive()
+    self._apply_rollback()
+    if self.disconnected:
+      return False
+    if self.frame - self.remote_confirmed > MAX_ROLLBACK:
+      self.stalls += 1
+      self._send_inputs()
+      return False
+
+    frame = self.frame
+    self.inputs[self.local][frame] = local_input
+    self.snapshots[frame] = [capture_state(p) for p in self.players]
+    self._simulate(frame)
+    self.frame += 1
+    self._prune()
+    self._send_inputs()
+    return True
+
+  def pump(self):
+    # フレームを進めずに送受信と巻き戻しだけ行う (待機中・終了処理用)
+    self._receive()
+    self._apply_rollback()
+    self._send_inputs()
+
+  def _remote_input(self, frame):
+    # 確定していればその入力、なければ最後に確定した入力で予測する
+    remote_inputs = self.inputs[self.remote]
+    if frame in remote_inputs:
+      return remote_inputs[frame]
+    guess = remote_inputs.get(self.remote_confirmed, 0)
+    self.predicted[frame] = guess
+    return guess
+
+  def _simulate(self, frame):
+    local_bits = self.inputs[self.local][frame]
+    remote_bits = self._remote_input(frame)
+    bits = [0, 0]
+    bits[self.local] = local_bits
+    bits[self.remote] = remote_bits
+    for player, player_bits in zip(self.players, bits):
+      player.update(INPUT_KEYS[player_bits], NET_CONTROL_MAP)
+    self.goal_flags[frame] = tuple(player.is_goal for player in self.players)
+
+  def confirmed_result(self, last_frame):
+    # 両方の入力が確定したフレームだけで試合の結果を決める (予測を含む状態では2台で分かれる)
+    # 誰かがゴールした最初のフレームか、誰もゴールしないまま確定した last_frame の
+    # (フレーム, プレイヤーごとのゴール) を返す。まだ決まらなければ None (advance の後に呼ぶ)
+    end = min(self.remote_confirmed, self.frame - 1, last_frame)
+    while self.result_checked < end:
+      self.result_checked += 1
+      goals = self.goal_flags.get(self.result_checked, (False,) * len(self.players))
+      if any(goals) or self.result_checked == last_frame:
+        return self.result_checked, goals
+    return None
+
+  def finished_sending(self):
+    # こちらの入力が全部相手に届いた (相手も同じ結果を決められる)
+    return self.peer_ack >= self.frame - 1
+
+  def _apply_rollback(self):
+    # 予測が外れていたフレームまで戻って再シミュレーションする
+    start_frame = self.rollback_from
+    self.rollback_from = None
+    if start_frame is None or start_frame >= self.frame:
+      self._record(0, 0.0)
+      return
+    start = time.perf_counter()
+    for player, state in zip(self.players, self.snapshots[start_frame]):
+      restore_state(player, state)
+    muted = [getattr(p, 'mute', False) for p in self.players]
+    for player in self.players:
+      player.mute = True     # 再シミュレーション中は効果音を鳴らさない
+    try:
+      for frame in range(start_frame, self.frame):
+        self.snapshots[frame] = [capture_state(p) for p in self.players]
+        self.predicted.pop(frame, None)
+        self._simulate(frame)
+    finally:
+      for player, was_muted in zip(self.players, muted):
+        player.mute = was_muted
+    self._record(self.frame - start_frame, (time.perf_counter() - start) * 1000)
+
+  def _mark_rollback(self, frame):
+    if frame < self.frame and (self.rollback_from is None or frame < self.rollback_from):
+      self.rollback_from = frame
+
+  def _prune(self):
+    # 確定済みで巻き戻し不要になった古いデータを捨てる
+    # 同期確認で古いフレームを参照することがあるので少し余分に残す
+    keep_from = min(self.remote_confirmed, self.frame - 1) - SNAPSHOT_INTERVAL * 2
+    for frame in [f for f in self.snapshots if f < keep_from]:
+      del self.snapshots[frame]
+    for frame in [f for f in self.goal_flags if f < keep_from]:
+      del self.goal_flags[frame]
+    oldest_needed = min(self.peer_ack, self.remote_confirmed) - INPUT_REDUNDANCY
+    for inputs in self.inputs:
+      for frame in [f for f in inputs if f < oldest_needed]:
+        del inputs[frame]
+    for frame in [f for f in self.sent_snapshots if f < (self.peer_snapshot_ack or 0)]:
+      del self.sent_snapshots[frame]
+
+  def _record(self, depth, ms):
+    self.rollback_depths.append(depth)
+    self.resim_times.append(ms)
+    if len(self.rollback_depths) > STATS_WINDOW:
+      del self.rollback_depths[0]
+      del self.resim_times[0]
+
+  # --- パケット ---
+  def _send_raw(self, data):
+    self.transport.send(data)
+    self.bytes_sent += len(data)
+    self.packets_sent += 1
+
+  def _send_inputs(self):
+    # 相手が未受信の入力をまとめて (ランレングスで) 送る
+    local_inputs = self.inputs[self.local]
+    first = self.peer_ack + 1
+    frames = range(first, min(self.frame, first + INPUT_REDUNDANCY))
+    runs = _run_length(local_inputs[f] for f in frames)
+    snapshot_ack = NO_FRAME if self.last_remote_snapshot is None else self.last_remote_snapshot
+    parts = [_HEADER.pack(PACKET_MAGIC, PACKET_INPUT, self.remote_confirmed & NO_FRAME,
+                          snapshot_ack, first, len(runs))]
+    parts.extend(struct.pack('<BB', bits, count) for bits, count in runs)
+
+    # 一定間隔で自分のプレイヤーの状態を差分で送る (同期ずれの検出・修正用)
+    snap_frame = (self.frame - 1) // SNAPSHOT_INTERVAL * SNAPSHOT_INTERVAL
+    if snap_frame not in self.sent_snapshots and snap_frame in self.snapshots:
+      self.sent_snapshots[snap_frame] = self.snapshots[snap_frame][self.local]
+    if snap_frame in self.sent_snapshots:
+      base_frame = self.peer_snapshot_ack
+      base = self.sent_snapshots.get(base_frame) if base_frame is not None else None
+      mask, payload = encode_snapshot(self.sent_snapshots[snap_frame], base)
+      parts.append(_SNAP_HEADER.pack(snap_frame, NO_FRAME if base is None else base_frame, mask))
+      parts.append(payload)
+    self._send_raw(b''.join(parts))
+
+  def _receive(self):
+    for data in self.transport.receive():
+      self._handle(data)
+    # 相手が終了した・回線が切れた (待ち続けると試合が終わらない)
+    if (not self.disconnected and self.last_receive is not None
+        and time.perf_counter() - self.last_receive > DISCONNECT_TIMEOUT):
+      self.disconnected = True
+      print(f"[WARNING] No packets from the peer for {DISCONNECT_TIMEOUT:.0f}s, connection lost")
+
+  def _handle(self, data):
+    if len(data) < _HEADER.size or data[:2] != PACKET_MAGIC:
+      return
+    self.last_receive = time.perf_counter()
+    _, kind, ack, snapshot_ack, first, run_count = _HEADER.unpack_from(data)
+    if kind == PACKET_HELLO:
+      self.connected = True
+      return
+    self.connected = True
+    if ack != NO_FRAME:
+      self.peer_ack = max(self.peer_ack, ack)
+    if snapshot_ack != NO_FRAME:
+      if self.peer_snapshot_ack is None or snapshot_ack > self.peer_snapshot_ack:
+        self.peer_snapshot_ack = snapshot_ack
+
+    offset = _HEADER.size
+    frame = first
+    remote_inputs = self.inputs[self.remote]
+    for _ in range(run_count):
+      bits, count = struct.unpack_from('<BB', data, offset)
+      offset += 2
+      for f in range(frame, frame + count):
+        if f > self.remote_confirmed and f not in remote_inputs:
+          remote_inputs[f] = bits
+          guess = self.predicted.pop(f, None)
+          if guess is not None and guess != bits:
+            self._mark_rollback(f)
+      frame += count
+    while self.remote_confirmed + 1 in remote_inputs:
+      self.remote_confirmed += 1
+
+    if offset + _SNAP_HEADER.size <= len(data):
+      snap_frame, base_frame, mask = _SNAP_HEADER.unpack_from(data, offset)
+      offset += _SNAP_HEADER.size
+      base = None
+      if base_frame != NO_FRAME:
+        base = self.remote_snapshots.get(base_frame)
+        if base is None:
+          return     # 基準が手元にない (次の全量送信を待つ)
+      state, offset = decode_snapshot(mask, data, offset, base)
+      self.remote_snapshots[snap_frame] = state
+      for f in [f for f in self.remote_snapshots if f < snap_frame - SNAPSHOT_INTERVAL * 4]:
+        del self.remote_snapshots[f]
+      if self.last_remote_snapshot is None or snap_frame > self.last_remote_snapshot:
+        self.last_remote_snapshot = snap_frame
+      self._check_sync(snap_frame, state)
+
+  def _check_sync(self, snap_frame, state):
+    # 相手プレイヤーの状態は相手が正。確定済みフレームで食い違えば上書きしてやり直す
+    if snap_frame > self.remote_confirmed or snap_frame not in self.snapshots:
+      return
+    if self.rollback_from is not None and self.rollback_from < snap_frame:
+      return     # 巻き戻し待ちで手元の状態が古い (次のパケットで再確認)
+    local_view = self.snapshots[snap_frame][self.remote]
+    if local_view != state:
+      self.desyncs += 1
+      self.snapshots[snap_frame][self.remote] = state
+      self._mark_rollback(snap_frame)
+
+  # --- 計測 ---
+  def stats(self):
+    depths = self.rollback_depths or [0]
+    times = self.resim_times or [0.0]
+    return {
+        "frame": self.frame,
+        "rollback_avg": sum(depths) / len(depths),
+        "rollback_max": max(depths),
+        "resim_ms_avg": sum(times) / len(times),
+        "resim_ms_max": max(times),
+        "stalls": self.stalls,
+        "desyncs": self.desyncs,
+        "bytes_per_packet": self.bytes_sent / max(self.packets_sent, 1),
+    }
+
+  def close(self):
+    self.transport.close()
+
+
+def parse_address(text):
+  # "host:port" または "host" を (host, port) に
+  host, _, port = text.partition(":")
+  # 毎回の sendto で名前解決しないよう IP アドレスにしておく
+  return socket.gethostbyname(host or "127.0.0.1"), int(port) if port else DEFAULT_PORT
+
+
+# --- localhost での検証 ---
+def _scripted_inputs(seed, frames):
+    # 人間っぽく一定時間同じ入力が続く疑似入力列
+  rng = random.Random(seed)
+  inputs = []
+  while len(inputs) < frames:
+    bits = rng.choice((0, INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP,
+                       INPUT_LEFT | INPUT_JUMP, INPUT_RIGHT | INPUT_JUMP))
+    inputs.extend([bits] * rng.randint(3, 40))
+  return inputs[:frames]
+
+
+def run_loopback(frames, latency_ms, jitter_ms, loss, fps=60):
+  import env
+  grid = env.load_grid()
+  player_class = env.sim_player_class()
+
+  host_transport = UdpTransport(0)
+  join_transport = UdpTransport(0, ("127.0.0.1", host_transport.port))
+  sessions = []
+  for index, transport in enumerate((host_transport, join_transport)):
+    lossy = LossyTransport(transport, latency_ms, jitter_ms, loss, seed=index)
+    players = [player_class(grid, 2800.0), player_class(grid, 3200.0)]
+    sessions.append(RollbackSession(players, index, lossy))
+  scripts = [_scripted_inputs(1, frames), _scripted_inputs(2, frames)]
+
+  deadline = time.perf_counter() + 5.0
+  while not all([s.poll_handshake() for s in sessions]):
+    if time.perf_counter() > deadline:
+      print("[ERROR] Handshake timed out")
+      return False
+    time.sleep(0.005)
+
+  frame_time = 1.0 / fps
+  next_tick = time.perf_counter()
+  while any(s.frame < frames for s in sessions):
+    for session, script in zip(sessions, scripts):
+      if session.frame < frames:
+        session.advance(script[session.frame])
+      else:
+        session.pump()
+    if sessions[0].frame % fps == 0:
+      stats = sessions[0].stats()
+      print(f"[INFO] frame {stats['frame']:5d}  rollback avg {stats['rollback_avg']:.2f} "
+            f"max {stats['rollback_max']:2d}  resim avg {stats['resim_ms_avg']:.3f}ms "
+            f"max {stats['resim_ms_max']:.3f}ms")
+    next_tick += frame_time
+    time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+  # 全入力が確定するまで送受信を続けてから、最終状態を突き合わせる
+  deadline = time.perf_counter() + 5.0
+  while any(s.remote_confirmed < frames - 1 for s in sessions):
+    if time.perf_counter() > deadline:
+      print("[ERROR] Inputs were not confirmed in time")
+      return False
+    for session in sessions:
+      session.pump()
+    time.sleep(0.002)
+
+  states = [[capture_state(p) for p in s.players] for s in sessions]
+  for index, session in enumerate(sessions):
+    stats = session.stats()
+    print(f"[INFO] peer {index}: stalls={stats['stalls']} desyncs={stats['desyncs']} "
+          f"bytes/packet={stats['bytes_per_packet']:.1f}")
+  if states[0] == states[1]:
+    print("[INFO] Both peers ended in the same state.")
+    return True
+  print(f"[ERROR] State mismatch: {states[0]} != {states[1]}")
+  return False
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Loopback test for the rollback netcode")
+  parser.add_argument("--frames", type=int, default=900)
+  parser.add_argument("--latency", type=float, default=60.0, help="片道遅延 (ms)")
+  parser.add_argument("--jitter", type=float, default=10.0, help="遅延の揺らぎ (ms)")
+  parser.add_argument("--loss", type=float, default=0.05, help="パケットロス率 (0-1)")
+  args = parser.parse_args()
+  ok = run_loopback(args.frames, args.latency, args.jitter, args.loss)
+  sys.exit(0 if ok else 1)
@@ -0,0 +1,149 @@
+# --- フレームペーシングと入力遅延の計測 ---
+# 待ち方を3種類から選べる:
+#   sleep  : pygame.time.Clock.tick (OS のスリープ、精度は数 ms)
+#   busy   : Clock.tick_busy_loop (CPU を回して待つ、精度は高いが1コア使い切る)
+#   hybrid : 締め切りの少し手前まで眠り、残りは回して待つ
+# あわせて、フレーム間隔のずれ (ジッタ) と、キー入力が画面に出るまでの時間を
+# ヒストグラムに記録する (F3 で表示、--pacing-report で終了時に出力)。
+import time
+
+import pygame
+
+STRATEGIES = ("sleep", "busy", "hybrid")
+HYBRID_SPIN_MS = 2.0       # hybrid でスリープせずに回す時間
+# get_pressed() のキー状態を変えるイベント (入力遅延の計測対象)
+LATENCY_EVENTS = (pygame.KEYDOWN, pygame.KEYUP)
+
+
+class Histogram:
+  # 固定幅のビンで ms の値を数える (メモリは一定、パーセンタイルはビン幅の精度)
+  def __init__(self, bin_ms=0.25, max_ms=100.0):
+    self.bin_ms = bin_ms
+    self.counts = [0] * (int(max_ms / bin_ms) + 1)    # 最後のビンは max_ms 以上
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def add(self, value_ms):
+    index = min(int(value_ms / self.bin_ms), len(self.counts) - 1)
+    self.counts[index] += 1
+    self.count += 1
+    self.total += value_ms
+    self.max = max(self.max, value_ms)
+
+  def mean(self):
+    return self.total / self.count if self.count else 0.0
+
+  def percentile(self, p):
+    # p (0-100) パーセンタイルが入るビンの上端
+    if not self.count:
+      return 0.0
+    target = self.count * p / 100.0
+    seen = 0
+    for index, n in enumerate(self.counts):
+      seen += n
+      if seen >= target:
+        return (index + 1) * self.bin_ms
+    return self.max
+
+  def summary(self):
+    return (f"p50 {self.percentile(50):.2f} p95 {self.percentile(95):.2f} "
+            f"p99 {self.percentile(99):.2f} max {self.max:.2f} ms (n={self.count})")
+
+  def format(self, title, rows=12, width=40):
+    # 終了時の出力用: rows 行にまとめた横棒グラフ
+    lines = [f"{title}: {self.summary()}"]
+    if not self.count:
+      return lines
+    last = max(i for i, n in enumerate(self.counts) if n)
+    per_row = max(1, (last + rows) // rows)
+    for start in range(0, last + 1, per_row):
+      n = sum(self.counts[start:start + per_row])
+      bar = "#" * int(round(width * n / self.count))
+      lines.append(f"  {start * self.bin_ms:6.2f}-{(start + per_row) * self.bin_ms:6.2f} ms "
+                   f"{n:7d} {bar}")
+    return lines
+
+
+class FramePacer:
+  def __init__(self, fps, strategy="sleep", clock=None, late_input=False,
+               spin_ms=HYBRID_SPIN_MS):
+    if strategy not in STRATEGIES:
+      raise ValueError(f"unknown pacing strategy: {strategy}")
+    self.fps = fps
+    self.period = 1.0 / fps
+    self.strategy = strategy
+    self.clock = clock or pygame.time.Clock()
+    self.late_input = late_input    # イベント処理の後でキー状態を読む
+    self.spin = spin_ms / 1000.0
+    self.deadline = None
+
+    self.jitter = Histogram()       # |フレーム間隔 - 目標間隔|
+    self.latency = Histogram()      # キー入力 -> そのキー状態で更新した画面の flip
+    self._last_poll = None
+    self._last_present = None
+    self._pending = []              # 取り出したがまだ keys に反映されていない入力の推定時刻
+    self._visible = []              # 今フレームの keys に反映された入力の推定時刻
+
+  # --- 待ち ---
+  def wait(self, fps=None):
+    # フレームの頭で呼ぶ (fps を指定するとそのフレームだけ目標を変える: 静止画面の間引き)
+    fps = fps or self.fps
+    self.period = 1.0 / fps
+    if self.strategy == "sleep":
+      self.clock.tick(fps)
+    elif self.strategy == "busy":
+      self.clock.tick_busy_loop(fps)
+    else:
+      self._wait_hybrid()
+
+  def _wait_hybrid(self):
+    now = time.perf_counter()
+    if self.deadline is None or now - self.deadline > self.period:
+      # 1フレーム以上遅れたら追いつこうとせず、ここから数え直す
+      self.deadline = now
+    else:
+      remaining = self.deadline - now
+      if remaining > self.spin:
+        time.sleep(remaining - self.spin)
+      while time.perf_counter() < self.deadline:
+        pass
+    self.deadline += self.period
+    self.clock.tick()     # get_fps() 用に Clock も進めておく
+
+  # --- 計測 ---
+  def events_polled(self, events):
+    # pygame.event.get() の直後に呼ぶ。入力の発生時刻は前回の取り出しとの中間と推定する
+    now = time.perf_counter()
+    since = self._last_poll if self._last_poll is not None else now
+    arrival = (since + now) / 2
+    for event in events:
+      if event.type in LATENCY_EVENTS:
+        self._pending.append(arrival)
+    self._last_poll = now
+
+  def keys_sampled(self):
+    # pygame.key.get_pressed() の直後に呼ぶ (それまでに取り出した入力が keys に反映される)
+    self._visible.extend(self._pending)
+    self._pending.clear()
+
+  def frame_presented(self):
+    # pygame.display.flip() の直後に呼ぶ
+    now = time.perf_counter()
+    for arrival in self._visible:
+      self.latency.add((now - arrival) * 1000)
+    self._visible.clear()
+    if self._last_present is not None:
+      self.jitter.add(abs(now - self._last_present - self.period) * 1000)
+    self._last_present = now
+
+  def readout(self):
+    # デバッグ表示用の2行
+    mode = self.strategy + ("+late" if self.late_input else "")
+    return [f"PACE {mode} {self.clock.get_fps():.0f}fps jitter p95 {self.jitter.percentile(95):.1f}ms",
+            f"IN->FLIP p50 {self.latency.percentile(50):.1f} p95 {self.latency.percentile(95):.1f}ms"]
+
+  def report(self):
+    print(f"[INFO] Frame pacing: {self.strategy}, late input {'on' if self.late_input else 'off'}")
+    for line in self.jitter.format("Frame jitter") + self.latency.format("Input to flip"):
+      print(line)
@@ -0,0 +1,121 @@
+# --- シーン管理 ---
+# 画面ごとの処理を Scene の enter / handle_event / update / render / exit に分け、
+# SceneManager が毎フレーム呼び出す。
+# シーンの切り替えはフレームの区切りでだけ行い、どのシーンでもイベント処理を止めない
+# (time.sleep で待つ画面は作らない)。
+import time
+
+import pygame
+
+# 操作があったとみなすイベント (無操作タイムアウトの判定用)
+INPUT_EVENTS = (pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN)
+
+
+class Scene:
+  # 画面の基底クラス。毎フレーム変わらない描画 (背景・文字など) は enter で作っておく
+  idle_timeout = None    # この秒数だけ操作がなければ on_idle を呼ぶ (None なら呼ばない)
+
+  def enter(self, manager):
+    self.manager = manager
+    self.entered_at = time.time()
+
+  def exit(self):
+    pass
+
+  def handle_event(self, event):
+    pass
+
+  def update(self, keys):
+    pass
+
+  def render(self, surface):
+    # 画面全体を描いたら None (flip)、一部だけなら変わった矩形のリストを返す
+    pass
+
+  def frame_rate(self):
+    # このフレームの目標フレームレート (None なら通常の FPS)
+    return None
+
+  def on_idle(self):
+    pass
+
+  def elapsed(self):
+    # enter からの経過秒数
+    return time.time() - self.entered_at
+
+
+class TimedScene(Scene):
+  # duration 秒表示したら next_scene() に進むシーン (None を返したら終了)
+  duration = 3.0
+
+  def next_scene(self):
+    return None
+
+  def update(self, keys):
+    if self.elapsed() >= self.duration:
+      scene = self.next_scene()
+      if scene is None:
+        self.manager.quit()
+      else:
+        self.manager.switch(scene)
+
+
+class SceneManager:
+  def __init__(self, context=None):
+    self.context = context    # シーンをまたいで共有する状態
+    self.scene = None
+    self.running = True
+    self.last_input_time = time.time()
+    self._pending = None
+
+  def start(self, scene):
+    # 最初のシーンにすぐ入る
+    self._pending = scene
+    self._apply()
+
+  def switch(self, scene):
+    # 次の区切り (イベント処理・update の前後) で scene に切り替える
+    self._pending = scene
+
+  def quit(self):
+    self.running = False
+
+  def _apply(self):
+    # enter の中で switch された場合も続けて切り替える
+    while self._pending is not None:
+      scene, self._pending = self._pending, None
+      if self.scene is not None:
+        self.scene.exit()
+      self.scene = scene
+      self.last_input_time = time.time()    # 無操作時間はシーンごとに数え直す
+      scene.enter(self)
+
+  def idle_seconds(self):
+    return time.time() - self.last_input_time
+
+  def handle_event(self, event):
+    self._apply()
+    if event.type in INPUT_EVENTS:
+      self.last_input_time = time.time()
+    self.scene.handle_event(event)
+
+  def update(self, keys):
+    self._apply()
+    self.scene.update(keys)
+    timeout = self.scene.idle_timeout
+    if timeout is not None and self.idle_seconds() >= timeout:
+      self.last_input_time = time.time()
+      self.scene.on_idle()
+    self._apply()
+
+  def render(self, surface):
+    return self.scene.render(surface)
+
+  def frame_rate(self):
+    return self.scene.frame_rate() if self.scene is not None else None
+
+  def close(self):
+    # 終了時に現在のシーンの exit を呼ぶ (ソケットや BGM の後始末)
+    if self.scene is not None:
+      self.scene.exit()
+      self.scene = None
@@ -0,0 +1,319 @@
+# --- 先生のチャット (質問に近い回答を Q&A 集から探す) ---
+# オフラインで索引を作る:
+#   python hisayoshi/teacher.py [--corpus hisayoshi/teacher_qa.jsonl] [--out hisayoshi/teacher.idx]
+# 質問応答ベンチマーク (Q&A の件数ごとの検索時間):
+#   python hisayoshi/teacher.py --bench
+# Q&A 集 (1行1件の JSON: {"q": 質問, "a": 回答}) の文章を、
+# 文字の並び (漢字・カタカナ・英数字のひとまとまり) と文字 2-gram に分けて転置索引にし、
+# BM25 で点数をつけて一番近い回答を返す。日本語は単語の区切りがないので 2-gram で拾う。
+# 索引は固定長の配列を並べたバイナリで、mmap で開いて numpy の配列としてそのまま引く
+# (読み込み時にパースしないので、件数が増えても開くのは一瞬)。
+# ゲームからは TeacherWorker を使い、検索は裏のスレッドで行う (送信でフレームが止まらない)。
+import os
+import re
+import sys
+import mmap
+import json
+import time
+import queue
+import struct
+import hashlib
+import argparse
+import threading
+import unicodedata
+
+import numpy as np
+
+CORPUS_PATH = "./hisayoshi/teacher_qa.jsonl"
+INDEX_PATH = "./hisayoshi/teacher.idx"
+INDEX_MAGIC = b'HTIX'
+INDEX_VERSION = 1
+K1 = 1.2              # BM25: 語の出現回数の効き方
+B = 0.75              # BM25: 文章の長さによる補正の強さ
+QUESTION_WEIGHT = 2   # 質問文の語は回答文の語の何回分に数えるか
+MIN_SCORE = 4.0       # これより低い点数しかなければ「答えなし」(決まり文句で返す)
+
+# magic, version, 予備, 件数, 語の数, ポスティングの数, 平均の長さ
+_HEADER = struct.Struct('<4sHHIIIf')
+
+# 同じ種類の文字のひとまとまり (ひらがなは助詞などが多いので語としては使わない)
+_RUNS = re.compile(r'[a-z0-9]+|[゠-ヿ]+|[一-鿿々]+|[぀-ゟ]+')
+
+
+def tokenize(text):
+  # 文章を索引の語のリストにする (「w:」付きはひとまとまりの語、それ以外は 2-gram / 1文字)
+  text = unicodedata.normalize("NFKC", text).lower()
+  tokens = []
+  for run in _RUNS.findall(text):
+    if len(run) == 1:
+      tokens.append(run)
+      continue
+    if not '぀' <= run[0] <= 'ゟ':
+      tokens.append("w:" + run)
+    tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+  return tokens
+
+
+def term_hash(term):
+  # 語の 64bit ハッシュ (プロセスをまたいで同じ値になるよう hash() は使わない)
+  return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def load_corpus(path=CORPUS_PATH):
+  entries = []
+  with open(path, encoding="utf-8") as f:
+    for number, line in enumerate(f, 1):
+      if not line.strip():
+        continue
+      try:
+        item = json.loads(line)
+        entries.append((item["q"], item["a"]))
+      except (ValueError, KeyError) as e:
+        print(f"[WARNING] {path}:{number}: skipped ({e})")
+  return entries
+
+
+# --- 索引の作成 ---
+def build_index(entries, path=INDEX_PATH):
+  postings = {}     # 語のハッシュ -> {文書番号: 重み付きの出現回数}
+  lengths = np.zeros(len(entries), dtype=np.float32)
+  for doc, (question, answer) in enumerate(entries):
+    counts = {}
+    for tokens, weight in ((tokenize(question), QUESTION_WEIGHT), (tokenize(answer), 1)):
+      for token in tokens:
+        key = term_hash(token)
+        counts[key] = counts.get(key, 0) + weight
+      lengths[doc] += weight * len(tokens)
+    for key, count in counts.items():
+      postings.setdefault(key, {})[doc] = count
+
+  hashes = np.array(sorted(postings), dtype=np.uint64)
+  starts = np.zeros(len(hashes) + 1, dtype=np.uint32)
+  docs = []
+  tfs = []
+  for i, key in enumerate(hashes.tolist()):
+    items = sorted(postings[key].items())
+    docs.extend(d for d, _ in items)
+    tfs.extend(c for _, c in items)
+    starts[i + 1] = len(docs)
+  texts = [answer.encode("utf-8") for _, answer in entries]
+  text_starts = np.zeros(len(texts) + 1, dtype=np.uint32)
+  np.cumsum([len(t) for t in texts], out=text_starts[1:])
+
+  average = float(lengths.mean()) if len(entries) else 0.0
+  tmp = path + ".tmp"
+  with open(tmp, "wb") as f:
+    f.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, len(entries), len(hashes), len(docs), average))
+    for array in (hashes, starts, np.array(docs, dtype=np.uint32), np.array(tfs, dtype=np.float32),
+                  lengths, text_starts):
+      _write_aligned(f, array.tobytes())
+    f.write(b''.join(texts))
+  os.replace(tmp, path)
+  return len(hashes)
+
+
+def _write_aligned(f, data):
+  # numpy の配列として引けるよう、各配列の先頭を 8 バイト境界にそろえる
+  f.write(b'\0' * (-f.tell() % 8))
+  f.write(data)
+
+
+# --- 検索 ---
+class TeacherIndex:
+  def __init__(self, path=INDEX_PATH):
+    with open(path, "rb") as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, _, self.doc_count, terms, count, self.average = _HEADER.unpack_from(self._mmap)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+      self._mmap.close()
+      raise ValueError(f"not a teacher index: {path}")
+    offset = _HEADER.size
+    arrays = []
+    for dtype, n in ((np.uint64, terms), (np.uint32, terms + 1), (np.uint32, count),
+                     (np.float32, count), (np.float32, self.doc_count), (np.uint32, self.doc_count + 1)):
+      offset += -offset % 8
+      arrays.append(np.frombuffer(self._mmap, dtype=dtype, count=n, offset=offset))
+      offset += arrays[-1].nbytes
+    self.hashes, self.starts, self.docs, self.tfs, self.lengths, self.text_starts = arrays
+    self._text_offset = offset
+    # 文書ごとの長さの補正 (BM25 の分母の一部) は先に計算しておく
+    self._norm = K1 * (1 - B + B * self.lengths / max(self.average, 1e-6))
+
+  def close(self):
+    self.hashes = self.starts = self.docs = self.tfs = self.lengths = self.text_starts = None
+    self._mmap.close()
+
+  def answer_text(self, doc):
+    start = self._text_offset + int(self.text_starts[doc])
+    end = self._text_offset + int(self.text_starts[doc + 1])
+    return self._mmap[start:end].decode("utf-8")
+
+  def search(self, text, limit=1):
+    # [(点数, 文書番号)] を点数の高い順に返す
+    terms = {}
+    for token in tokenize(text):
+      key = term_hash(token)
+      terms[key] = terms.get(key, 0) + 1
+    if not terms or not self.doc_count:
+      return []
+    keys = np.array(list(terms), dtype=np.uint64)
+    found = np.searchsorted(self.hashes, keys)
+    found = np.minimum(found, len(self.hashes) - 1)
+    scores = np.zeros(self.doc_count, dtype=np.float32)
+    for key, i in zip(keys.tolist(), found.tolist()):
+      if len(self.hashes) == 0 or int(self.hashes[i]) != key:
+        continue
+      start, end = int(self.starts[i]), int(self.starts[i + 1])
+      docs = self.docs[start:end]
+      tf = self.tfs[start:end]
+      df = end - start
+      idf = np.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+      scores[docs] += terms[key] * idf * tf * (K1 + 1) / (tf + self._norm[docs])
+    if limit == 1:
+      best = int(scores.argmax())
+      return [(float(scores[best]), best)] if scores[best] > 0 else []
+    top = np.argsort(-scores)[:limit]
+    return [(float(scores[d]), int(d)) for d in top if scores[d] > 0]
+
+  def ask(self, text):
+    # 一番近い回答 (点数が MIN_SCORE に届かなければ None)
+    hits = self.search(text)
+    if not hits or hits[0][0] < MIN_SCORE:
+      return None
+    return self.answer_text(hits[0][1])
+
+
+def open_index(index_path=INDEX_PATH, corpus_path=CORPUS_PATH):
+  # 索引を開く。ないか Q&A 集より古ければ作り直す (どちらもなければ None)
+  try:
+    stale = (os.path.exists(corpus_path) and
+             (not os.path.exists(index_path) or
+              os.path.getmtime(index_path) < os.path.getmtime(corpus_path)))
+    if stale:
+      start = time.perf_counter()
+      entries = load_corpus(corpus_path)
+      terms = build_index(entries, index_path)
+      print(f"[INFO] Built teacher index: {len(entries)} entries, {terms} terms "
+            f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+    if not os.path.exists(index_path):
+      print(f"[WARNING] Teacher Q&A not found: {corpus_path}")
+      return None
+    return TeacherIndex(index_path)
+  except (OSError, ValueError, struct.error) as e:
+    print(f"[WARNING] Teacher index is unavailable: {e}")
+    return None
+
+
+class TeacherWorker:
+  # 質問を裏のスレッドで検索する。索引もこのスレッドで開くので、起動も待たせない
+  def __init__(self, index_path=INDEX_PATH, corpus_path=CORPUS_PATH):
+    self.index_path = index_path
+    self.corpus_path = corpus_path
+    self.requests = queue.Queue()    # (質問, 呼び出し側の印)、None で終了
+    self.answers = queue.Queue()     # (呼び出し側の印, 質問, 回答 or None, 検索にかかった ms)
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(target=self._run, name="teacher", daemon=True)
+    self._thread.start()
+
+  def close(self):
+    if self._thread is not None:
+      self.requests.put(None)
+      self._thread.join()
+      self._thread = None
+
+  def ask(self, text, tag=None):
+    # 質問を渡すだけで待たない (回答は poll で受け取る)
+    self.requests.put((text, tag))
+
+  def poll(self):
+    # 届いている回答を全部返す。メインのスレッドから毎フレーム呼ぶ
+    results = []
+    while True:
+      try:
+        results.append(self.answers.get_nowait())
+      except queue.Empty:
+        return results
+
+  def _run(self):
+    index = open_index(self.index_path, self.corpus_path)
+    try:
+      while True:
+        request = self.requests.get()
+        if request is None:
+          break
+        text, tag = request
+        start = time.perf_counter()
+        answer = index.ask(text) if index is not None else None
+        self.answers.put((tag, text, answer, (time.perf_counter() - start) * 1000))
+    finally:
+      if index is not None:
+        index.close()
+
+
+# --- ベンチマーク ---
+def synthetic_corpus(entries, size, rng):
+  # 元の Q&A の文を混ぜ合わせて size 件の Q&A を作る (語の分布を実際の文章に近づける)
+  sentences = [s for _, a in entries for s in re.split(r'(?<=[。！？])', a) if s]
+  questions = [q for q, _ in entries]
+  result = []
+  for _ in range(size):
+    q = " ".join(questions[i] for i in rng.integers(len(questions), size=2))
+    a = "".join(sentences[i] for i in rng.integers(len(sentences), size=3))
+    result.append((q, a))
+  return result
+
+
+def benchmark(sizes, queries, path):
+  entries = load_corpus()
+  rng = np.random.default_rng(0)
+  questions = [q for q, _ in entries]
+  print(f"[INFO] {queries} queries per size")
+  print(f"{'entries':>8} {'build s':>8} {'index MB':>9} {'open ms':>8} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7}")
+  try:
+    for size in sizes:
+      corpus = entries + synthetic_corpus(entries, max(0, size - len(entries)), rng)
+      start = time.perf_counter()
+      build_index(corpus, path)
+      build = time.perf_counter() - start
+      start = time.perf_counter()
+      index = TeacherIndex(path)
+      opened = (time.perf_counter() - start) * 1000
+      times = []
+      for i in range(queries):
+        text = questions[i % len(questions)]
+        start = time.perf_counter()
+        index.ask(text)
+        times.append((time.perf_counter() - start) * 1000)
+      index.close()
+      times = np.array(times)
+      print(f"{len(corpus):>8} {build:>8.2f} {os.path.getsize(path) / 2**20:>9.2f} {opened:>8.2f} "
+            f"{np.percentile(times, 50):>7.3f} {np.percentile(times, 95):>7.3f} {times.max():>7.3f}")
+  finally:
+    if os.path.exists(path):
+      os.remove(path)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Build or benchmark the teacher chat index")
+  parser.add_argument("--corpus", default=CORPUS_PATH)
+  parser.add_argument("--out", default=INDEX_PATH)
+  parser.add_argument("--bench", action="store_true", help="Q&A の件数ごとの検索時間を計測する")
+  parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 4000, 16000, 64000])
+  parser.add_argument("--queries", type=int, default=500)
+  parser.add_argument("--ask", metavar="TEXT", help="索引を作った後に1つ質問してみる")
+  args = parser.parse_args()
+
+  if args.bench:
+    benchmark(args.sizes, args.queries, args.out + ".bench")
+    sys.exit()
+  entries = load_corpus(args.corpus)
+  terms = build_index(entries, args.out)
+  print(f"[INFO] Saved {args.out} ({len(entries)} entries, {terms} terms)")
+  if args.ask:
+    index = TeacherIndex(args.out)
+    for score, doc in index.search(args.ask, limit=3):
+      print(f"  {score:6.2f}  {index.answer_text(doc)[:60]}")
+    index.close()
+  sys.exit()
@@ -0,0 +1,204 @@
+# --- プレイの記録 (テレメトリ) ---
+# ステージ調整用に、高度の推移・着地・ジャンプ台・壁ジャンプ・チャット・フレーム時間を
+# 固定長のバイナリレコードとして残す。
+# ゲームのスレッドは前もって確保したリングバッファに struct.pack_into で書くだけで、
+# ファイルへの書き出し (gzip 圧縮・ファイルの切り替え) は裏のスレッドがまとめて行う。
+# 書き込み側 (ゲーム) と読み出し側 (書き出しスレッド) が1つずつなので、
+# それぞれが自分の位置だけを進めればロックは要らない。
+# 書き出しが追いつかずバッファが一杯のときは待たずに捨て、捨てた数を記録に残す。
+#
+# ファイル形式: gzip の中身が ヘッダ (magic, version, レコード長, 起動時刻) + レコードの列
+import os
+import zlib
+import gzip
+import time
+import struct
+import threading
+
+TELEMETRY_DIR = "./hisayoshi/telemetry"
+TELEMETRY_EXT = ".tlm.gz"
+TELEMETRY_MAGIC = b'HTLM'
+TELEMETRY_VERSION = 1
+RING_CAPACITY = 8192             # レコード数 (= 約 160 KB)
+FLUSH_INTERVAL = 0.25            # 書き出しスレッドが起きる間隔 (秒)
+ROTATE_BYTES = 8 * 1024 * 1024   # 1ファイルあたりの (圧縮前の) 上限
+POSITION_INTERVAL = 6            # 位置を残すフレーム間隔 (10 回/秒)
+
+# レコードの種類
+EVENT_SESSION_START = 1    # value: プレイモード (1 / 2、CPU 対戦は 3)
+EVENT_SESSION_END = 2      # value: プレイ時間 (秒)、player: ゴールしたプレイヤー (0 ならなし)
+EVENT_POSITION = 3         # x, y: 位置、value: 縦速度
+EVENT_LAND = 4             # value: 着地直前の縦速度
+EVENT_PAD = 5              # value: 打ち上げ速度 (青 / 緑で異なる)
+EVENT_WALL_JUMP = 6
+EVENT_CHAT = 7             # value: メッセージの文字数
+EVENT_FRAME_TIME = 8       # value: 1フレームの処理時間 (ms)
+EVENT_DROPPED = 9          # value: 捨てたレコード数 (書き出しスレッドが追加する)
+
+EVENT_NAMES = {
+    EVENT_SESSION_START: "session_start", EVENT_SESSION_END: "session_end",
+    EVENT_POSITION: "position", EVENT_LAND: "land", EVENT_PAD: "pad",
+    EVENT_WALL_JUMP: "wall_jump", EVENT_CHAT: "chat", EVENT_FRAME_TIME: "frame_time",
+    EVENT_DROPPED: "dropped",
+}
+
+RECORD = struct.Struct('<BBHIfff')    # 種類, プレイヤー, セッション番号, フレーム, x, y, value
+_HEADER = struct.Struct('<4sBHd')     # magic, version, レコード長, 起動時刻 (UNIX 時間)
+
+
+class TelemetryWriter:
+  def __init__(self, directory=TELEMETRY_DIR, capacity=RING_CAPACITY,
+               rotate_bytes=ROTATE_BYTES, flush_interval=FLUSH_INTERVAL):
+    self.directory = directory
+    self.capacity = capacity
+    self.rotate_bytes = rotate_bytes
+    self.flush_interval = flush_interval
+    self.started_at = time.time()
+    self.stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started_at))
+
+    self._ring = bytearray(capacity * RECORD.size)
+    self._head = 0       # 書いたレコードの総数 (ゲームのスレッドだけが進める)
+    self._tail = 0       # 書き出したレコードの総数 (書き出しスレッドだけが進める)
+    self.dropped = 0     # 捨てたレコードの総数 (ゲームのスレッドだけが進める)
+    self._dropped_seen = 0
+
+    self.session = 0
+    self.frame = 0
+    self.written = 0
+    self.files = []
+    self._file = None
+    self._file_bytes = 0
+    self._stop = threading.Event()
+    self._thread = None
+
+  # --- ゲームのスレッド側 ---
+  def log(self, kind, player=0, x=0.0, y=0.0, value=0.0):
+    # レコードを1つ追加する (一杯なら捨てて数えるだけで、待たない)
+    head = self._head
+    if head - self._tail >= self.capacity:
+      self.dropped += 1
+      return
+    RECORD.pack_into(self._ring, (head % self.capacity) * RECORD.size,
+                     kind, player, self.session & 0xFFFF, self.frame, x, y, value)
+    self._head = head + 1    # 書き終わってから位置を進める (読み出し側に見えるのはここから)
+
+  def begin_session(self, play_mode):
+    self.session += 1
+    self.frame = 0
+    self.log(EVENT_SESSION_START, value=play_mode)
+
+  def end_session(self, duration, goal_player=0):
+    self.log(EVENT_SESSION_END, goal_player, value=duration)
+
+  def pending(self):
+    return self._head - self._tail
+
+  def readout(self):
+    # デバッグ表示用の1行
+    return (f"TELEM q {self.pending()}/{self.capacity} drop {self.dropped} "
+            f"written {self.written}")
+
+  # --- 書き出しスレッド ---
+  def start(self):
+    self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+    self._thread.start()
+
+  def close(self):
+    # 残りを書き出してファイルを閉じる (終了時に呼ぶ)
+    if self._thread is not None:
+      self._stop.set()
+      self._thread.join()
+      self._thread = None
+    else:
+      self._drain()
+      self._close_file()
+    lost = f", {self.dropped} dropped" if self.dropped else ""
+    print(f"[INFO] Telemetry: {self.written} records in {len(self.files)} file(s){lost}")
+
+  def _run(self):
+    try:
+      while not self._stop.wait(self.flush_interval):
+        self._drain()
+      self._drain()
+    except OSError as e:
+      print(f"[WARNING] Telemetry writer stopped: {e}")
+    finally:
+      self._close_file()
+
+  def _drain(self):
+    head = self._head
+    tail = self._tail
+    if head == tail and self.dropped == self._dropped_seen:
+      return
+    # リングの中身を (折り返しも含めて) 1つのバイト列にまとめてから書く
+    start = (tail % self.capacity) * RECORD.size
+    end = (head % self.capacity) * RECORD.size
+    if head - tail == 0:
+      chunk = b''
+    elif start < end:
+      chunk = bytes(self._ring[start:end])
+    else:
+      chunk = bytes(self._ring[start:]) + bytes(self._ring[:end])
+    self._tail = head     # コピーし終えたのでゲームのスレッドが上書きしてよい
+
+    dropped = self.dropped
+    if dropped != self._dropped_seen:
+      # 捨てた数も記録に残す (集計側で欠けている区間が分かるように)
+      chunk += RECORD.pack(EVENT_DROPPED, 0, self.session & 0xFFFF, self.frame,
+                           0.0, 0.0, dropped - self._dropped_seen)
+      print(f"[WARNING] Telemetry writer fell behind: {dropped - self._dropped_seen} records dropped")
+      self._dropped_seen = dropped
+    self._write(chunk)
+    self.written += len(chunk) // RECORD.size
+
+  def _write(self, chunk):
+    if self._file is None or self._file_bytes >= self.rotate_bytes:
+      self._open_file()
+    self._file.write(chunk)
+    self._file_bytes += len(chunk)
+
+  def _open_file(self):
+    self._close_file()
+    os.makedirs(self.directory, exist_ok=True)
+    path = os.path.join(self.directory,
+                        f"{self.stamp}_{len(self.files):03d}{TELEMETRY_EXT}")
+    self._file = gzip.open(path, "wb", compresslevel=6)
+    self._file.write(_HEADER.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, RECORD.size,
+                                  self.started_at))
+    self._file_bytes = 0
+    self.files.append(path)
+
+  def _close_file(self):
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+
+# --- 読み込み (集計ツール用) ---
+def list_files(directory=TELEMETRY_DIR):
+  if not os.path.isdir(directory):
+    return []
+  return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                if name.endswith(TELEMETRY_EXT))
+
+
+def read_file(path):
+  # (起動時刻, レコードのバイト列) を返す。途中で切れたファイル (強制終了など) は読めた分だけ
+  with open(path, "rb") as f:
+    raw = f.read()
+  decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  data = decompressor.decompress(raw)
+  if len(data) < _HEADER.size:
+    raise ValueError(f"not a telemetry file: {path}")
+  magic, version, record_size, started_at = _HEADER.unpack_from(data)
+  if magic != TELEMETRY_MAGIC or version != TELEMETRY_VERSION or record_size != RECORD.size:
+    raise ValueError(f"not a telemetry file: {path}")
+  body = data[_HEADER.size:]
+  body = body[:len(body) - len(body) % RECORD.size]
+  return started_at, body
+
+
+def iter_records(path):
+  started_at, body = read_file(path)
+  for record in RECORD.iter_unpack(body):
+    yield record
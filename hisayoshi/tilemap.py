@@ -0,0 +1,330 @@
+# --- タイルマップ (map_highres.png の配列表現) ---
+# Player.check_collision / check_special_jump と同じ判定を
+# NumPy 配列上で行うためのヘルパー群。
+# 配列はワールド座標系 (行 = y, 下端が 0) で grid[y, x] と引く。
+import sys
+import math
+import argparse
+
+import numpy as np
+import pygame
+
+TILE_EMPTY = 0
+TILE_SOLID = 1   # 黒 (0, 0, 0): 壁・床
+TILE_BLUE = 2    # 青 (0, 0, 255): ハイジャンプ台
+TILE_GREEN = 3   # 緑 (0, 255, 0): スーパージャンプ台
+
+PAD_NAMES = {TILE_BLUE: 'blue', TILE_GREEN: 'green'}
+
+
+def _classify(r, g, b):
+    # 色の配列からタイルの種類の配列を作る
+  grid = np.zeros(r.shape, dtype=np.uint8)
+  r_zero = r == 0
+  grid[r_zero & (g == 0) & (b == 0)] = TILE_SOLID
+  grid[r_zero & (g == 0) & (b == 255)] = TILE_BLUE
+  grid[r_zero & (g == 255) & (b == 0)] = TILE_GREEN
+  return grid
+
+
+def build_tile_grid(surface):
+    # マップ画像からタイル配列 (uint8, shape=(MAP_HEIGHT, MAP_WIDTH)) を作る
+  if surface.get_bitsize() == 8:
+    # パレット画像 (game.py --palette-map) はパレットの色ごとにタイルを決めて引く
+    palette = np.array([tuple(color)[:3] for color in surface.get_palette()], dtype=np.uint8)
+    table = _classify(palette[:, 0], palette[:, 1], palette[:, 2])
+    indices = pygame.surfarray.pixels2d(surface)
+    try:
+      grid = table[indices]
+    finally:
+      del indices
+  else:
+    rgb = pygame.surfarray.pixels3d(surface)
+    try:
+      grid = _classify(rgb[..., 0], rgb[..., 1], rgb[..., 2])
+    finally:
+      # pixels3d はサーフェスをロックするので確実に解放する
+      del rgb
+  # surfarray は [x, 画像y] なので転置して上下反転 (画像y -> ワールドy)
+  return np.ascontiguousarray(grid.T[::-1])
+
+
+def _box_region(grid, x, y, width, height):
+    # プレイヤー矩形に重なる配列の範囲を返す (マップ外は切り捨て)
+  map_h, map_w = grid.shape
+  left = max(int(x), 0)
+  right = min(int(np.ceil(x + width)), map_w)
+  bottom = max(int(y), 0)
+  top = min(int(np.ceil(y + height)), map_h)
+  return grid[bottom:top, left:right]
+
+
+def grid_collision(grid, x, y, width, height):
+    # Player.check_collision の配列版 (黒ピクセルと重なるか)
+  region = _box_region(grid, x, y, width, height)
+  return bool(region.size) and bool((region == TILE_SOLID).any())
+
+
+def grid_special_jump(grid, x, y, width, height):
+    # Player.check_special_jump の配列版 ('blue' / 'green' / None)
+  region = _box_region(grid, x, y, width, height)
+  if not region.size:
+    return None
+  # 元の実装は x 優先 (列ごとに y を走査) で最初に見つかった色を返す
+  pads = region.T.ravel()
+  hit = np.flatnonzero(pads >= TILE_BLUE)
+  if not hit.size:
+    return None
+  return PAD_NAMES[int(pads[hit[0]])]
+
+
+# --- 接触テーブル (黒ピクセルまでの距離) ---
+# 各画素から、列方向 (上 / 下) と行方向 (左 / 右) に一番近い黒ピクセルまでの距離を
+# uint8 (CONTACT_MAX で頭打ち) で持つ。黒ピクセル自身は 0。
+# 矩形に黒が含まれるかは「各行の左端から右に何 px で黒に当たるか」の最小値で分かるので、
+# Player.check_collision の画素ごとの走査が行数ぶんの配列参照1回になる。
+CONTACT_MAX = 255
+_CHUNK = 256      # テーブルを作るときに一度に処理する行 / 列の数 (一時配列の大きさを抑える)
+
+
+def _distance_table(solid, axis, reverse):
+    # axis 方向に、手前 (reverse なら奥) の一番近い黒までの距離
+  n = solid.shape[axis]
+  shape = [1, 1]
+  shape[axis] = n
+  index = np.arange(n, dtype=np.int32).reshape(shape)
+  far = np.int32(1 << 30)
+  if not reverse:
+    last = np.maximum.accumulate(np.where(solid, index, -far), axis=axis)
+    distance = index - last
+  else:
+    flipped = np.flip(np.where(solid, index, far), axis=axis)
+    distance = np.flip(np.minimum.accumulate(flipped, axis=axis), axis=axis) - index
+  return np.minimum(distance, CONTACT_MAX).astype(np.uint8)
+
+
+def _fill_tables(tables, solid, rows, cols):
+    # solid (ワールド座標の rows x cols の範囲) から4つのテーブルを作って書き込む
+  below, above, left, right = tables
+  r0, r1 = rows
+  c0, c1 = cols
+  for start in range(0, c1 - c0, _CHUNK):
+    part = solid[:, start:start + _CHUNK]
+    below[r0:r1, c0 + start:c0 + start + part.shape[1]] = _distance_table(part, 0, False)
+    above[r0:r1, c0 + start:c0 + start + part.shape[1]] = _distance_table(part, 0, True)
+  for start in range(0, r1 - r0, _CHUNK):
+    part = solid[start:start + _CHUNK]
+    left[r0 + start:r0 + start + part.shape[0], c0:c1] = _distance_table(part, 1, False)
+    right[r0 + start:r0 + start + part.shape[0], c0:c1] = _distance_table(part, 1, True)
+
+
+def _solid_window(surface, cols, rows):
+    # マップ画像のうちワールド座標 rows x cols の範囲の黒ピクセル (ワールド座標の bool 配列)
+  map_h = surface.get_height()
+  area = pygame.Rect(cols[0], map_h - rows[1], cols[1] - cols[0], rows[1] - rows[0])
+  return build_tile_grid(surface.subsurface(area)) == TILE_SOLID
+
+
+class ContactTables:
+  def __init__(self, solid):
+    # solid: ワールド座標 (行 = y、下端が 0) の黒ピクセルの bool 配列
+    self.height, self.width = solid.shape
+    self.below = np.empty(solid.shape, dtype=np.uint8)   # 下 (y が小さい側) の黒まで
+    self.above = np.empty(solid.shape, dtype=np.uint8)   # 上の黒まで
+    self.left = np.empty(solid.shape, dtype=np.uint8)    # 左の黒まで
+    self.right = np.empty(solid.shape, dtype=np.uint8)   # 右の黒まで
+    _fill_tables(self._tables(), solid, (0, self.height), (0, self.width))
+
+  @classmethod
+  def from_surface(cls, surface):
+    return cls(build_tile_grid(surface) == TILE_SOLID)
+
+  def _tables(self):
+    return (self.below, self.above, self.left, self.right)
+
+  def nbytes(self):
+    return sum(table.nbytes for table in self._tables())
+
+  def update_region(self, surface, rect):
+    # マップ画像の rect (画像座標) が変わったときに、影響する範囲だけ作り直す
+    # (距離は CONTACT_MAX で頭打ちなので、その分だけ外側まで見れば正しい値になる)
+    y0 = self.height - rect.bottom
+    y1 = self.height - rect.top
+    x0, x1 = rect.left, rect.right
+    window = (max(0, y0 - CONTACT_MAX), min(self.height, y1 + CONTACT_MAX))
+    solid = _solid_window(surface, (x0, x1), window)
+    part = tuple(np.empty(solid.shape, dtype=np.uint8) for _ in range(4))
+    _fill_tables(part, solid, (0, solid.shape[0]), (0, solid.shape[1]))
+    self.below[y0:window[1], x0:x1] = part[0][y0 - window[0]:]
+    self.above[window[0]:y1, x0:x1] = part[1][:y1 - window[0]]
+
+    window = (max(0, x0 - CONTACT_MAX), min(self.width, x1 + CONTACT_MAX))
+    solid = _solid_window(surface, window, (y0, y1))
+    part = tuple(np.empty(solid.shape, dtype=np.uint8) for _ in range(4))
+    _fill_tables(part, solid, (0, solid.shape[0]), (0, solid.shape[1]))
+    self.left[y0:y1, x0:window[1]] = part[2][:, x0 - window[0]:]
+    self.right[y0:y1, window[0]:x1] = part[3][:, :x1 - window[0]]
+
+  def _span(self, x, y, width, height):
+    # Player.check_collision と同じ丸め方で、矩形が重なる列・行の範囲 (マップ外は切り捨て)
+    left = max(int(x), 0)
+    right = min(int(math.ceil(x + width)), self.width)
+    bottom = max(int(y), 0)
+    top = min(int(math.ceil(y + height)), self.height)
+    return left, right, bottom, top
+
+  def box_hit(self, x, y, width, height):
+    # 矩形に黒ピクセルが含まれるか (Player.check_collision と同じ結果)
+    left, right, bottom, top = self._span(x, y, width, height)
+    if left >= right or bottom >= top:
+      return False
+    return int(self.right[bottom:top, left].min()) < right - left
+
+  def on_ground(self, x, y, width):
+    # 足元 (1 px 下の行) に黒ピクセルがあるか
+    left, right, _, _ = self._span(x, y, width, 0)
+    row = int(y) - 1
+    if left >= right or not 0 <= row < self.height:
+      return False
+    return int(self.below[row, left:right].min()) == 0
+
+  def wall_within(self, x, y, width, height, distance):
+    # 左右それぞれ distance px 以内に壁があるか (左, 右)
+    # (矩形を distance だけずらして box_hit と同じ丸め方で調べる。小数の distance も可)
+    return (self.box_hit(x - distance, y, width, height),
+            self.box_hit(x + distance, y, width, height))
+
+  def free_distance(self, x, y, width, height, direction):
+    # direction ('up' / 'down' / 'left' / 'right') に何 px 動けば黒に触れるか
+    # (CONTACT_MAX 以上は CONTACT_MAX、マップの外側は CONTACT_MAX とみなす)
+    left, right, bottom, top = self._span(x, y, width, height)
+    if direction in ('up', 'down'):
+      row = top if direction == 'up' else int(y) - 1
+      if left >= right or not 0 <= row < self.height:
+        return CONTACT_MAX
+      table = self.above if direction == 'up' else self.below
+      return int(table[row, left:right].min())
+    column = right if direction == 'right' else left - 1
+    if bottom >= top or not 0 <= column < self.width:
+      return CONTACT_MAX
+    table = self.right if direction == 'right' else self.left
+    return int(table[bottom:top, column].min())
+
+
+# --- 接触テーブルの検証 ---
+#   python hisayoshi/tilemap.py [--samples 200000] [--runs 8 --frames 1800]
+# 1. 黒に重なっていない矩形を黒の近くに散らし、テーブルの答えを grid_collision
+#    (= Player.check_collision の画素ループ) で調べた答えと比べる。
+# 2. Player.update をテーブルありとなし (画素ループ) で同じ入力列のまま動かし、
+#    毎フレームの状態 (netplay のスナップショットと同じ項目) が一致するかを比べる。
+WALL_PROBES = (0.2, 1, 3)     # 壁の判定を比べる距離 (0.2 は Player の壁ジャンプ)
+
+
+def _reference_contacts(grid, x, y, width, height):
+  walls = tuple((grid_collision(grid, x - d, y, width, height),
+                 grid_collision(grid, x + d, y, width, height)) for d in WALL_PROBES)
+  standing = grid_collision(grid, x, int(y) - 1, width, height)
+  drop = CONTACT_MAX
+  for d in range(CONTACT_MAX):
+    if grid_collision(grid, x, int(y) - d - 1, width, height):
+      drop = d
+      break
+  return walls, standing, drop
+
+
+def check_contact_tables(surface, samples=200000, width=20, height=30, seed=0):
+  # 食い違った数を {判定: 数} で返す
+  grid = build_tile_grid(surface)
+  tables = ContactTables(grid == TILE_SOLID)
+  rng = np.random.default_rng(seed)
+  solid_y, solid_x = np.nonzero(grid == TILE_SOLID)
+  picks = rng.integers(len(solid_y), size=samples)
+  xs = np.clip(solid_x[picks] + rng.uniform(-width - 4, 4, samples), 0, grid.shape[1] - width)
+  ys = np.clip(solid_y[picks] + rng.uniform(-4, height + 8, samples), 0, None)
+  mismatches = {"box_hit": 0, "wall_within": 0, "on_ground": 0, "free_distance": 0}
+  checked = 0
+  for x, y in zip(xs.tolist(), ys.tolist()):
+    hit = grid_collision(grid, x, y, width, height)
+    mismatches["box_hit"] += tables.box_hit(x, y, width, height) != hit
+    if hit:
+      continue
+    checked += 1
+    walls, standing, drop = _reference_contacts(grid, x, y, width, height)
+    mismatches["wall_within"] += tuple(tables.wall_within(x, y, width, height, d)
+                                       for d in WALL_PROBES) != walls
+    mismatches["on_ground"] += tables.on_ground(x, y, width) != standing
+    mismatches["free_distance"] += tables.free_distance(x, y, width, height, 'down') != drop
+  print(f"[INFO] Checked {samples} boxes ({checked} free): " +
+        " ".join(f"{name} {count}" for name, count in mismatches.items()))
+  return mismatches
+
+
+def _wall_starts(tables, count, seed, width=20, height=30):
+  # 壁のすぐ横 (左右どちらか WALL_PROBES[0] 以内) で黒に重なっていない空中の位置を count 個選ぶ
+  rng = np.random.default_rng(seed)
+  starts = []
+  while len(starts) < count:
+    x = float(rng.uniform(CONTACT_MAX, tables.width - CONTACT_MAX))
+    y = float(rng.uniform(CONTACT_MAX, tables.height - CONTACT_MAX))
+    if tables.box_hit(x, y, width, height) or tables.free_distance(x, y, width, height, 'down') < 8:
+      continue
+    side = 'left' if len(starts) % 2 else 'right'
+    gap = tables.free_distance(x, y, width, height, side)
+    if gap >= 40:
+      continue
+    # 壁までの隙間を詰めて、小数部も残す (丸めの境目を通るように)
+    x += (gap if side == 'right' else -gap) + float(rng.uniform(-0.5, 0.5))
+    if not tables.box_hit(x, y, width, height) and any(tables.wall_within(x, y, width, height, WALL_PROBES[0])):
+      starts.append((x, y))
+  return starts
+
+
+def check_player_parity(runs=8, frames=1800, seed=0):
+  # 食い違った走りの数を返す (game.py を読み込むので、ここで import する)
+  import env
+  import netplay
+  game = env.init_rendering()
+  game.wait_contact_tables()
+  tables = game.contact_tables
+  starts = _wall_starts(tables, runs, seed)
+  failures = wall_jumps = landings = 0
+  try:
+    for run, (start_x, start_y) in enumerate(starts):
+      inputs = netplay._scripted_inputs(seed + run, frames)
+      traces = []
+      for use_tables in (True, False):
+        game.contact_tables = tables if use_tables else None
+        player = game.Player(1, None, None, start_x, None, None)
+        player.y = start_y
+        player.mute = True
+        trace = []
+        for bits in inputs:
+          player.update(netplay.INPUT_KEYS[bits], netplay.NET_CONTROL_MAP)
+          trace.append(netplay.capture_state(player))
+        traces.append(trace)
+      with_tables, pixel_loop = traces
+      for a, b in zip(with_tables, with_tables[1:]):
+        wall_jumps += b[-1] > a[-1]     # 壁ジャンプのクールダウンが始まった
+        landings += b[4] and not a[4]
+      if with_tables != pixel_loop:
+        failures += 1
+        frame = next(i for i, (a, b) in enumerate(zip(*traces)) if a != b)
+        print(f"[ERROR] Run {run} ({start_x:.1f}, {start_y:.1f}) differs at frame {frame}: "
+              f"{with_tables[frame]} != {pixel_loop[frame]}")
+  finally:
+    game.contact_tables = tables
+  print(f"[INFO] Player.update parity: {runs} runs x {frames} frames, {failures} differ "
+        f"({wall_jumps} wall jumps, {landings} landings)")
+  return failures
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="接触テーブルと画素ごとの判定の比較")
+  parser.add_argument("--map", default="./hisayoshi/image/map_highres.png")
+  parser.add_argument("--samples", type=int, default=200000)
+  parser.add_argument("--runs", type=int, default=8, help="Player.update を比べる走りの数")
+  parser.add_argument("--frames", type=int, default=1800)
+  args = parser.parse_args()
+  result = check_contact_tables(pygame.image.load(args.map), args.samples)
+  failures = check_player_parity(args.runs, args.frames)
+  sys.exit(1 if any(result.values()) or failures else 0)
@@ -0,0 +1,130 @@
+# --- 保持型 UI (メニュー画面用) ---
+# 画面全体は一度だけ背景として描き、その後はホバーなどで見た目が変わった
+# ボタンの矩形だけを pygame.display.update(rects) で送る。
+# 何も変わらない間はフレームレートを落とせるよう、最後に変化した時刻を持つ。
+#
+# プレイ中の HUD (タイマー・座標・ラベル) は HudLayer に置く。
+# 部品ごとに前回の値と描いた画像を持ち、値が変わった部品だけを描き直して
+# 1枚の合成用サーフェスにまとめる。毎フレームの仕事は値の比較と、部品がある範囲の blit 1回だけ。
+import time
+
+import pygame
+
+
+class Button:
+  def __init__(self, rect, hover_image, action):
+    self.rect = pygame.Rect(rect)
+    self.hover_image = hover_image    # ホバー中に rect へ重ねる画像 (通常の見た目は背景側)
+    self.action = action
+    self.hovered = False
+
+
+class RetainedScreen:
+  def __init__(self, background):
+    self.background = background
+    self.buttons = []
+    self.dirty = []
+    self.full_redraw = True
+    self.last_change = time.time()
+
+  def add_button(self, rect, hover_image, action):
+    self.buttons.append(Button(rect, hover_image, action))
+
+  def invalidate(self, rect=None):
+    # rect を描き直す (None なら画面全体)
+    if rect is None:
+      self.full_redraw = True
+    else:
+      self.dirty.append(pygame.Rect(rect))
+    self.last_change = time.time()
+
+  def handle_event(self, event):
+    # クリックされたボタンの action を返す
+    if event.type == pygame.MOUSEMOTION:
+      self.update_hover(event.pos)
+    elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+      self.update_hover(event.pos)
+      for button in self.buttons:
+        if button.rect.collidepoint(event.pos):
+          return button.action
+    return None
+
+  def update_hover(self, pos):
+    for button in self.buttons:
+      hovered = button.rect.collidepoint(pos)
+      if hovered != button.hovered:
+        button.hovered = hovered
+        self.invalidate(button.rect)
+
+  def idle_for(self):
+    # 最後に見た目が変わってからの秒数
+    return time.time() - self.last_change
+
+  def render(self, surface):
+    # 画面全体を描いたときは None (flip)、それ以外は送るべき矩形のリストを返す
+    if self.full_redraw:
+      surface.blit(self.background, (0, 0))
+      for button in self.buttons:
+        if button.hovered:
+          surface.blit(button.hover_image, button.rect)
+      self.full_redraw = False
+      self.dirty = []
+      return None
+    rects, self.dirty = self.dirty, []
+    for rect in rects:
+      surface.blit(self.background, rect, rect)
+      for button in self.buttons:
+        if button.hovered and button.rect.colliderect(rect):
+          surface.blit(button.hover_image, button.rect)
+    return rects
+
+
+class HudLayer:
+  def __init__(self, size):
+    self.surface = pygame.Surface(size, pygame.SRCALPHA)    # 部品を合成したもの
+    self.widgets = {}       # 名前 -> (値, 画像, Rect)
+    self.bounds = None      # 部品がある範囲 (blit する範囲)
+    self.dirty = False
+    self.updates = 0        # set を呼んだ回数 (F3 の表示用)
+    self.renders = 0        # そのうち値が変わって部品を描き直した回数
+
+  def set(self, name, value, render, **anchor):
+    # 部品 name の値を value にする。前回と同じなら何もしない
+    # 変わったときだけ render(value) で画像を作り、anchor (topleft=... など) の位置に置く
+    self.updates += 1
+    widget = self.widgets.get(name)
+    if widget is not None and widget[0] == value:
+      return
+    image = render(value)
+    self.widgets[name] = (value, image, image.get_rect(**anchor))
+    self.dirty = True
+    self.renders += 1
+
+  def remove(self, name):
+    if self.widgets.pop(name, None) is not None:
+      self.dirty = True
+
+  def blit(self, target):
+    if self.dirty:
+      self._compose()
+    if self.bounds is not None:
+      target.blit(self.surface, self.bounds.topleft, self.bounds)
+
+  def _compose(self):
+    # 前回の範囲を消して部品を置き直す (透明な下地への blit は部品の画素がそのまま写る)
+    if self.bounds is not None:
+      self.surface.fill((0, 0, 0, 0), self.bounds)
+    rects = []
+    for _, image, rect in self.widgets.values():
+      self.surface.blit(image, rect)
+      rects.append(rect)
+    self.bounds = rects[0].unionall(rects[1:]).clip(self.surface.get_rect()) if rects else None
+    self.dirty = False
+
+
+def hud_readout(layers):
+  # F3 の表示用: 部品の描き直しの回数と、値が変わらず前の画像を使えた set の割合
+  updates = sum(layer.updates for layer in layers)
+  renders = sum(layer.renders for layer in layers)
+  saved = 1 - renders / updates if updates else 0.0
+  return f"HUD renders {renders}/{updates} set ({saved:.0%} cached)"